@@ -0,0 +1,113 @@
+"""
+Benchmark websocket compression (permessage-deflate) for a typical mix
+of messages that the Flexx server sends, to choose the settings of
+``server.configure_compression()``.
+
+The mix consists of the definitions of all flexx.ui classes (DEFINE-JS
+commands, sent when a class is first used), many small signal updates,
+HTML text (e.g. for a Label), and plot data (a list of floats). Each
+message is compressed as permessage-deflate does it, for different
+compression levels, thresholds and with/without context takeover.
+
+Some results on my machine (Linux, Python 3.6), 2168 messages, 0.8 MB:
+
+    level threshold  context   bytes  ratio  CPU [us/msg]
+     none         -        -  808 kB   1.00           0.0
+        1         0      yes  267 kB   0.33          11.2
+        1         0       no  395 kB   0.49          24.2
+        1       256      yes  374 kB   0.46           5.8
+        1       256       no  394 kB   0.49           7.0
+        6         0      yes  215 kB   0.27          25.4
+        6       256       no  362 kB   0.45          17.4
+        9         0      yes  212 kB   0.26          77.7
+
+Compression reduces the bandwidth by a factor 2-4. Level 1 costs less
+than half the CPU of level 6 for about 20% more bytes, which is the
+better trade-off for a server with many clients. With context takeover,
+small messages (most signal updates) compress very well, because they
+resemble earlier messages, so it pays to compress all messages. Without
+context takeover, small messages hardly shrink, and a threshold of a few
+hundred bytes saves CPU at no cost. This is what the server does by
+default (``threshold=None``). Disabling context takeover saves memory
+for servers with many mostly idle connections.
+"""
+
+import json
+import time
+import zlib
+import random
+
+from flexx import ui  # noqa - define widget classes
+from flexx.app import get_model_classes
+from flexx.app.serialize import serializer
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+def get_messages():
+    """ Get a list of bytes messages that represent a typical session.
+    """
+    random.seed(0)
+    messages = []
+    # Class definitions
+    for cls in get_model_classes():
+        messages.append(('DEFINE-JS ' + cls.JS.CODE).encode())
+    # Signal updates
+    template = 'EXEC flexx.instances.%s._set_signal_from_py(%s, %s, 0);'
+    for i in range(2000):
+        value = random.choice([random.random(), random.randint(0, 1000),
+                               'item %i' % i, [random.random(), random.random()]])
+        messages.append((template % ('w%i' % random.randint(1, 50), '"value"',
+                         json.dumps(serializer.saves(value)))).encode())
+    # HTML text
+    for i in range(100):
+        html = ''.join(['<p>Paragraph <b>%i</b>: %s</p>' %
+                        (j, ' '.join(['word%i' % random.randint(0, 99)
+                                      for k in range(20)])) for j in range(10)])
+        messages.append((template % ('w0', '"text"',
+                         json.dumps(serializer.saves(html)))).encode())
+    # Plot data
+    for i in range(40):
+        data = [round(random.gauss(0, 1), 4) for j in range(1000)]
+        messages.append((template % ('w1', '"ydata"',
+                         json.dumps(serializer.saves(data)))).encode())
+    random.shuffle(messages)
+    return messages
+
+
+def compress(messages, level, threshold, context_takeover):
+    """ Compress the messages like permessage-deflate does. Returns
+    the total number of bytes and the CPU time.
+    """
+    nbytes = 0
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    t0 = timer()
+    for message in messages:
+        if len(message) < threshold:
+            nbytes += len(message)
+            continue
+        if not context_takeover:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        data = compressor.compress(message) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        nbytes += len(data) - 4
+    return nbytes, timer() - t0
+
+
+def main():
+    messages = get_messages()
+    total = sum([len(m) for m in messages])
+    print('%i messages, %0.1f MB\n' % (len(messages), total / 1e6))
+    print('%5s %9s %8s %7s %6s %13s' % ('level', 'threshold', 'context',
+                                         'bytes', 'ratio', 'CPU [us/msg]'))
+    print('%5s %9s %8s %4i kB %6.2f %13.1f' % ('none', '-', '-', total / 1000, 1, 0))
+    for level in (1, 6, 9):
+        for threshold in (0, 256, 1024):
+            for context_takeover in (True, False):
+                nbytes, t = compress(messages, level, threshold, context_takeover)
+                print('%5i %9i %8s %4i kB %6.2f %13.1f' %
+                      (level, threshold, 'yes' if context_takeover else 'no',
+                       nbytes / 1000, nbytes / total, t / len(messages) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
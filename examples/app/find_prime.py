@@ -2,7 +2,8 @@
 This example demonstrates how Python code can be run in NodeJS (or
 Firefox), which is for many things faster than CPython. We run the exact
 same code to find the n-th prime on both Python and JS and measure the
-performance.
+performance. The JS version is an offloaded method, which returns a
+future for the result.
 """
 
 from flexx import app
@@ -32,6 +33,7 @@ def _find_prime(self, n):
             primes.append(i)
     t1 = time.perf_counter()
     print(i, 'found in ', t1-t0, 'seconds')
+    return i
 
 
 class PrimeFinder(app.Model):
@@ -39,19 +41,16 @@ class PrimeFinder(app.Model):
     _find_prime = _find_prime
     
     def find_prime_py(self, n):
-        self._find_prime(n)
+        return self._find_prime(n)
     
-    class JS:
-        _find_prime = _find_prime
-        
-    def find_prime_js(self, n):
-        self.call_js('_find_prime(%i)' % n)
+    find_prime_js = app.offload(_find_prime)
 
 
 # Create app instance
 finder = app.launch(PrimeFinder, 'nodejs')  # can also use Firefox or Chrome
 
 finder.find_prime_py(2000)  # 0.7 s
-finder.find_prime_js(2000)  # 0.2 s
+future = finder.find_prime_js(2000)  # 0.2 s
+future.add_done_callback(lambda f: print('The JS result is', f.result()))
 
 app.run()
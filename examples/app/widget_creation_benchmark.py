@@ -0,0 +1,64 @@
+"""
+Benchmark the creation of widgets in a server that has been running
+for a while, i.e. that has many sessions and many assets.
+
+This creates 10k widgets across 1k sessions. Each session also adds an
+asset of its own (like the extra model classes that a session serves),
+so that the global asset store grows as the server ages. The time per
+widget is reported for the first and last group of sessions; it should
+not increase with the number of sessions and assets.
+
+Some results on my machine (Linux, Python 3.6):
+
+    sessions      assets   us/widget
+       0-100         206      1698.4
+    900-1000        2006      1590.1
+
+Before the asset store and session assets used hashing for lookups,
+``use_global_asset()`` sorted the names of all assets in the store for
+each widget, and the time per widget was 1612 us for the first sessions
+and 2013 us at 1k sessions (and kept increasing with the number of
+sessions).
+"""
+
+import time
+
+from flexx import app, ui
+
+timer = getattr(time, 'perf_counter', time.time)
+
+N_SESSIONS = 1000
+N_WIDGETS = 10  # per session
+GROUP = 100  # sessions per measurement
+
+
+def create_session(i):
+    """ Create a session with N_WIDGETS widgets. Returns the time it took.
+    """
+    session = app.Session('benchmark')
+    session._send_command = lambda command: None  # not connected
+    session.add_asset('data.json', ('{"session": %i}' % i).encode())
+    t0 = timer()
+    with ui.HBox(session=session, is_app=True):
+        for j in range(N_WIDGETS - 1):
+            ui.Widget(flex=1)
+    t1 = timer() - t0
+    session.close()
+    return t1
+
+
+def main():
+    print('%12s %11s %11s' % ('sessions', 'assets', 'us/widget'))
+    t = 0.0
+    for i in range(N_SESSIONS):
+        t += create_session(i)
+        if (i + 1) % GROUP == 0:
+            if i + 1 in (GROUP, N_SESSIONS):
+                print('%12s %11i %11.1f' % ('%i-%i' % (i + 1 - GROUP, i + 1),
+                                            len(app.assets.get_asset_names()),
+                                            t / (GROUP * N_WIDGETS) * 1e6))
+            t = 0.0
+
+
+if __name__ == '__main__':
+    main()
@@ -13,17 +13,18 @@ from flexx import app, ui, react
 nsamples = 16
 
 
-@react.source
-def global_cpu_usage(usage):
+# Broadcast signals are serialized once and sent to all subscribed clients
+@app.broadcast
+def global_cpu_usage(usage=0):
     return float(usage)
 
-@react.source
-def global_mem_usage(usage):
+@app.broadcast
+def global_mem_usage(usage=0):
     return float(usage)
 
 def refresh():
-    global_cpu_usage._set(psutil.cpu_percent())
-    global_mem_usage._set(psutil.virtual_memory().percent)
+    global_cpu_usage(psutil.cpu_percent())
+    global_mem_usage(psutil.virtual_memory().percent)
     app.call_later(1, refresh)
 
 refresh()
@@ -47,14 +48,9 @@ class CPUMonitor(ui.Widget):
                                               xdata=[], yrange=(0, 100), 
                                               ylabel='Mem usage (%)')
                 ui.Widget(flex=1)
-    
-    @react.connect('global_cpu_usage')
-    def cpu_usage(self, v):
-        return float(v)
-    
-    @react.connect('global_mem_usage')
-    def mem_usage(self, v):
-        return float(v)
+        
+        app.manager.subscribe(self.session, global_cpu_usage)
+        app.manager.subscribe(self.session, global_mem_usage)
     
     @react.connect('button.mouse_down')
     def _do_work(self, down):
@@ -85,7 +81,7 @@ class CPUMonitor(ui.Widget):
             self.info.text('There are %i connected clients.<br />' % n[0] +
                            'And in total we served %i connections.<br />' % n[1])
         
-        @react.connect('cpu_usage')
+        @react.connect('broadcasts.global_cpu_usage')
         def _update_cpu_usage(self, v):
             import time
             times = self.cpu_plot.xdata()
@@ -97,7 +93,7 @@ class CPUMonitor(ui.Widget):
             self.cpu_plot.xdata(times)
             self.cpu_plot.ydata(usage)
         
-        @react.connect('mem_usage')
+        @react.connect('broadcasts.global_mem_usage')
         def _update_mem_usage(self, v):
             import time
             times = self.mem_plot.xdata()
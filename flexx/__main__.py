@@ -94,6 +94,67 @@ class CLI:
         except FetchError:
             print('There appears to be no local server at port %i' % port)
     
+    def cmd_loadtest(self, *args):
+        """ simulate many clients that connect to an app and update signals.
+        flexx loadtest <url> [--clients N] [--rate R] [--duration S]
+                       [--ramp S] [--signal NAME] [--script FILE] [--model ID]
+        flexx loadtest --serve module:AppClass [--port P] [options]
+        The url is e.g. http://localhost:8080/MyApp/. With --serve, the
+        app is served in this process (using the asyncio backend). The
+        rate is the number of signal updates per second per client. A
+        script is a JSON file with a list of [signal_name, value] pairs.
+        """
+        import json
+        import argparse
+        from flexx.app.loadtest import LoadTest, serve_in_process
+        parser = argparse.ArgumentParser(prog='flexx loadtest')
+        parser.add_argument('url', nargs='?')
+        parser.add_argument('--serve', default=None)
+        parser.add_argument('--port', type=int, default=None)
+        parser.add_argument('--clients', type=int, default=10)
+        parser.add_argument('--rate', type=float, default=1.0)
+        parser.add_argument('--duration', type=float, default=10.0)
+        parser.add_argument('--ramp', type=float, default=1.0)
+        parser.add_argument('--signal', default=None)
+        parser.add_argument('--script', default=None)
+        parser.add_argument('--model', default=None)
+        ns = parser.parse_args(args)
+        if not (ns.url or ns.serve):
+            return self.cmd_help('loadtest')
+        script = None
+        if ns.script:
+            with open(ns.script, 'rb') as f:
+                script = json.loads(f.read().decode())
+        url = ns.url or serve_in_process(ns.serve, port=ns.port)
+        test = LoadTest(url, clients=ns.clients, rate=ns.rate, duration=ns.duration,
+                        ramp=ns.ramp, signal=ns.signal, script=script, model=ns.model)
+        print('Running load test with %i clients on %s' % (test.clients, url))
+        test.run()
+        print(test.report())
+    
+    def cmd_export(self, *args):
+        """ export apps to HTML documents in a directory.
+        flexx export <dirname> module:AppClass [module:AppClass ...]
+                     [--workers N] [--force]
+        The JS and CSS assets are written once, and are shared by the
+        apps. Apps that did not change since the last export to the
+        directory are skipped, unless --force is given.
+        """
+        import argparse
+        from flexx.app import export_many
+        parser = argparse.ArgumentParser(prog='flexx export')
+        parser.add_argument('dirname', nargs='?')
+        parser.add_argument('apps', nargs='*')
+        parser.add_argument('--workers', type=int, default=None)
+        parser.add_argument('--force', action='store_true')
+        ns = parser.parse_args(args)
+        if not (ns.dirname and ns.apps):
+            return self.cmd_help('export')
+        exported = export_many(ns.apps, ns.dirname, workers=ns.workers,
+                               force=ns.force)
+        print('Exported %i apps to %s (%i unchanged)' %
+              (len(exported), ns.dirname, len(ns.apps) - len(exported)))
+    
     def cmd_log(self, port=None, level='info'):
         """ Start listening to log messages from a server process - STUB
         flexx log port level
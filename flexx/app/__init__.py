@@ -16,6 +16,8 @@ Each server process hosts on a single URL (domain+port), but can serve
 multiple applications (via different paths). Each process uses one
 tornado IOLoop (the default one), and exactly one Tornado Application
 object.
+Alternatively, the server can run in an asyncio event loop (see
+``start()``).
 
 Applications
 ------------
@@ -31,7 +33,8 @@ corresponding to the `MyApp` class, one should connect to
 An app can also be launched (via ``app.launch()``), which will invoke
 a client webruntime which is connected to the returned app object. This
 is the intended way to launch desktop-like apps. An app can also be
-exported to HTML via ``app.export()``.
+exported to HTML via ``app.export()``, and many apps can be exported at
+once (e.g. to host them as static files) via ``app.export_many()``.
 
 Further, there is a notion of a default app, intended for interactive use
 and use inside the Jupyter notebook; any ``Model`` instance created
@@ -68,7 +71,7 @@ Overview of classes:
   Assets specific to the session are name-mangled.
 * Session: object that handles connection between Python and JS. Has a
   websocket, and optionally a reference to the runtime.
-* WebSocket: tornado WS handler.
+* WebSocket: tornado WS handler (or its asyncio counterpart).
 * AppManager: keeps track of what apps are registered. Has functionality
   to instantiate apps and connect the websocket to them.
 * Server: handles http requests. Uses manager to create new app
@@ -79,9 +82,10 @@ Overview of classes:
 """
 
 from .session import manager, Session  # noqa
-from .model import Model, get_instance_by_id, get_model_classes  # noqa
+from .model import Model, get_instance_by_id, get_model_classes, broadcast  # noqa
+from .model import offload  # noqa
 from .funcs import run, start, stop, call_later  # noqa
-from .funcs import init_notebook, serve, launch, export  # noqa
+from .funcs import init_notebook, serve, launch, export, export_many, ModelPool  # noqa
 from .assetstore import assets  # noqa
 from .clientcore import FlexxJS  # noqa
 
@@ -18,6 +18,7 @@ are not provided via such a module asset will be added to the index.
 """
 
 import os
+import re
 import sys
 import json
 import time
@@ -28,6 +29,7 @@ from urllib.request import urlopen
 from collections import OrderedDict
 
 from .model import Model, get_model_classes
+from . import metrics
 
 INDEX = """<!doctype html>
 <html>
@@ -139,6 +141,11 @@ def create_css_and_js_from_model_classes(classes, css='', js=''):
     return '\n\n'.join(css) or '\n', '\n\n'.join(js) or '\n'
 
 
+_asset_loads = metrics.Counter('flexx_asset_loads_total',
+                               'Number of loaded assets, by cache result.',
+                               ('result', ))
+
+
 class AssetStore:
     """ Global provider of client assets (CSS, JavaScript, images, etc.).
     
@@ -150,6 +157,7 @@ class AssetStore:
     def __init__(self):
         self._cache = {}
         self._assets = {}
+        self._hashed_names = {}
         self._module_names = []
         self.add_asset('reset.css', RESET.encode())
     
@@ -172,6 +180,11 @@ class AssetStore:
         # Note: order matters not (it does for the session though)
         return list(sorted(self._assets.keys()))
     
+    def has_asset(self, fname):
+        """ Get whether an asset with the given name is present.
+        """
+        return fname in self._assets
+    
     def add_asset(self, fname, content):
         """ Add an asset. Can be JavaScript, CSS, images, etc. 
         
@@ -201,6 +214,30 @@ class AssetStore:
         else:
             raise ValueError('An asset must be str filename or bytes.')
     
+    def remove_asset(self, fname):
+        """ Remove the asset with the given name. Does nothing if the
+        asset is not present.
+        """
+        self._assets.pop(fname, None)
+        self._hashed_names.pop(fname, None)
+    
+    def get_hashed_name(self, fname):
+        """ Get a name for the given asset that includes a hash of its
+        content, e.g. "flexx-app-0a1b2c3d4e5f.js". Such names change
+        when the content changes, so that they can be cached forever.
+        """
+        try:
+            return self._hashed_names[fname]
+        except KeyError:
+            pass
+        part1, dot, part2 = fname.rpartition('.')
+        if not dot:
+            part1, part2 = part2, ''
+        digest = hashlib.sha1(self.load_asset(fname)).hexdigest()[:12]
+        hashed_name = '%s-%s%s%s' % (part1, digest, dot, part2)
+        self._hashed_names[fname] = hashed_name
+        return hashed_name
+    
     def load_asset(self, fname):
         """ Get the asset corresponding to the given name.
         
@@ -215,8 +252,10 @@ class AssetStore:
             raise IndexError('Asset %r not known.' % fname)
         
         if lookslikeafilename(content):
+            _asset_loads.inc(labels=('hit' if content in self._cache else 'miss', ))
             return self._cache_get(content)
         else:
+            _asset_loads.inc(labels=('hit', ))
             return content
     
     def get_module_name_for_model_class(self, cls):
@@ -258,20 +297,46 @@ class AssetStore:
         
         # Create cached assets
         fname = module_name.replace('.', '-')
+        for ext in ('.css', '.js'):
+            self._hashed_names.pop(fname + ext, None)
         self._assets[fname + '.css'] = css_.encode()
         self._assets[fname + '.js'] = js_.encode()
     
-    def export(self, dirname):
-        """ Write all assets to the given directory.
+    def export(self, dirname, names=None, hashed=False):
+        """ Write assets to the given directory.
+        
+        Parameters:
+            dirname (str): the directory to write the assets to.
+            names (list, optional): the names of the assets to write.
+                Default all assets, except the session-specific index
+                assets (which are included in the page).
+            hashed (bool): if True, JS and CSS assets are written under
+                their content-hashed name (see ``get_hashed_name()``),
+                and are not written again if that file already exists.
         """
         # Normalize and check
         if dirname.startswith('~'):  # pragma: no cover
             dirname = os.path.expanduser(dirname)
         if not os.path.isdir(dirname):
             raise ValueError('dirname %r for export is not a directory.' % dirname)
-        # Export all assets
-        for fname in self.get_asset_names():
-            if not fname.startswith('index-'):
+        if names is None:
+            names = [fname for fname in self.get_asset_names()
+                     if not fname.startswith('index-')]
+        # Export assets
+        for fname in names:
+            if hashed and (fname.endswith('.js') or fname.endswith('.css')):
+                filename = os.path.join(dirname, self.get_hashed_name(fname))
+                if os.path.isfile(filename):
+                    continue  # same name, same content
+                # Write to temp file and rename, so that concurrent
+                # exports never see a partial file.
+                tempname = '%s.%i.tmp' % (filename, os.getpid())
+                with open(tempname, 'wb') as f:
+                    f.write(self.load_asset(fname))
+                if sys.platform.startswith('win') and os.path.isfile(filename):
+                    os.remove(filename)  # pragma: no cover - rename won't overwrite
+                os.rename(tempname, filename)
+            else:
                 with open(os.path.join(dirname, fname), 'wb') as f:
                     f.write(self.load_asset(fname))
 
@@ -286,11 +351,12 @@ class SessionAssets:
     def __init__(self, store=None):  # Allow custom store for testing
         self._store = store if (store is not None) else assets
         assert isinstance(self._store, AssetStore)
-        self._asset_names = list()
+        self._asset_names = OrderedDict()  # name -> True, ordered for the page
         self._remote_asset_names = []  # e.g. JS and CSS to load from a CDN
         self._served = False
         self._known_classes = set()  # Cache what classes we know (for performance)
         self._extra_model_classes = []  # Model classes that are not in an asset/module
+        self._own_asset_names = []  # the (mangled) names of assets added by us
         self._id = get_random_string()
     
     @property
@@ -337,7 +403,7 @@ class SessionAssets:
         if fname in self._asset_names:
             return  # ok
         
-        if fname not in self._store.get_asset_names():
+        if not self._store.has_asset(fname):
             raise IndexError('Asset %r is not present in the store.' % fname)
         
         if self._served and (fname.endswith('.js') or fname.endswith('.css')):
@@ -347,10 +413,14 @@ class SessionAssets:
             #logging.warn('Adding asset %r but the page was already "served".' % fname)
         
         if before:
-            index = self._asset_names.index(before)
-            self._asset_names.insert(index, fname)
+            if before not in self._asset_names:
+                raise ValueError('Asset %r is not used by this session.' % before)
+            # Rebuild the ordered dict; this is rare (once per session)
+            names = list(self._asset_names)
+            names.insert(names.index(before), fname)
+            self._asset_names = OrderedDict([(name, True) for name in names])
         else:
-            self._asset_names.append(fname)
+            self._asset_names[fname] = True
     
     def add_asset(self, fname, content, before=None):
         """ Add an asset specific for this session.
@@ -374,8 +444,18 @@ class SessionAssets:
         part1, dot, part2 = fname.rpartition('.')
         fname = '%s-%s%s%s' % (part1, self.id, dot, part2)
         self.add_global_asset(fname, content, before)
+        self._own_asset_names.append(fname)
         return fname
     
+    def _release_index_assets(self):
+        """ Remove the index assets of this session from the store.
+        These are included in the page, so they are not needed anymore
+        once the page is created (e.g. for an export).
+        """
+        for fname in self._own_asset_names:
+            if fname.startswith('index-'):
+                self._store.remove_asset(fname)
+    
     def add_global_asset(self, fname, content, before=None):
         """ Add an asset that is global to this process.
         
@@ -491,21 +571,16 @@ class SessionAssets:
         """
         return self._get_page(single)
     
-    def get_page_for_export(self, commands, single=False):
+    def get_page_for_export(self, commands, single=False, hashed=False):
         """ Get the string for an exported HTML page (to run without a server).
+        If ``hashed`` is True, the page links to JS and CSS assets by their
+        content-hashed name (see ``AssetStore.export()``).
         """
-        # Create lines to init app
-        lines = []
-        lines.append('flexx.is_exported = true;\n')
-        lines.append('flexx.runExportedApp = function () {')
-        lines.extend(['    flexx.command(%s);' % reprs(c) for c in commands])
-        lines.append('};\n')
-        
         # Create an extra asset for the export
-        self.add_asset('index-export.js', '\n'.join(lines).encode())
-        return self._get_page(single)
+        self.add_asset('index-export.js', get_export_js(commands).encode())
+        return self._get_page(single, hashed)
     
-    def _get_page(self, single):
+    def _get_page(self, single, hashed=False):
         """ This code takes the template, the collected JS and CSS, and
         composes an index page to serve/export.
         """
@@ -534,6 +609,8 @@ class SessionAssets:
                     t = "<script>\n/* JS for %s */\n%s\n</script>"
                     content_assets.append(t % (fname, code))
             else:
+                if hashed:
+                    fname = self._store.get_hashed_name(fname)
                 if fname.endswith('.css'):
                     t = "    <link rel='stylesheet' type='text/css' href='%s' />"
                     link_assets.append(t % fname)
@@ -549,6 +626,113 @@ class SessionAssets:
         return src
 
 
+# Code of EXEC commands that can be merged into a construct spec
+_RE_CREATE = re.compile(r'^flexx\.instances\.(\w+) = '
+                        r'new flexx\.classes\.(\w+)\(".*"\);$')
+_RE_SIGNAL = re.compile(r'^flexx\.instances\.(\w+)\._set_signal_from_py\((.*)\);$')
+_RE_CONNECT = re.compile(r'^flexx\.instances\.(\w+)\.connect_signals\(false\);$')
+
+
+def _exec_to_construct(code):
+    """ Get a construct spec that corresponds to the given JS code.
+    """
+    spec = dict(instances=[], steps=[], connect=[])
+    m = _RE_CREATE.match(code)
+    if m:
+        spec['instances'].append([m.group(1), m.group(2)])
+        return spec
+    m = _RE_CONNECT.match(code)
+    if m:
+        spec['connect'].append(m.group(1))
+        return spec
+    m = _RE_SIGNAL.match(code)
+    if m:
+        try:
+            name, txt, esid = json.loads('[%s]' % m.group(2))
+        except ValueError:
+            pass  # more than a signal update
+        else:
+            spec['steps'].append([m.group(1), name, txt, esid])
+            return spec
+    spec['steps'].append(code)
+    return spec
+
+
+def compact_commands(commands):
+    """ Collapse a stream of commands (as recorded by an export) into
+    construct specs (see ``Session._begin_construct()``), so that the
+    client can create the app in one pass. The instances, signal updates
+    and code of subsequent CONSTRUCT and EXEC commands are merged, and
+    only the latest value of each signal is kept. Returns a list of specs
+    (dicts) and the commands that cannot be merged (e.g. DEFINE-JS), in
+    their original order.
+    """
+    result = []
+    spec = signals = None
+    for command in commands:
+        if command.startswith('CONSTRUCT '):
+            new = json.loads(command[10:])
+        elif command.startswith('EXEC '):
+            new = _exec_to_construct(command[5:])
+        else:
+            result.append(command)
+            spec = None
+            continue
+        if spec is None:
+            spec = dict(instances=[], steps=[], connect=[])
+            signals = {}  # (id, name) -> index in steps
+            result.append(spec)
+        spec['instances'].extend(new['instances'])
+        spec['connect'].extend(new['connect'])
+        for step in new['steps']:
+            if not isinstance(step, str):
+                key = step[0], step[1]
+                if key in signals:
+                    spec['steps'][signals[key]] = None
+                signals[key] = len(spec['steps'])
+            spec['steps'].append(step)
+    for spec in result:
+        if isinstance(spec, dict):
+            spec['steps'] = [step for step in spec['steps'] if step is not None]
+    return result
+
+
+def get_command_js(commands, indent=''):
+    """ Get JS code that executes the given commands in the client. The
+    commands are compacted (see ``compact_commands()``) and the specs are
+    included as object literals, with code as functions, so that nothing
+    needs to be parsed or evaluated separately.
+    """
+    lines = []
+    for item in compact_commands(commands):
+        if isinstance(item, dict):
+            steps = []
+            for step in item['steps']:
+                if isinstance(step, str):
+                    steps.append('function () {\n%s\n}' % step)
+                else:
+                    steps.append(reprs(step))
+            lines.append('%sflexx.construct({"instances": %s, "steps": [%s], '
+                         '"connect": %s});' % (indent, reprs(item['instances']),
+                                               ', '.join(steps),
+                                               reprs(item['connect'])))
+        else:
+            lines.append('%sflexx.command(%s);' % (indent, reprs(item)))
+    return '\n'.join(lines)
+
+
+def get_export_js(commands):
+    """ Get the JS to run an exported app, given the commands that
+    the app sent (see ``get_command_js()``).
+    """
+    lines = []
+    lines.append('flexx.is_exported = true;\n')
+    lines.append('flexx.runExportedApp = function () {')
+    lines.append(get_command_js(commands, '    '))
+    lines.append('};\n')
+    return '\n'.join(lines)
+
+
 # Use the system PRNG for session id generation (if possible)
 # NOTE: secure random string generation implementation is adapted
 #       from the Django project. 
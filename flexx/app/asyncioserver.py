@@ -0,0 +1,499 @@
+"""
+Serve web pages and handle websockets using asyncio (from the standard
+library), as an alternative to the Tornado server. This makes it possible
+to run Flexx in the event loop of an existing asyncio application, or
+with an alternative event loop (e.g. uvloop). Select it with
+``app.start(backend='asyncio')``, or by setting the FLEXX_BACKEND
+environment variable to "asyncio".
+
+The server is implemented with asyncio protocols (i.e. callbacks), and
+implements the parts of HTTP/1.1 and of the websocket protocol (RFC 6455)
+that Flexx needs. Websocket messages are not compressed. The logic for
+serving pages and for the Flexx protocol is shared with the Tornado
+server.
+"""
+
+import sys
+import types
+import base64
+import socket
+import struct
+import asyncio
+import hashlib
+import logging
+import functools
+import traceback
+from urllib.parse import parse_qs, unquote
+
+from .tornadoserver import AbstractServer, PageHandlerMixin, WSHandlerMixin
+from .tornadoserver import Heartbeat, port_hash
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'  # from RFC 6455
+
+MAX_HEADER_SIZE = 65536
+MAX_MESSAGE_SIZE = 10 * 1024 * 1024  # same as Tornado
+
+REASONS = {101: 'Switching Protocols', 200: 'OK', 302: 'Found', 400: 'Bad Request',
+           403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed',
+           500: 'Internal Server Error'}
+
+
+class AsyncioServer(AbstractServer):
+    """ Flexx Server implemented with asyncio.
+
+    Parameters:
+        loop (asyncio.AbstractEventLoop, optional): the event loop to
+            use. Default is the current event loop (at the time that the
+            server is opened or used).
+
+    Callbacks passed to ``call_later()`` may be coroutine functions;
+    the coroutine is then run as a task in the event loop.
+    """
+
+    backend = 'asyncio'
+
+    def __init__(self, loop=None):
+        self._loop = loop
+        self._server = None
+        self.heartbeat = AsyncioHeartbeat(self)
+
+    @property
+    def loop(self):
+        """ The asyncio event loop that this server runs in.
+        """
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop()
+        return self._loop
+
+    def open(self, host, port):
+
+        # Check that its not already running
+        if self._server is not None:
+            raise RuntimeError('flexx server is already hosting.')
+
+        # Bind now (find free port number if port not given), so that we
+        # know the port, even if the event loop is not running yet.
+        if port is not None:
+            port = int(port)
+            sock = self._bind(host, port)
+        else:
+            for i in range(100):
+                port = port_hash('flexx%i' % i)
+                try:
+                    sock = self._bind(host, port)
+                    break
+                except OSError:
+                    pass  # address already in use
+            else:
+                raise RuntimeError('Could not bind to free address')
+
+        # Start serving once the event loop runs
+        self._server = self.loop.create_task(
+            self.loop.create_server(lambda: HTTPProtocol(self), sock=sock))
+
+        # Notify address, so its easy to e.g. copy and paste in the browser
+        self.serving_at = host, port
+        print('Serving apps at http://%s:%i/' % (host, port))
+
+    def _bind(self, host, port):
+        family = socket.AF_INET6 if ':' in host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((host, port))
+            sock.listen(128)
+        except OSError:
+            sock.close()
+            raise
+        sock.setblocking(False)
+        return sock
+
+    def start(self):
+        if not self.loop.is_running():
+            self.loop.run_forever()
+
+    def stop(self):
+        """ Stop the server. Thread-safe.
+        """
+        print('Stopping server')
+        self.loop.call_soon_threadsafe(self.heartbeat.stop)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def call_later(self, delay, callback, *args, **kwargs):
+        # Thread-safe, like Tornado's add_callback()
+        func = functools.partial(self._call, callback, args, kwargs)
+        if delay <= 0:
+            self.loop.call_soon_threadsafe(func)
+        else:
+            self.loop.call_soon_threadsafe(self.loop.call_later, delay, func)
+
+    def _call(self, callback, args, kwargs):
+        result = callback(*args, **kwargs)
+        if asyncio.iscoroutine(result):
+            self.loop.create_task(result)
+
+
+class PeriodicTimer:
+    """ Calls a function every interval seconds (like Tornado's
+    PeriodicCallback) until ``stop()`` is called.
+    """
+
+    def __init__(self, loop, callback, interval):
+        self._loop = loop
+        self._callback = callback
+        self._interval = interval
+        self._handle = loop.call_later(interval, self._run)
+
+    def _run(self):
+        self._handle = self._loop.call_later(self._interval, self._run)
+        try:
+            self._callback()
+        except Exception:
+            logging.exception('Exception in periodic callback')
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+
+class AsyncioHeartbeat(Heartbeat):
+    """ Heartbeat that uses the event loop of the given server.
+    """
+
+    def __init__(self, server, *args, **kwargs):
+        self._server = server
+        Heartbeat.__init__(self, *args, **kwargs)
+
+    def _create_timer(self, callback, interval):
+        return PeriodicTimer(self._server.loop, callback, interval)
+
+
+class HTTPProtocol(asyncio.Protocol):
+    """ Handles a connection: parses http requests, and hands the
+    connection to a ``WebSocket`` when the client asks for an upgrade.
+    """
+
+    def __init__(self, server):
+        self.flexx_server = server
+        self.transport = None
+        self._buffer = bytearray()
+        self._ws = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self.transport = None
+        if self._ws is not None:
+            self._ws._connection_lost()
+
+    def pause_writing(self):
+        if self._ws is not None:
+            self._ws._pause_writing()
+
+    def resume_writing(self):
+        if self._ws is not None:
+            self._ws._resume_writing()
+
+    def data_received(self, data):
+        if self._ws is not None:
+            self._ws.data_received(data)
+            return
+        self._buffer.extend(data)
+        while self._ws is None and self.transport is not None:
+            i = self._buffer.find(b'\r\n\r\n')
+            if i < 0:
+                if len(self._buffer) > MAX_HEADER_SIZE:
+                    self._respond(400, {}, b'Request header too large', False)
+                return
+            head = bytes(self._buffer[:i]).decode('latin-1')
+            del self._buffer[:i + 4]
+            self._handle_request(head)
+        if self._ws is not None and self._buffer:
+            data, self._buffer = bytes(self._buffer), bytearray()
+            self._ws.data_received(data)
+
+    def _handle_request(self, head):
+        # Parse request line and headers
+        lines = head.split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            return self._respond(400, {}, b'Invalid request', False)
+        headers = {}
+        for line in lines[1:]:
+            key, _, value = line.partition(':')
+            headers[key.strip().lower()] = value.strip()
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.1':
+            keep_alive = 'close' not in connection
+        else:
+            keep_alive = 'keep-alive' in connection
+        path, _, query = target.partition('?')
+        path = unquote(path)[1:]  # strip leading slash
+
+        if headers.get('upgrade', '').lower() == 'websocket' and path.endswith('/ws'):
+            self._upgrade(path[:-3], headers)
+        elif method not in ('GET', 'HEAD'):
+            self._respond(405, {}, b'Method not allowed', False)
+        elif int(headers.get('content-length', 0) or 0):
+            self._respond(400, {}, b'Request body not supported', False)
+        else:
+            handler = RequestHandler(self.flexx_server, headers, query)
+            try:
+                handler.handle_get(path)
+            except Exception:
+                logging.exception('Uncaught exception in GET %s' % target)
+                handler.send_error(500, exc_info=sys.exc_info())
+            body = handler.get_body() if method == 'GET' else b''
+            self._respond(handler.status, handler.headers, body, keep_alive)
+
+    def _respond(self, status, headers, body, keep_alive):
+        lines = ['HTTP/1.1 %i %s' % (status, REASONS.get(status, 'Unknown'))]
+        headers = dict(headers)
+        headers['Content-Length'] = str(len(body))
+        if not keep_alive:
+            headers['Connection'] = 'close'
+        for key, value in headers.items():
+            lines.append('%s: %s' % (key, value))
+        head = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+        self.transport.write(head + body)
+        if not keep_alive:
+            self.transport.close()
+
+    def _upgrade(self, path, headers):
+        """ Upgrade the connection to a websocket.
+        """
+        key = headers.get('sec-websocket-key', '')
+        if not key or headers.get('sec-websocket-version') != '13':
+            return self._respond(400, {'Sec-WebSocket-Version': '13'},
+                                 b'Invalid websocket request', False)
+        ws = WebSocket(self)
+        if 'origin' in headers and not ws.check_origin(headers['origin']):
+            return self._respond(403, {}, b'Cross origin websockets not allowed', False)
+        accept = hashlib.sha1((key + WS_GUID).encode()).digest()
+        lines = ['HTTP/1.1 101 Switching Protocols',
+                 'Upgrade: websocket',
+                 'Connection: Upgrade',
+                 'Sec-WebSocket-Accept: %s' % base64.b64encode(accept).decode()]
+        self.transport.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        self._ws = ws
+        ws.open(path)
+
+
+class RequestHandler(PageHandlerMixin):
+    """ Collects the response to a single http request, providing the
+    subset of the interface of Tornado's RequestHandler that Flexx uses.
+    """
+
+    def __init__(self, server, headers, query):
+        self.flexx_server = server
+        self.request = types.SimpleNamespace(host=headers.get('host', ''),
+                                             headers=headers)
+        self.status = 200
+        self.headers = {'Content-Type': 'text/html; charset=UTF-8'}
+        self._arguments = parse_qs(query)
+        self._chunks = []
+
+    def get_argument(self, name, default=None):
+        values = self._arguments.get(name, None)
+        return values[-1] if values else default
+
+    def set_header(self, name, value):
+        self.headers[name] = str(value)
+
+    def write(self, chunk):
+        if not isinstance(chunk, bytes):
+            chunk = chunk.encode()
+        self._chunks.append(chunk)
+
+    def redirect(self, url):
+        self.status = 302
+        self.headers['Location'] = url
+
+    def send_error(self, status_code, **kwargs):
+        self.status = status_code
+        self._chunks = []
+        self.headers = {'Content-Type': 'text/html; charset=UTF-8'}
+        self.write_error(status_code, **kwargs)
+
+    def write_error(self, status_code, **kwargs):
+        if status_code == 404:
+            self.write('flexx.ui wants you to connect to root (404)')
+        else:
+            msg = 'Flexx.ui encountered an error: <br /><br />'
+            try:  # try providing a useful message; tough luck if this fails
+                type, value, tb = kwargs['exc_info']
+                tb_str = ''.join(traceback.format_tb(tb))
+                msg += '<pre>%s\n%s</pre>' % (tb_str, str(value))
+            except Exception:
+                pass
+            self.write(msg)
+
+    def get_body(self):
+        return b''.join(self._chunks)
+
+
+def _unmask(mask, data):
+    """ Apply the websocket mask (4 bytes) to the data.
+    """
+    n = len(data)
+    if n == 0:
+        return data
+    key = int.from_bytes((mask * (n // 4 + 1))[:n], 'little')
+    return (int.from_bytes(data, 'little') ^ key).to_bytes(n, 'little')
+
+
+class WebSocket(WSHandlerMixin):
+    """ A websocket connection (server side) that speaks the Flexx protocol.
+    """
+
+    def __init__(self, protocol):
+        self.flexx_server = protocol.flexx_server
+        self.transport = protocol.transport
+        self.close_code = self.close_reason = None
+        self._buffer = bytearray()
+        self._fragments = None  # (opcode, list of payloads) of a fragmented message
+        self._closing = False  # whether we sent a close frame
+        self._closed = False  # whether on_close() was called
+        self._close_timer = None
+        self._drain_future = None  # set while the transport's buffer is full
+
+    def open(self, path):
+        self._open_app(path)
+
+    # --- receiving
+
+    def data_received(self, data):
+        buf = self._buffer
+        buf.extend(data)
+        while len(buf) >= 2 and not self._closed:
+            fin, opcode = buf[0] & 0x80, buf[0] & 0x0f
+            masked, n = buf[1] & 0x80, buf[1] & 0x7f
+            pos = 2
+            if n == 126:
+                if len(buf) < 4:
+                    return
+                n, pos = struct.unpack('!H', buf[2:4])[0], 4
+            elif n == 127:
+                if len(buf) < 10:
+                    return
+                n, pos = struct.unpack('!Q', buf[2:10])[0], 10
+            if not masked:
+                return self._fail(1002, 'Frames from the client must be masked')
+            if n > MAX_MESSAGE_SIZE:
+                return self._fail(1009, 'Message too big')
+            if len(buf) < pos + 4 + n:
+                return
+            mask, payload = bytes(buf[pos:pos + 4]), bytes(buf[pos + 4:pos + 4 + n])
+            del buf[:pos + 4 + n]
+            self._handle_frame(fin, opcode, _unmask(mask, payload))
+
+    def _handle_frame(self, fin, opcode, payload):
+        if opcode == 0x8:  # close
+            if len(payload) >= 2:
+                self.close_code = struct.unpack('!H', payload[:2])[0]
+                self.close_reason = payload[2:].decode('utf-8', 'replace')
+            if not self._closing:
+                self._closing = True
+                self._send_frame(0x8, payload[:2])  # echo
+            self.transport.close()
+        elif opcode == 0x9:  # ping
+            if not self._closing:
+                self._send_frame(0xA, payload)
+        elif opcode == 0xA:  # pong
+            self.on_pong(payload)
+        elif opcode in (0x0, 0x1, 0x2):  # continuation, text, binary
+            if (opcode == 0x0) != (self._fragments is not None):
+                return self._fail(1002, 'Unexpected continuation frame')
+            if opcode:
+                self._fragments = opcode, [payload], len(payload)
+            else:
+                opcode, parts, size = self._fragments
+                self._fragments = opcode, parts + [payload], size + len(payload)
+                if size + len(payload) > MAX_MESSAGE_SIZE:
+                    return self._fail(1009, 'Message too big')
+            if fin:
+                opcode, parts, size = self._fragments
+                self._fragments = None
+                message = b''.join(parts)
+                if opcode == 0x1:
+                    try:
+                        message = message.decode('utf-8')
+                    except UnicodeDecodeError:
+                        return self._fail(1007, 'Invalid UTF-8')
+                try:
+                    self.on_message(message)
+                except Exception:
+                    logging.exception('Uncaught exception in websocket message handler')
+        else:
+            self._fail(1002, 'Unknown opcode %i' % opcode)
+
+    def _fail(self, code, reason):
+        logging.warn('Closing websocket: %s' % reason)
+        self._buffer.clear()
+        self.close(code, reason)
+
+    # --- sending
+
+    def _send_frame(self, opcode, payload):
+        n = len(payload)
+        if n < 126:
+            header = struct.pack('!BB', 0x80 | opcode, n)
+        elif n < 65536:
+            header = struct.pack('!BBH', 0x80 | opcode, 126, n)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 127, n)
+        self.transport.write(header + payload)
+
+    def command(self, cmd):
+        """ Send a command. Returns a Future that resolves when the data
+        has been written, or None if it can be written right away.
+        """
+        if not isinstance(cmd, bytes):
+            cmd = cmd.encode()
+        if self._closing or self.transport is None or self.transport.is_closing():
+            raise RuntimeError('Websocket is closed.')
+        self._count_command(cmd)
+        self._send_frame(0x2, cmd)
+        return self._drain_future
+
+    def ping(self, data):
+        if self._closing or self.transport is None:
+            raise RuntimeError('Websocket is closed.')
+        self._send_frame(0x9, data)
+
+    def close(self, code=None, reason=None):
+        """ Start the closing handshake. The connection is closed when the
+        client responds, or after 5 seconds.
+        """
+        if self._closing or self.transport is None:
+            return
+        self._closing = True
+        payload = b''
+        if code is not None:
+            payload = struct.pack('!H', code) + (reason or '').encode()[:123]
+        self._send_frame(0x8, payload)
+        self._close_timer = self.flexx_server.loop.call_later(5, self.transport.close)
+
+    # --- connection state
+
+    def _pause_writing(self):
+        if self._drain_future is None:
+            self._drain_future = self.flexx_server.loop.create_future()
+
+    def _resume_writing(self):
+        future, self._drain_future = self._drain_future, None
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    def _connection_lost(self):
+        self.transport = None
+        self._resume_writing()
+        if self._close_timer is not None:
+            self._close_timer.cancel()
+            self._close_timer = None
+        if not self._closed:
+            self._closed = True
+            self.on_close()
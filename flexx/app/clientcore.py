@@ -5,6 +5,7 @@ The client's core Flexx engine, implemented in PyScript.
 from ..pyscript import py2js, undefined, window
 
 flexx_session_id = location = root = module = typeof = None  # fool PyFlakes
+flexx_ws_options = None  # set by the nodejs launcher (in funcs.py)
 
 
 @py2js(inline_stdlib=False)
@@ -24,6 +25,12 @@ class FlexxJS:
         self.is_exported = False
         self.classes = {}
         self.instances = {}
+        self._send_queue = []  # messages to send in the next iteration
+        self.last_seq = 0  # number of messages received from the server
+        self.resume_timeout = 0  # set by the server if the session is resumable
+        self._resume_deadline = None  # set while trying to resume
+        self._resume_delay = 0
+        self._broadcasts = None  # signal holding the broadcast signals
         if typeof(window) is 'undefined' and typeof(module) is 'object':
             # nodejs (call exit on exit and ctrl-c
             root.window = root  # create alias
@@ -51,8 +58,9 @@ class FlexxJS:
         
     def exit(self):
         """ Called when runtime is about to quit. """
+        self.resume_timeout = 0  # don't reconnect
         if self.ws:  # is not null or undefined
-            self.ws.close()
+            self.ws.close(1000)
             self.ws = None
     
     def get(self, id):
@@ -80,19 +88,35 @@ class FlexxJS:
             if (WebSocket is undefined):
                 window.document.body.innerHTML = 'Browser does not support WebSockets'
                 raise "FAIL: need websocket"
-        # Open web socket in binary mode
-        self.ws = ws = WebSocket(window.flexx.ws_url)
+        # Open web socket in binary mode. In nodejs, the options (e.g. for
+        # compression) are set by the flexx nodejs runtime.
+        if self.nodejs and typeof(flexx_ws_options) is not 'undefined':
+            self.ws = ws = WebSocket(window.flexx.ws_url, flexx_ws_options)
+        else:
+            self.ws = ws = WebSocket(window.flexx.ws_url)
         ws.binaryType = "arraybuffer"
         
         def on_ws_open(evt):
             window.console.info('Socket connected')
-            ws.send('hiflexx ' + window.flexx_session_id)
+            if window.flexx._resume_deadline is None:
+                ws.send('hiflexx ' + window.flexx_session_id)
+            else:
+                # Resume; the server resends the messages that we missed
+                ws.send('hiflexx %s %i' % (window.flexx_session_id,
+                                           window.flexx.last_seq))
+                window.flexx._resume_deadline = None
+            window.flexx._flush_send_queue()
         def on_ws_message(evt):
+            window.flexx.last_seq += 1
             window.flexx.last_msg = evt.data or evt
             msg = window.flexx.decodeUtf8(window.flexx.last_msg)
             window.flexx.command(msg)
         def on_ws_close(evt):
             self.ws = None
+            code = evt.code if (evt and evt.code) else 0
+            if window.flexx._resume(code):
+                window.console.info('Lost connection with server, reconnecting')
+                return
             msg = 'Lost connection with server'
             if evt and evt.reason:  # nodejs-ws does not have it?
                 msg += ': %s (%i)' % (evt.reason, evt.code)
@@ -116,6 +140,117 @@ class FlexxJS:
             ws.onclose = on_ws_close
             ws.onerror = on_ws_error
     
+    def _resume(self, code):
+        """ Try to reconnect after the connection was lost, if the session
+        is resumable and the timeout has not passed. Returns whether
+        we are reconnecting.
+        """
+        if self.resume_timeout <= 0 or [1000, 1001, 1003, 1008].indexOf(code) >= 0:
+            return False
+        now = window.Date.now()
+        if self._resume_deadline is None:
+            self._resume_deadline = now + self.resume_timeout * 1000
+            self._resume_delay = 250
+        elif now > self._resume_deadline:
+            self._resume_deadline = None
+            return False
+        # Back off exponentially, with jitter, so that the clients that lost
+        # their connection at the same time do not all reconnect at once
+        delay = self._resume_delay * (0.5 + window.Math.random())
+        self._resume_delay = window.Math.min(self._resume_delay * 2, 5000)
+        window.setTimeout(self.initSocket, delay)
+        return True
+    
+    def can_send(self):
+        """ Whether messages can be sent to the server, now or after
+        reconnecting.
+        """
+        return self.ws is not None or self._resume_deadline is not None
+    
+    def send(self, msg):
+        """ Send a message to the server. Messages that are sent in the
+        same event loop iteration are batched into a single websocket
+        message. While reconnecting, messages are kept until the
+        connection is restored.
+        """
+        if not self.can_send():
+            return
+        self._send_queue.append(msg)
+        if len(self._send_queue) == 1:
+            window.setTimeout(self._flush_send_queue, 0)
+    
+    def _flush_send_queue(self):
+        if self.ws is None or self.ws.readyState == 0:
+            if self._resume_deadline is None:
+                self._send_queue = []
+            return  # sent when the connection is (re)established
+        queue = self._send_queue
+        self._send_queue = []
+        if len(queue) == 0:
+            return
+        elif len(queue) == 1:
+            self.ws.send(queue[0])
+        else:
+            self.ws.send('MULTI ' + window.JSON.stringify(queue))
+    
+    def call_on_frame(self, func):
+        """ Call the given function right before the next repaint. In
+        environments without animation frames (e.g. nodejs), the function
+        is called after approximately 16 ms.
+        """
+        if typeof(window.requestAnimationFrame) is 'function':
+            window.requestAnimationFrame(func)
+        else:
+            window.setTimeout(func, 16)
+    
+    def call_on_idle(self, func):
+        """ Call the given function when the client is idle, but within
+        one second. Falls back to a short timeout if idle callbacks are
+        not supported.
+        """
+        if typeof(window.requestIdleCallback) is 'function':
+            window.requestIdleCallback(func, {'timeout': 1000})
+        else:
+            window.setTimeout(func, 100)
+    
+    def _create_signal(self, hub, name):
+        func = lambda v: v
+        func._name = name
+        signal = hub._create_SourceSignal(func, [], None)
+        signal.flags = {}
+        signal.connect(False)
+        return signal
+    
+    def get_broadcasts(self):
+        """ Get the signal of which the value is an object that maps
+        names to broadcast signals. Models can connect to a broadcast
+        signal via 'broadcasts.<name>'; they (re)connect automatically
+        when the broadcast becomes available.
+        """
+        if self._broadcasts is None:
+            hub = window.flexx.classes.HasSignals()
+            self._broadcasts = self._create_signal(hub, 'broadcasts')
+            self._broadcasts._hub = hub
+            self._broadcasts._set({})
+        return self._broadcasts
+    
+    def set_broadcast(self, name, text):
+        """ Set the value of a broadcast signal, creating it if needed.
+        """
+        value = window.flexx.serializer.loads(text)
+        broadcasts = self.get_broadcasts()
+        signal = broadcasts._value[name]
+        if signal is undefined:
+            signal = self._create_signal(broadcasts._hub, name)
+            signal._set(value)
+            d = {}
+            for key in broadcasts._value.keys():
+                d[key] = broadcasts._value[key]
+            d[name] = signal
+            broadcasts._set(d)  # downstream signals reconnect
+        else:
+            signal._set(value)
+    
     def initLogging(self):
         """ Setup logging so that messages are proxied to Python.
         """
@@ -129,20 +264,16 @@ class FlexxJS:
         
         def log(self, msg):
             window.console.ori_log(msg)
-            if window.flexx.ws is not None:
-                window.flexx.ws.send("PRINT " + msg)
+            window.flexx.send("PRINT " + msg)
         def info(self, msg):
             window.console.ori_info(msg)
-            if window.flexx.ws is not None:
-                window.flexx.ws.send("INFO " + msg)
+            window.flexx.send("INFO " + msg)
         def warn(self, msg):
             window.console.ori_warn(msg)
-            if window.flexx.ws is not None:
-                window.flexx.ws.send("WARN " + msg)
+            window.flexx.send("WARN " + msg)
         def error(self, msg):
             window.console.ori_error(msg)
-            if window.flexx.ws is not None:
-                window.flexx.ws.send("ERROR " + msg)
+            window.flexx.send("ERROR " + msg)
         def on_error(self, evt):
             msg = evt.message
             if evt.error.stack:
@@ -171,9 +302,13 @@ class FlexxJS:
             window.console.ori_log(msg[6:])
         elif msg.startswith('EVAL '):
             window._ = eval(msg[5:])
-            window.flexx.ws.send('RET ' + window._)  # send back result
+            self.send('RET ' + window._)  # send back result
         elif msg.startswith('EXEC '):
             eval(msg[5:])  # like eval, but do not return result
+        elif msg.startswith('RESUME '):
+            self.resume_timeout = float(msg[7:])
+        elif msg.startswith('CONSTRUCT '):
+            self.construct(window.JSON.parse(msg[10:]))
         elif msg.startswith('DEFINE-JS '):
             eval(msg[10:])
             #el = window.document.createElement("script")
@@ -185,6 +320,9 @@ class FlexxJS:
             el.type = "text/css"
             el.innerHTML = msg[11:]
             window.document.body.appendChild(el)
+        elif msg.startswith('BROADCAST '):
+            i = msg.indexOf(' ', 10)
+            self.set_broadcast(msg[10:i], msg[i+1:])
         elif msg.startswith('TITLE '):
             if not self.nodejs:
                 window.document.title = msg[6:]
@@ -200,6 +338,25 @@ class FlexxJS:
         else:
             window.console.warn('Invalid command: "' + msg + '"')
     
+    def construct(self, spec):
+        """ Construct a tree of Model instances in a single pass: create
+        all instances, apply the signal values and execute code (in
+        order), and then connect the signals of the given instances.
+        Code is a string, or a function in exported apps.
+        """
+        for item in spec.instances:
+            Cls = self.classes[item[1]]
+            self.instances[item[0]] = Cls(item[0])
+        for step in spec.steps:
+            if typeof(step) is 'string':
+                eval(step)
+            elif typeof(step) is 'function':
+                step()  # code in an exported app
+            else:
+                self.instances[step[0]]._set_signal_from_py(step[1], step[2], step[3])
+        for id in spec.connect:
+            self.instances[id].connect_signals(False)
+    
     def decodeUtf8(self, arrayBuffer):
         """
         var result = "",
@@ -3,14 +3,20 @@ Functional API for flexx.app
 """
 
 import os
+import sys
 import json
+import hashlib
+import inspect
 import logging
+import importlib
+import multiprocessing
 
 from .. import webruntime
 from .. import react
 
 from .model import Model
 from .session import manager
+from .assetstore import assets, get_command_js
 from .tornadoserver import server
 
 
@@ -18,13 +24,13 @@ reprs = json.dumps
 
 ## Main loop functions
 
-def _server_open(host=None, port=None):
+def _server_open(host=None, port=None, backend=None):
     """ Server.open() but with handling of defaults, and checking if
     already serving.
     """
     # If already hosting, return or error
     if getattr(server, '_is_hosting', False):
-        if host is None and port is None:
+        if host is None and port is None and backend in (None, server.backend):
             return
         else:
             raise RuntimeError('Already hosting')
@@ -33,12 +39,35 @@ def _server_open(host=None, port=None):
         host = os.getenv('FLEXX_HOSTNAME', 'localhost')
     if port is None:
         port = os.getenv('FLEXX_PORT', None)
+    if backend is None:
+        backend = os.getenv('FLEXX_BACKEND', server.backend)
+    if backend != server.backend:
+        _use_backend(backend)
     # Start hosting
     server.open(host, port)
     server._is_hosting = True
 
 
-def start(host=None, port=None):
+def _use_backend(backend):
+    """ Replace the global server with one of the given backend.
+    """
+    global server
+    if backend == 'tornado':
+        from .tornadoserver import server as new_server
+    elif backend == 'asyncio':
+        from .asyncioserver import AsyncioServer
+        new_server = AsyncioServer()
+    else:
+        raise ValueError('Unknown server backend %r, use "tornado" or "asyncio".'
+                         % backend)
+    new_server._auto_stop = server._auto_stop
+    server = new_server
+    # Pools are filled via call_later(), reschedule in the new event loop
+    for name in manager._pools:
+        manager._schedule_pool_fill(name, 0)
+
+
+def start(host=None, port=None, backend=None):
     """ Start the server and event loop if not already running.
     
     This function generally does not return until the application is
@@ -46,8 +75,8 @@ def start(host=None, port=None):
     environments (e.g. Spyder, IEP, Jupyter notebook), so the caller
     should take into account that the function may return immediately.
     
-    The host and port can also be specified using environment variables
-    FLEXX_HOSTNAME and FLEXX_PORT.
+    The host, port and backend can also be specified using environment
+    variables FLEXX_HOSTNAME, FLEXX_PORT and FLEXX_BACKEND.
     
     Arguments:
         host (str): The hostname to serve on. Default 'localhost'. This
@@ -55,9 +84,13 @@ def start(host=None, port=None):
         port (int, str): The port number. If a string is given, it is
             hashed to an ephemeral port number. If not given or None,
             will try a series of ports until one is found that is free.
+        backend (str): The server implementation: 'tornado' (default)
+            or 'asyncio'. The asyncio backend runs in the current asyncio
+            event loop, so that Flexx can be combined with other asyncio
+            code. It cannot be changed once the server is running.
     """
     # Get server up
-    _server_open(host, port)
+    _server_open(host, port, backend)
     # Start event loop
     server.start()
 
@@ -105,16 +138,15 @@ def _auto_closer(name):
 def init_notebook():
     """ Initialize the Jupyter notebook by injecting the necessary CSS
     and JS into the browser.
+    
+    The commands for the browser are collected during the execution of
+    a cell, and are then injected as a single JavaScript output, to keep
+    the notebook (and its nbconverted version) small and fast to render.
     """
     
+    from IPython import get_ipython
     from IPython.display import display, Javascript, HTML
     
-    # todo: ideally you don't want user interactions done this way:
-    # they result in spamming of JavaScript "objects" and when nbconverting,
-    # this will result in a huge number of output_javascript elements.
-    def my_send_command(command):
-        display(Javascript('flexx.command(%s);' % reprs(command)))
-    
     # Create default session and monkey-patch it
     # Not very pretty, but this keeps notebook logic confined to this module/function.
     session = manager.get_default_session()
@@ -122,8 +154,13 @@ def init_notebook():
         display(HTML("<i>Flexx already loaded</i>"))
         return  # Don't inject twice
     else:
+        buffer = NotebookCommandBuffer(lambda js: display(Javascript(js)))
+        ip = get_ipython()
+        if ip is not None:
+            ip.events.register('pre_execute', buffer.pre_execute)
+            ip.events.register('post_execute', buffer.post_execute)
         session._original_send_command = session._send_command
-        session._send_command = my_send_command
+        session._send_command = buffer.send_command
         try:
             session.use_global_asset('phosphor-all.js')
             session.use_global_asset('flexx-ui.css')
@@ -150,21 +187,41 @@ def init_notebook():
     display(HTML(t))
 
 
-def serve(cls):
+def serve(cls=None, pool_size=None, pool_max_age=None):
     """ Serve the given Model class as a web app. Can be used as a decorator.
     
     This registers the given class with the internal app manager. The
     app can be loaded via 'http://hostname:port/classname'.
     
+    For apps that take long to instantiate, a pool of pre-built
+    sessions can be used, so that pages are served without delay.
+    The pool is filled in the background, during idle time of the
+    event loop. Each session in the pool holds a (not yet connected)
+    app instance, so this costs memory.
+    
     Arguments:
         cls (Model): a subclass of ``app.Model`` (or ``ui.Widget``).
+        pool_size (int, optional): the number of pre-built sessions to
+            keep ready. Default no pool.
+        pool_max_age (float, optional): the maximum age (in seconds) of
+            a pooled session, after which it is replaced. Default 300.
     
     Returns:
         cls: The given class.
+    
+    Example:
+    
+    .. code-block:: py
+    
+        @app.serve(pool_size=4)
+        class HeavyApp(ui.Widget):
+            ...
     """
+    if cls is None:
+        return lambda cls: serve(cls, pool_size, pool_max_age)
     # Note: this talks to the manager; it has nothing to do with the server
     assert isinstance(cls, type) and issubclass(cls, Model)
-    manager.register_app_class(cls)
+    manager.register_app_class(cls, pool_size, pool_max_age)
     return cls
 
 
@@ -194,8 +251,11 @@ def launch(cls, runtime='xul', **runtime_kwargs):
     host, port = server.serving_at
     if runtime == 'nodejs':
         all_js = session.get_js_only()
+        ws_options = json.dumps(server.get_client_ws_options())
+        all_js = 'var flexx_ws_options = %s;\n%s' % (ws_options, all_js)
         url = '%s:%i/%s/' % (host, port, session.app_name)
-        session._runtime = launch('http://' + url, runtime=runtime, code=all_js)
+        session._runtime = launch('http://' + url, runtime=runtime, code=all_js,
+                                  **runtime_kwargs)
     else:
         url = '%s:%i/%s/?session_id=%s' % (host, port, session.app_name, session.id)
         session._runtime = launch('http://' + url, runtime=runtime, **runtime_kwargs)
@@ -203,6 +263,72 @@ def launch(cls, runtime='xul', **runtime_kwargs):
     return session.app
 
 
+class ModelPool:
+    """ A pool of instances of a Model class, each launched in its own
+    runtime, to run offloaded methods (see ``offload()``) in parallel.
+    
+    Arguments:
+        cls (type): a subclass of ``app.Model``.
+        size (int): the number of instances (and runtimes). Default 2.
+        runtime (str): the runtime to launch the instances in. Default
+            'nodejs'.
+        runtime_kwargs: kwargs to pass to ``launch()``, e.g. ``pool=True``
+            to take the nodejs processes from a pool.
+    
+    Example:
+    
+        .. code-block:: py
+        
+            pool = app.ModelPool(PrimeFinder, 4)
+            futures = [pool.submit('count_primes', n) for n in (1000, 2000)]
+    """
+    
+    def __init__(self, cls, size=2, runtime='nodejs', **runtime_kwargs):
+        if size < 1:
+            raise ValueError('ModelPool needs at least one instance.')
+        self._models = [launch(cls, runtime, **runtime_kwargs)
+                        for i in range(size)]
+        self._pending = [0 for model in self._models]
+    
+    def __repr__(self):
+        return '<ModelPool with %i instances, %i pending calls at 0x%x>' % (
+            len(self._models), sum(self._pending), id(self))
+    
+    @property
+    def models(self):
+        """ The Model instances in this pool.
+        """
+        return tuple(self._models)
+    
+    def submit(self, name, *args):
+        """ Call the offloaded method with the given name on the instance
+        that has the fewest pending calls (skipping instances of which the
+        session is closed). Returns a Future.
+        """
+        if not self._models:
+            raise RuntimeError('ModelPool is closed.')
+        alive = [i for i, model in enumerate(self._models) if not model.session._closed]
+        if not alive:
+            raise RuntimeError('The sessions of all ModelPool instances are closed.')
+        i = min(alive, key=lambda i: self._pending[i])
+        method = getattr(self._models[i], name)
+        future = method(*args)
+        self._pending[i] += 1
+        
+        def done(future):
+            self._pending[i] -= 1
+        
+        future.add_done_callback(done)
+        return future
+    
+    def close(self):
+        """ Close the sessions (and runtimes) of the instances.
+        """
+        models, self._models = self._models, []
+        for model in models:
+            model.session.close()
+
+
 def export(cls, filename=None, single=True):
     """ Export the given Model class to an HTML document.
     
@@ -221,19 +347,12 @@ def export(cls, filename=None, single=True):
     if not (isinstance(cls, type) and issubclass(cls, Model)):
         raise ValueError('runtime must be a string or Model subclass.')
     
-    # Create session
-    serve(cls)
-    session = manager.create_session(cls.__name__)
-    
-    # Make fake connection using exporter object
-    exporter = ExporterWebSocketDummy()
-    manager.connect_client(exporter, session.app_name, session.id)
-    
-    # Clean up again - NO keep in memory to ensure two sessions dont get same id
-    # manager.disconnect_client(session)
-    
     # Get HTML - this may be good enough
-    html = session.get_page_for_export(exporter._commands, single)
+    session, exporter = _create_export_session(cls)
+    try:
+        html = session.get_page_for_export(exporter._commands, single)
+    finally:
+        _release_export_session(session)
     if filename is None:
         return html
     
@@ -245,6 +364,219 @@ def export(cls, filename=None, single=True):
     logging.info('Exported app to %r' % filename)
 
 
+EXPORT_MANIFEST = 'flexx-export.json'
+
+
+def export_many(classes, dirname, workers=None, force=False):
+    """ Export many Model classes to HTML documents in the given directory.
+    
+    Each app is exported to "<classname>.html". The JS and CSS assets
+    are written once, with a name that includes a hash of their content,
+    and are linked from the documents. The exports are done in parallel
+    worker processes. A manifest ("flexx-export.json") in the directory
+    keeps track of
+    what was exported, so that apps for which the source (i.e. the modules
+    that define the class and its bases) and the assets have not changed
+    are not exported again.
+    
+    Arguments:
+        classes (list): the ``app.Model`` subclasses to export. Can also
+            be strings of the form "module:ClassName".
+        dirname (str): the directory to export to. Created if necessary.
+        workers (int, optional): the number of worker processes. Default
+            the number of CPU's. If 0 or 1, all apps are exported in the
+            current process.
+        force (bool): if True, export all apps, also unchanged ones.
+    
+    Returns:
+        exported (list): the names of the apps that were exported (i.e.
+        not skipped).
+    """
+    if dirname.startswith('~'):
+        dirname = os.path.expanduser(dirname)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    manifest = _read_export_manifest(dirname)
+    
+    # Select the apps that need an export
+    todo = []
+    source_hashes = {}
+    for cls in classes:
+        cls = _get_model_class(cls)
+        source_hashes[cls.__name__] = _get_source_hash(cls)
+        entry = manifest.get(cls.__name__, None)
+        if force or not _is_export_current(cls, dirname, entry,
+                                           source_hashes[cls.__name__]):
+            target = '%s:%s' % (cls.__module__, cls.__name__)
+            todo.append((cls if workers in (0, 1) else target, dirname))
+    
+    # Export, in worker processes if it helps
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = min(workers, len(todo))
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(_export_worker, todo, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_export_worker(args) for args in todo]
+    
+    # Update manifest
+    for name, filename, asset_hashes in results:
+        manifest[name] = dict(file=filename, source=source_hashes[name],
+                              assets=asset_hashes)
+    _write_export_manifest(dirname, manifest)
+    logging.info('Exported %i apps to %r (%i unchanged)' %
+                 (len(results), dirname, len(source_hashes) - len(results)))
+    return [r[0] for r in results]
+
+
+def _get_model_class(target):
+    """ Get the Model class for the given "module:ClassName" string (or
+    Model class).
+    """
+    if isinstance(target, str):
+        module_name, _, class_name = target.partition(':')
+        if not class_name:
+            raise ValueError('App must be given as "module:ClassName".')
+        if os.getcwd() not in sys.path:
+            sys.path.insert(0, os.getcwd())
+        target = getattr(importlib.import_module(module_name), class_name)
+    if not (isinstance(target, type) and issubclass(target, Model)):
+        raise ValueError('Not a Model class: %r.' % target)
+    return target
+
+
+def _create_export_session(cls):
+    """ Create a session for the given class, connected to an exporter
+    that records the commands.
+    """
+    serve(cls)
+    session = manager.create_session(cls.__name__)
+    exporter = ExporterWebSocketDummy()
+    manager.connect_client(exporter, session.app_name, session.id)
+    return session, exporter
+
+
+def _release_export_session(session):
+    """ Close an exported session, and remove its assets from the store,
+    so that exporting many apps does not grow the memory.
+    """
+    session._ws.close_code = 1000  # the exporter is done, the session is closed
+    manager.disconnect_client(session)
+    session._release_index_assets()
+
+
+def _export_worker(args):
+    """ Export a single app to the given directory, including the assets
+    that it needs. Returns (app name, filename, asset hashes).
+    """
+    cls, dirname = args
+    cls = _get_model_class(cls)
+    session, exporter = _create_export_session(cls)
+    try:
+        html = session.get_page_for_export(exporter._commands, False, hashed=True)
+        names = ['reset.css'] + [fname for fname in session.get_used_asset_names()
+                                 if not fname.startswith('index-')]
+        assets.export(dirname, names, hashed=True)
+        asset_hashes = dict([(fname, assets.get_hashed_name(fname))
+                             for fname in names])
+    finally:
+        _release_export_session(session)
+    filename = cls.__name__ + '.html'
+    with open(os.path.join(dirname, filename), 'wb') as f:
+        f.write(html.encode())
+    return cls.__name__, filename, asset_hashes
+
+
+def _get_source_hash(cls):
+    """ Get a hash of the source of the modules that define the given
+    Model class and its base classes, and of the Flexx version.
+    """
+    from .. import __version__
+    hash = hashlib.sha1(__version__.encode())
+    for c in cls.mro():
+        if not (issubclass(c, Model) and c is not Model):
+            continue
+        try:
+            filename = inspect.getsourcefile(c)
+            with open(filename, 'rb') as f:
+                hash.update(f.read())
+        except (TypeError, OSError, IOError):
+            # Not from a file (e.g. defined interactively)
+            hash.update((c.JS.CODE + c.CSS).encode())
+    return hash.hexdigest()
+
+
+def _is_export_current(cls, dirname, entry, source_hash):
+    """ Get whether the exported document for the given class (as
+    described by the manifest entry) is up to date.
+    """
+    if not entry or entry.get('source', None) != source_hash:
+        return False
+    if not os.path.isfile(os.path.join(dirname, entry['file'])):
+        return False
+    for fname, hashed_name in entry['assets'].items():
+        if not assets.has_asset(fname) or assets.get_hashed_name(fname) != hashed_name:
+            return False
+    return True
+
+
+def _read_export_manifest(dirname):
+    filename = os.path.join(dirname, EXPORT_MANIFEST)
+    try:
+        with open(filename, 'rb') as f:
+            return json.loads(f.read().decode())
+    except (OSError, IOError, ValueError):
+        return {}
+
+
+def _write_export_manifest(dirname, manifest):
+    filename = os.path.join(dirname, EXPORT_MANIFEST)
+    with open(filename, 'wb') as f:
+        f.write(json.dumps(manifest, indent=1, sort_keys=True).encode())
+
+
+class NotebookCommandBuffer:
+    """ Object that collects the commands for the notebook, and sends
+    them as one piece of JavaScript at the end of a cell execution (via
+    the given function). Commands sent outside of a cell execution (e.g.
+    via ``call_later()``) are sent in the next event loop iteration.
+    """
+    
+    def __init__(self, send_js):
+        self._send_js = send_js
+        self._commands = []
+        self._executing = False
+        self._flush_pending = False
+    
+    def pre_execute(self):
+        self._executing = True
+    
+    def post_execute(self):
+        self._executing = False
+        self.flush()
+    
+    def send_command(self, command, key=None):
+        if isinstance(command, bytes):
+            command = command.decode()
+        self._commands.append(command)
+        if not (self._executing or self._flush_pending):
+            self._flush_pending = True
+            call_later(0, self.flush)
+    
+    def flush(self):
+        """ Send the collected commands.
+        """
+        self._flush_pending = False
+        commands, self._commands = self._commands, []
+        if commands:
+            self._send_js(get_command_js(commands))
+
+
 class ExporterWebSocketDummy:
     """ Object that can be used by an app inplace of the websocket to
     export apps to standalone HTML. The object tracks the commands send
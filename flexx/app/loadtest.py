@@ -0,0 +1,464 @@
+"""
+Load testing of Flexx apps, without browsers or other runtimes.
+
+Each simulated client speaks the Flexx protocol directly: it fetches the
+page of the app (which creates a session on the server), extracts the
+session id, opens the websocket, says "hiflexx", and then sends SIGNAL
+messages at a fixed rate, like a browser does when a signal changes on
+the JS side. The server echoes each signal update back with the same
+"eventual synchronicity id" (esid), which is used to measure the round
+trip latency. All clients run in a single asyncio event loop, so that
+thousands of clients can be simulated on one machine.
+
+The load test can be run from the command line, e.g. against an app that
+is served at port 8080, or against an app that is served in the same
+process (using the asyncio backend):
+
+.. code-block:: none
+
+    python -m flexx loadtest http://localhost:8080/MyApp/ --clients 1000
+    python -m flexx loadtest --serve mymodule:MyApp --clients 100 --signal value
+
+Or from Python:
+
+.. code-block:: py
+
+    from flexx.app.loadtest import LoadTest
+
+    test = LoadTest('http://localhost:8080/MyApp/', clients=100, rate=2,
+                    signal='value')
+    stats = test.run()
+    print(test.report())
+
+By default, the updated signal gets increasing integer values. A script
+can be given instead: a list of (signal_name, value) tuples, which is
+replayed by each client. Updates that the server does not echo (e.g.
+for signals that do not change, or updates that were coalesced because
+the client could not keep up) are not measured. Updates are sent to the
+first model that the server creates in the session (the app), unless a
+model id is given.
+"""
+
+import os
+import re
+import json
+import time
+import random
+import struct
+import base64
+import asyncio
+import hashlib
+import logging
+from urllib.parse import urlparse
+
+from .asyncioserver import WS_GUID, _unmask
+from .serialize import serializer
+
+timer = getattr(time, 'perf_counter', time.time)
+
+RE_SESSION_ID = re.compile(r'flexx_session_id = "(\w+)"')
+RE_INSTANCE = re.compile(r'flexx\.instances\.(\w+) = ')
+RE_ECHO = re.compile(r'_set_signal_from_py\("(\w+)", .*?, "(\d+)"\);')
+
+
+def percentile(values, p):
+    """ Get the p-th percentile (0-100) of the given sorted values, using
+    the nearest-rank method. Returns None if there are no values.
+    """
+    if not values:
+        return None
+    index = max(0, int(len(values) * p / 100.0 + 0.5) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+class LoadClient(asyncio.Protocol):
+    """ A simulated client: a connection that goes through the states
+    "page" (fetching the page), "upgrade" (opening the websocket), "ws"
+    (connected) and "closed".
+    """
+
+    def __init__(self, test):
+        self.test = test
+        self.state = 'page'
+        self.transport = None
+        self.session_id = None
+        self.model_id = test.model
+        self.error = None
+        self._buffer = bytearray()
+        self._t_start = timer()
+        self._step = 0
+        self._esid = 0
+        self._sent = {}  # esid -> time sent
+        self._send_handle = None
+
+    # --- connection and handshakes
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self._write_request(self.test.path, {})
+
+    def connection_lost(self, exc):
+        if self.state != 'closed' and self.error is None:
+            self.error = 'connection lost in state %r' % self.state
+        self.state = 'closed'
+        self.transport = None
+        self._stop_sending()
+        self.test._client_closed(self)
+
+    def _write_request(self, path, headers):
+        lines = ['GET %s HTTP/1.1' % path, 'Host: %s' % self.test.netloc]
+        lines.extend(['%s: %s' % (key, value) for key, value in headers.items()])
+        self.transport.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+    def _fail(self, error):
+        self.error = error
+        self.close()
+
+    def data_received(self, data):
+        self._buffer.extend(data)
+        if self.state == 'page':
+            self._read_page()
+        elif self.state == 'upgrade':
+            self._read_upgrade()
+        if self.state == 'ws':
+            self._read_frames()
+
+    def _read_head(self):
+        """ Get (status, headers, size) of a buffered response, or None.
+        """
+        i = self._buffer.find(b'\r\n\r\n')
+        if i < 0:
+            return None
+        lines = bytes(self._buffer[:i]).decode('latin-1').split('\r\n')
+        headers = {}
+        for line in lines[1:]:
+            key, _, value = line.partition(':')
+            headers[key.strip().lower()] = value.strip()
+        try:
+            status = int(lines[0].split(' ')[1])
+        except (IndexError, ValueError):
+            status = 0
+        return status, headers, i + 4
+
+    def _read_page(self):
+        head = self._read_head()
+        if head is None:
+            return
+        status, headers, size = head
+        n = int(headers.get('content-length', 0))
+        if len(self._buffer) < size + n:
+            return  # wait for the rest of the body
+        body = bytes(self._buffer[size:size + n]).decode('utf-8', 'replace')
+        del self._buffer[:size + n]
+        m = RE_SESSION_ID.search(body)
+        if status != 200 or m is None:
+            return self._fail('could not get page (status %i)' % status)
+        self.session_id = m.group(1)
+        self.state = 'upgrade'
+        self._key = base64.b64encode(os.urandom(16)).decode()
+        self._write_request(self.test.ws_path,
+                            {'Upgrade': 'websocket', 'Connection': 'Upgrade',
+                             'Sec-WebSocket-Key': self._key,
+                             'Sec-WebSocket-Version': '13'})
+
+    def _read_upgrade(self):
+        head = self._read_head()
+        if head is None:
+            return
+        status, headers, size = head
+        del self._buffer[:size]
+        accept = base64.b64encode(hashlib.sha1((self._key + WS_GUID).encode())
+                                  .digest()).decode()
+        if status != 101 or headers.get('sec-websocket-accept') != accept:
+            return self._fail('could not open websocket (status %i)' % status)
+        self.state = 'ws'
+        self._send_frame(0x1, ('hiflexx ' + self.session_id).encode())
+        self.test._client_connected(self, timer() - self._t_start)
+        if self.model_id is not None:
+            self._start_sending()
+
+    # --- websocket
+
+    def _send_frame(self, opcode, payload):
+        n = len(payload)
+        if n < 126:
+            header = struct.pack('!BB', 0x80 | opcode, 0x80 | n)
+        elif n < 65536:
+            header = struct.pack('!BBH', 0x80 | opcode, 0x80 | 126, n)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 0x80 | 127, n)
+        mask = os.urandom(4)
+        self.transport.write(header + mask + _unmask(mask, payload))
+
+    def _read_frames(self):
+        buf = self._buffer
+        while len(buf) >= 2 and self.transport is not None:
+            opcode, n, pos = buf[0] & 0x0f, buf[1] & 0x7f, 2
+            if n == 126:
+                if len(buf) < 4:
+                    return
+                n, pos = struct.unpack('!H', buf[2:4])[0], 4
+            elif n == 127:
+                if len(buf) < 10:
+                    return
+                n, pos = struct.unpack('!Q', buf[2:10])[0], 10
+            if len(buf) < pos + n:
+                return
+            payload = bytes(buf[pos:pos + n])
+            del buf[:pos + n]
+            # The server does not fragment messages
+            if opcode in (0x1, 0x2):
+                self._on_message(payload)
+            elif opcode == 0x9:  # ping
+                self._send_frame(0xA, payload)
+            elif opcode == 0x8:  # close
+                if self.state != 'closed':
+                    self.error = self.error or 'closed by server: %r' % payload[2:]
+                    self.state = 'closed'
+                    self._send_frame(0x8, payload[:2])
+                self.transport.close()
+
+    def _on_message(self, payload):
+        now = timer()
+        self.test.received += 1
+        self.test.received_bytes += len(payload)
+        message = payload.decode('utf-8', 'replace')
+        if self.model_id is None:
+            self._find_model_id(message)
+        for name, esid in RE_ECHO.findall(message):
+            t0 = self._sent.pop(int(esid), None)
+            if t0 is not None:
+                self.test.latencies.append(now - t0)
+
+    def _find_model_id(self, message):
+        if message.startswith('CONSTRUCT '):
+            instances = json.loads(message[10:])['instances']
+            if instances:
+                self.model_id = instances[0][0]
+        else:
+            m = RE_INSTANCE.search(message)
+            if m is not None:
+                self.model_id = m.group(1)
+        if self.model_id is not None:
+            self._start_sending()
+
+    # --- sending signals
+
+    def _start_sending(self):
+        if self.test.steps and self.test.rate > 0:
+            delay = random.random() / self.test.rate  # spread the clients
+            self._send_handle = self.test.loop.call_later(delay, self._send_signal)
+
+    def _stop_sending(self):
+        if self._send_handle is not None:
+            self._send_handle.cancel()
+            self._send_handle = None
+
+    def _send_signal(self):
+        self._send_handle = self.test.loop.call_later(1.0 / self.test.rate,
+                                                      self._send_signal)
+        name, value = self.test.steps[self._step % len(self.test.steps)]
+        if value is None:
+            value = self._step + 1  # default: increasing numbers
+        self._step += 1
+        self._esid += 1
+        txt = serializer.saves(value)
+        message = 'SIGNAL %s %i %s %s' % (self.model_id, self._esid, name, txt)
+        message = message.encode()
+        self._sent[self._esid] = timer()
+        self._send_frame(0x1, message)
+        self.test.sent += 1
+        self.test.sent_bytes += len(message)
+
+    def close(self):
+        """ Close the connection (with a close handshake if connected).
+        """
+        self._stop_sending()
+        if self.transport is None:
+            return
+        if self.state == 'ws':
+            self._send_frame(0x8, struct.pack('!H', 1000))
+        self.state = 'closed'
+        self.transport.close()
+
+
+class LoadTest:
+    """ Simulate a number of clients that connect to a Flexx app and
+    update signals at a fixed rate.
+
+    Parameters:
+        url (str): the url of the app, e.g. "http://localhost:8080/MyApp/".
+        clients (int): the number of simulated clients. Default 10.
+        rate (float): the number of signal updates per second per client.
+            Default 1.
+        duration (float): the duration of the test in seconds, after all
+            clients have been started. Default 10.
+        ramp (float): the time in seconds over which the clients are
+            started. Default 1.
+        signal (str, optional): the name of the signal to update with
+            increasing numbers.
+        script (list, optional): a list of (signal_name, value) tuples to
+            replay instead.
+        model (str, optional): the id of the model to send updates to.
+            Default the first model that is created in the session.
+        loop (asyncio.AbstractEventLoop, optional): the event loop to run
+            the clients in. Default the current event loop.
+    """
+
+    def __init__(self, url, clients=10, rate=1.0, duration=10.0, ramp=1.0,
+                 signal=None, script=None, model=None, loop=None):
+        parts = urlparse(url)
+        if parts.scheme not in ('http', ''):
+            raise ValueError('LoadTest needs an http url, not %r.' % url)
+        self.host = parts.hostname or 'localhost'
+        self.port = parts.port or 80
+        self.netloc = '%s:%i' % (self.host, self.port)
+        self.path = parts.path.rstrip('/') + '/'
+        self.ws_path = self.path + 'ws'
+        self.clients = int(clients)
+        self.rate = float(rate)
+        self.duration = float(duration)
+        self.ramp = float(ramp)
+        self.model = model
+        self.steps = [tuple(step) for step in script] if script else []
+        if signal and not self.steps:
+            self.steps = [(signal, None)]
+        self.loop = loop or asyncio.get_event_loop()
+        self._reset()
+
+    def _reset(self):
+        self.sent = self.received = self.sent_bytes = self.received_bytes = 0
+        self.latencies = []
+        self.connect_times = []
+        self.errors = []
+        self._clients = []
+        self._nclosed = 0
+        self._t0 = self._t1 = None
+
+    def start(self, callback=None):
+        """ Start the clients in the event loop. The given callback is
+        called with the statistics when the test is done.
+        """
+        self._reset()
+        self._callback = callback
+        self._t0 = timer()
+        for i in range(self.clients):
+            delay = self.ramp * i / self.clients
+            self.loop.call_later(delay, self._start_client)
+        self.loop.call_later(self.ramp + self.duration, self._stop)
+
+    def run(self):
+        """ Run the test in the (not running) event loop, and return the
+        statistics.
+        """
+        result = []
+        self.start(lambda stats: (result.append(stats), self.loop.stop()))
+        self.loop.run_forever()
+        return result[0]
+
+    def _start_client(self):
+        client = LoadClient(self)
+        self._clients.append(client)
+        task = self.loop.create_task(self.loop.create_connection(lambda: client,
+                                                                 self.host, self.port))
+        task.add_done_callback(lambda task: self._on_connection(client, task))
+
+    def _on_connection(self, client, task):
+        if task.cancelled():
+            client.error = 'could not connect: cancelled'
+        elif task.exception() is not None:
+            client.error = 'could not connect: %s' % task.exception()
+        else:
+            return
+        self._client_closed(client)
+
+    def _client_connected(self, client, connect_time):
+        self.connect_times.append(connect_time)
+
+    def _client_closed(self, client):
+        self._nclosed += 1
+        if client.error:
+            self.errors.append(client.error)
+        if self._t1 is not None and self._nclosed == len(self._clients):
+            self._done()
+
+    def _stop(self):
+        """ Stop sending and close all clients. Echoes of recent updates
+        get a second to arrive.
+        """
+        self._t1 = timer()
+        for client in self._clients:
+            client._stop_sending()
+        self.loop.call_later(1.0, self._close_all)
+
+    def _close_all(self):
+        for client in self._clients:
+            client.close()
+        if self._nclosed == len(self._clients):
+            self._done()
+        else:
+            self.loop.call_later(5.0, self._done)  # don't wait forever
+
+    def _done(self):
+        if self._callback is not None:
+            callback, self._callback = self._callback, None
+            callback(self.get_stats())
+
+    def get_stats(self):
+        """ Get a dict with the statistics of the test. Times are in
+        seconds; the latencies are round trip times of signal updates.
+        """
+        elapsed = (self._t1 or timer()) - (self._t0 or timer())
+        latencies = sorted(self.latencies)
+        connect_times = sorted(self.connect_times)
+        stats = dict(clients=self.clients, connected=len(self.connect_times),
+                     errors=len(self.errors), duration=elapsed,
+                     sent=self.sent, received=self.received,
+                     sent_bytes=self.sent_bytes, received_bytes=self.received_bytes,
+                     echoed=len(latencies),
+                     sent_per_second=self.sent / elapsed if elapsed else 0.0,
+                     received_per_second=self.received / elapsed if elapsed else 0.0)
+        for p in (50, 90, 99, 100):
+            stats['latency_p%i' % p] = percentile(latencies, p)
+            stats['connect_p%i' % p] = percentile(connect_times, p)
+        return stats
+
+    def report(self):
+        """ Get a text report of the statistics.
+        """
+        stats = self.get_stats()
+
+        def ms(t):
+            return '-' if t is None else '%0.1f ms' % (t * 1000)
+
+        lines = ['Clients:    %i connected of %i, %i errors' %
+                 (stats['connected'], stats['clients'], stats['errors']),
+                 'Sent:       %i messages (%0.1f/s), %i bytes' %
+                 (stats['sent'], stats['sent_per_second'], stats['sent_bytes']),
+                 'Received:   %i messages (%0.1f/s), %i bytes' %
+                 (stats['received'], stats['received_per_second'],
+                  stats['received_bytes']),
+                 'Echoed:     %i of %i signal updates' % (stats['echoed'],
+                                                          stats['sent'])]
+        for what, label in (('connect', 'Connect:'), ('latency', 'Latency:')):
+            lines.append('%s p50 %s, p90 %s, p99 %s, max %s' %
+                         (label.ljust(11), ms(stats[what + '_p50']),
+                          ms(stats[what + '_p90']), ms(stats[what + '_p99']),
+                          ms(stats[what + '_p100'])))
+        for error in sorted(set(self.errors))[:5]:
+            lines.append('Error:      %s (%ix)' % (error, self.errors.count(error)))
+        return '\n'.join(lines)
+
+
+def serve_in_process(target, host='localhost', port=None):
+    """ Serve the app given as "module:ClassName" (or a Model class) with
+    the asyncio backend, so that a load test can run in the same event
+    loop. Returns the url of the app.
+    """
+    from . import funcs
+    target = funcs._get_model_class(target)
+    funcs.serve(target)
+    funcs._server_open(host, port, 'asyncio')
+    host, port = funcs.server.serving_at
+    logging.info('Serving %s for the load test.' % target.__name__)
+    return 'http://%s:%i/%s/' % (host, port, target.__name__)
@@ -0,0 +1,269 @@
+"""
+Metrics of the Flexx server, in the Prometheus text format.
+
+The server exposes the metrics in the default ``registry`` at
+``http://localhost:port/__metrics__``, so that they can be scraped by
+Prometheus (or inspected by hand). Like ``__cmd__``, this is only served
+to requests for localhost, so that public deployments do not reveal
+their apps and sessions. The collected metrics are:
+
+* ``flexx_sessions``: the number of sessions per app and status
+  (pending, connected, pooled, detached (waiting to be resumed), or
+  closed but still retained in memory).
+* ``flexx_messages_received_total`` and ``flexx_received_bytes_total``:
+  incoming websocket messages, per command type.
+* ``flexx_messages_sent_total`` and ``flexx_sent_bytes_total``:
+  outgoing websocket messages, per command type.
+* ``flexx_command_duration_seconds``: the time to handle incoming
+  messages, per command type.
+* ``flexx_page_duration_seconds``: the time to generate the page for
+  a new session, per app.
+* ``flexx_asset_loads_total``: the number of loaded assets, labeled
+  "hit" when served from memory and "miss" when read from disk or url.
+* ``flexx_queue_depth`` and ``flexx_queue_bytes``: the number of queued
+  outgoing commands and the number of bytes that are queued or in
+  transit, summed over the pending and connected sessions of an app.
+* ``flexx_transpile_duration_seconds``: the time to create the
+  JavaScript for Model classes.
+
+Custom metrics can be added by creating a ``Counter``, ``Gauge`` or
+``Histogram``; these register themselves in the default registry.
+
+.. code-block:: py
+
+    from flexx.app import metrics
+
+    orders = metrics.Counter('myapp_orders_total', 'Number of orders.',
+                             labels=('product', ))
+    orders.inc(labels=('bicycle', ))
+"""
+
+import time
+
+timer = getattr(time, 'perf_counter', time.time)  # legacy Python has no perf_counter
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Buckets (upper bounds in seconds) for durations of server-side work
+DURATION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(s):
+    return str(s).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    elif isinstance(value, int) or float(value).is_integer():
+        return '%i' % value
+    else:
+        return repr(float(value))
+
+
+class Registry:
+    """ A collection of metrics that can be rendered as text.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        """ Add a metric to this registry. Raises ValueError if a
+        metric with the same name is already registered.
+        """
+        if self.get(metric.name) is not None:
+            raise ValueError('Metric %r is already registered.' % metric.name)
+        self._metrics.append(metric)
+
+    def unregister(self, metric):
+        """ Remove a metric from this registry.
+        """
+        if metric in self._metrics:
+            self._metrics.remove(metric)
+
+    def get(self, name):
+        """ Get the metric with the given name, or None.
+        """
+        for metric in self._metrics:
+            if metric.name == name:
+                return metric
+
+    def render(self):
+        """ Get all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.append('# HELP %s %s' % (metric.name,
+                                           metric.doc.replace('\n', ' ')))
+            lines.append('# TYPE %s %s' % (metric.name, metric.TYPE))
+            for name, labels, value in metric.samples():
+                if labels:
+                    labels = ','.join(['%s="%s"' % (k, _escape(v)) for k, v in labels])
+                    lines.append('%s{%s} %s' % (name, labels, _format_value(value)))
+                else:
+                    lines.append('%s %s' % (name, _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+# The default registry that is exposed by the server
+registry = _default_registry = Registry()
+
+
+class Metric:
+    """ Base class for metrics.
+
+    Parameters:
+        name (str): the name of the metric, e.g. "flexx_sessions".
+        doc (str): short description of the metric.
+        labels (tuple): the names of the labels of this metric. Values
+            are recorded for each unique combination of label values.
+        registry (Registry, optional): the registry to add this metric
+            to. Default is the global registry. Use False to not
+            register the metric.
+    """
+
+    TYPE = 'untyped'
+
+    def __init__(self, name, doc, labels=(), registry=None):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._values = {}
+        if registry is None:
+            registry = _default_registry
+        if registry is not False:
+            registry.register(self)
+
+    def __repr__(self):
+        return '<%s %r at 0x%x>' % (self.__class__.__name__, self.name, id(self))
+
+    def _check_labels(self, labels):
+        labels = tuple(labels)
+        if len(labels) != len(self.labels):
+            raise ValueError('Metric %r needs %i label values, got %i.' %
+                             (self.name, len(self.labels), len(labels)))
+        return labels
+
+    def get(self, labels=()):
+        """ Get the current value for the given label values.
+        """
+        return self._values.get(tuple(labels), 0)
+
+    def reset(self):
+        """ Clear all recorded values.
+        """
+        self._values = {}
+
+    def samples(self):
+        """ Get a list of (name, labels, value) tuples, where labels is
+        a tuple of (name, value) pairs.
+        """
+        samples = []
+        for key in sorted(self._values):
+            labels = tuple(zip(self.labels, key))
+            samples.append((self.name, labels, self._values[key]))
+        return samples
+
+
+class Counter(Metric):
+    """ A metric that only goes up, e.g. the number of handled messages.
+    """
+
+    TYPE = 'counter'
+
+    def inc(self, amount=1, labels=()):
+        """ Increase the counter for the given label values.
+        """
+        if amount < 0:
+            raise ValueError('Counter can only increase.')
+        labels = self._check_labels(labels)
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """ A metric that can go up and down, e.g. the number of sessions.
+
+    Values can be set, or a function can be given that returns a
+    dict that maps tuples of label values to values. The function is
+    called each time that the metrics are rendered.
+    """
+
+    TYPE = 'gauge'
+
+    def __init__(self, name, doc, labels=(), registry=None, func=None):
+        Metric.__init__(self, name, doc, labels, registry)
+        self._func = func
+
+    def set(self, value, labels=()):
+        """ Set the value for the given label values.
+        """
+        self._values[self._check_labels(labels)] = value
+
+    def samples(self):
+        if self._func is not None:
+            self._values = dict(self._func())
+        return Metric.samples(self)
+
+
+class Histogram(Metric):
+    """ A metric that counts observations (e.g. durations) in buckets.
+
+    Parameters:
+        buckets (tuple): the upper bounds of the buckets. Default
+            ``DURATION_BUCKETS``, which suits durations in seconds.
+    """
+
+    TYPE = 'histogram'
+
+    def __init__(self, name, doc, labels=(), registry=None, buckets=None):
+        Metric.__init__(self, name, doc, labels, registry)
+        self.buckets = tuple(sorted(buckets or DURATION_BUCKETS))
+
+    def observe(self, value, labels=()):
+        """ Record a value for the given label values.
+        """
+        labels = self._check_labels(labels)
+        try:
+            counts, total = self._values[labels]
+        except KeyError:
+            counts, total = [0] * (len(self.buckets) + 1), 0.0  # last is +Inf
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        counts[i] += 1
+        self._values[labels] = counts, total + value
+
+    def get(self, labels=()):
+        """ Get the number of observations for the given label values.
+        """
+        return self.get_count(labels)
+
+    def get_count(self, labels=()):
+        """ Get the number of observations for the given label values.
+        """
+        counts, total = self._values.get(tuple(labels), ((), 0.0))
+        return sum(counts)
+
+    def get_sum(self, labels=()):
+        """ Get the sum of observations for the given label values.
+        """
+        counts, total = self._values.get(tuple(labels), ((), 0.0))
+        return total
+
+    def samples(self):
+        samples = []
+        for key in sorted(self._values):
+            counts, total = self._values[key]
+            labels = tuple(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'), ), counts):
+                cumulative += count
+                samples.append((self.name + '_bucket',
+                                labels + (('le', _format_value(bound)), ), cumulative))
+            samples.append((self.name + '_sum', labels, total))
+            samples.append((self.name + '_count', labels, cumulative))
+        return samples
@@ -3,19 +3,28 @@ Base class for objects that live in both Python and JS.
 This basically implements the syncing of signals.
 """
 
+import sys
 import weakref
 import logging
 import json
 
+try:
+    from concurrent.futures import Future
+except ImportError:  # Python 2.x without the futures backport
+    from tornado.concurrent import Future
+
 from .. import react
 from ..react.hassignals import HasSignalsMeta, with_metaclass, new_type
 from ..react.pyscript import create_js_signals_class, HasSignalsJS
-from ..pyscript import py2js, js_rename, window
+from ..pyscript import py2js, js_rename, window, undefined
 
 from .serialize import serializer
+from . import metrics
 
 reprs = json.dumps
 
+typeof = None  # fool PyFlakes
+
 model_classes = []
 def get_model_classes():
     """ Get a list of all known Model subclasses.
@@ -47,29 +56,60 @@ class JSSignal(react.SourceSignal):
             func.__name__ = func_or_name.__name__
         
         self._linked = False
+        self._lazy = False
         react.SourceSignal.__init__(self, func, [], ob=ob)
     
     def _subscribe(self, *args):
         react.SourceSignal._subscribe(self, *args)
-        if not self._linked:
+        if not (self._linked or self._lazy):
+            self._linked = True
             self._self._link_js_signal(self.name)
     
     def _unsubscribe(self, *args):
         react.SourceSignal._unsubscribe(self, *args)
         if self._linked and not self._downstream:
+            self._linked = False
+            self._self._link_js_signal(self.name, False)
+    
+    @property
+    def lazy(self):
+        """ Whether this signal is in pull mode. See ``set_lazy()``.
+        """
+        return self._lazy
+    
+    def set_lazy(self, lazy=True):
+        """ Set whether this signal is lazy. A lazy signal is not updated
+        when the value changes in JS, which avoids traffic for signals
+        that are only read occasionally. Use ``request()`` to obtain the
+        current value.
+        """
+        self._lazy = lazy = bool(lazy)
+        self._self._set_js_signal_lazy(self.name, lazy)
+        if lazy and self._linked:
+            self._linked = False
             self._self._link_js_signal(self.name, False)
+        elif not lazy and self._downstream and not self._linked:
+            self._linked = True
+            self._self._link_js_signal(self.name)
+    
+    def request(self):
+        """ Request the current value from JS. Returns a Future that
+        is resolved with the value when the client replies (at which
+        point the value of this signal is updated as well).
+        """
+        return self._self._request_js_signal(self.name)
 
 
 class PySignal(react.SourceSignal):
     """ A signal in JS that represents a proxy to a signal in Python.
     """
     
-    def __init__(self, name):
+    def __init__(self, name, flags=None):
         
         def func(v):
             return v
         func._name = name
-        react.SourceSignal.__init__(self, func, [])
+        react.SourceSignal.__init__(self, func, [], flags=flags)
 
 
 class PyInputSignal(PySignal):
@@ -80,6 +120,121 @@ class PyInputSignal(PySignal):
     pass
 
 
+class BroadcastSignal(react.InputSignal):
+    """ An input signal of which the value is sent to all sessions that
+    are subscribed to it. See ``broadcast()``.
+    """
+    
+    def _set_value(self, value):
+        count = self._count
+        react.InputSignal._set_value(self, value)
+        if self._count != count:
+            from .session import manager
+            manager._broadcast(self)
+
+
+def broadcast(func):
+    """ Decorator to create a broadcast signal: a global input signal
+    whose value is shared with many sessions.
+    
+    Sessions subscribe via ``app.manager.subscribe(session, signal)``.
+    Each time that the signal changes, its value is serialized just once,
+    and the resulting message is sent to all subscribed clients. In JS,
+    Model classes can connect to it via ``'broadcasts.<name>'``, so no
+    Python signal per session is needed. Broadcast signals must be
+    defined at module level and must have unique names.
+    
+    Example:
+    
+        .. code-block:: py
+        
+            @app.broadcast
+            def global_cpu_usage(v=0):
+                return float(v)
+            
+            class Monitor(ui.Widget):
+                
+                def init(self):
+                    app.manager.subscribe(self.session, global_cpu_usage)
+                
+                class JS:
+                    
+                    @react.connect('broadcasts.global_cpu_usage')
+                    def _update_cpu_usage(self, v):
+                        ...
+    """
+    if isinstance(func, react.Signal) or not callable(func):
+        raise ValueError('broadcast must be used as a plain decorator.')
+    frame = sys._getframe(1)
+    return BroadcastSignal(func, [], frame=frame)
+
+
+class OffloadedMethod:
+    """ A method of a Model class that runs in JS. See ``offload()``.
+    """
+    
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__  # set to the attribute name by ModelMeta
+        self.__doc__ = func.__doc__
+    
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        name = self.name
+        
+        def call_offloaded(*args):
+            return instance._call_js_method(name, args)
+        
+        call_offloaded.__name__ = name
+        call_offloaded.__doc__ = self.__doc__
+        return call_offloaded
+
+
+def offload(func):
+    """ Decorator to make a method of a Model class run in JS, e.g. in
+    nodejs, which is for many things faster than CPython.
+    
+    The method must be PyScript compatible; it is transpiled to a method
+    of the JS class. Calling it from Python sends the arguments to the
+    client, and returns a ``concurrent.futures.Future`` that resolves
+    with the return value (or an exception if the JS code fails). The
+    arguments and return value are serialized like signal values. If
+    the method returns a JS promise, its result is awaited. Futures can
+    be waited for in a tornado coroutine, or in asyncio via
+    ``asyncio.wrap_future()``. See ``ModelPool`` to run offloaded
+    methods in parallel.
+    
+    Example:
+    
+        .. code-block:: py
+        
+            class PrimeFinder(app.Model):
+                
+                @app.offload
+                def count_primes(self, n):
+                    count = 0
+                    for i in range(2, n):
+                        for j in range(2, i):
+                            if i % j == 0:
+                                break
+                        else:
+                            count += 1
+                    return count
+            
+            finder = app.launch(PrimeFinder, 'nodejs')
+            future = finder.count_primes(10000)
+            future.add_done_callback(lambda f: print(f.result()))
+    """
+    if isinstance(func, react.Signal) or not callable(func):
+        raise ValueError('offload must be used as a plain decorator.')
+    return OffloadedMethod(func)
+
+
+_transpile_duration = metrics.Histogram('flexx_transpile_duration_seconds',
+                                        'Time to create the JS of Model classes.')
+
+
 class ModelMeta(HasSignalsMeta):
     """ Meta class for Model
     Set up proxy signals in Py/JS.
@@ -117,14 +272,24 @@ class ModelMeta(HasSignalsMeta):
                         setattr(JS, name, val)
         cls.JS = JS
         
-        # Create proxy signals on cls.JS for each signal on cls
+        # Offloaded methods are methods of the JS class too
+        for name, val in cls.__dict__.items():
+            if isinstance(val, OffloadedMethod):
+                val.name = name
+                if name not in JS.__dict__:
+                    setattr(JS, name, val.func)
+        
+        # Create proxy signals on cls.JS for each signal on cls. The
+        # sync flags are copied, because these determine how JS syncs.
         for name, val in cls.__dict__.items():
             if isinstance(val, react.Signal) and not isinstance(val, JSSignal):
                 if not hasattr(cls.JS, name):
+                    flags = dict([(k, v) for k, v in val.flags.items()
+                                  if k in ('syncmode', 'syncrate')])
                     if isinstance(val, react.InputSignal):
-                        setattr(cls.JS, name, PyInputSignal(name))
+                        setattr(cls.JS, name, PyInputSignal(name, flags))
                     else:
-                        setattr(cls.JS, name, PySignal(name))
+                        setattr(cls.JS, name, PySignal(name, flags))
                 elif isinstance(getattr(cls.JS, name), (PySignal, react.InputSignal)):
                     pass  # ok, overloaded signal on JS side
                 else:
@@ -132,7 +297,9 @@ class ModelMeta(HasSignalsMeta):
                                  'as it would hide a JS attribute.' % name)
         
         # Set JS and CSS for this class
+        t0 = metrics.timer()
         cls.JS.CODE = cls._get_js()
+        _transpile_duration.observe(metrics.timer() - t0)
         cls.CSS = cls.__dict__.get('CSS', '')
     
     def _get_js(cls):
@@ -229,24 +396,42 @@ class Model(with_metaclass(ModelMeta, react.HasSignals)):
         # Flag to implement eventual synchronicity
         self._seid_from_js = 0
         
+        # Futures for requested JS signal values: name -> list of futures
+        self._js_signal_requests = {}
+        
+        # Calls to offloaded methods: call id -> (method name, future)
+        self._js_calls = {}
+        self._js_call_count = 0
+        
         # Init session
         if session is None:
             from .session import manager
             session = manager.get_default_session()
         self._session = session
+        self._session._models.add(self)
         
         self._session.register_model_class(self.__class__)
         
-        # Instantiate JavaScript version of this class
-        clsname = 'flexx.classes.' + self.__class__.__name__
-        cmd = 'flexx.instances.%s = new %s(%s);' % (self._id, clsname, reprs(self._id))
-        self._session._exec(cmd)
-        
-        self._init()
-        
-        # Init signals - signals will be connected updated, causing updates
-        # on the JS side.
-        react.HasSignals.__init__(self, **kwargs)
+        # Models created during construction are sent to JS in one go
+        self._session._begin_construct()
+        try:
+            # Instantiate JavaScript version of this class
+            construct = self._session._construct
+            if construct is not None:
+                construct['instances'].append([self._id, self.__class__.__name__])
+            else:
+                clsname = 'flexx.classes.' + self.__class__.__name__
+                cmd = 'flexx.instances.%s = new %s(%s);' % (self._id, clsname,
+                                                            reprs(self._id))
+                self._session._exec(cmd)
+            
+            self._init()
+            
+            # Init signals - signals will be connected updated, causing updates
+            # on the JS side.
+            react.HasSignals.__init__(self, **kwargs)
+        finally:
+            self._session._end_construct()
     
     def _init(self):
         """ Can be overloaded when creating a custom class.
@@ -295,7 +480,18 @@ class Model(with_metaclass(ModelMeta, react.HasSignals)):
         # #if name in ('parent', 'children') and signal.value == value:
         #     pass  # input signal already has this value
         # else:
-        signal._set(value)
+        # Resolve any pending requests for this signal, also if setting fails
+        futures = self._js_signal_requests.pop(name, [])
+        try:
+            signal._set(value)
+        except Exception as err:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(err)
+            raise
+        for future in futures:
+            if not future.done():
+                future.set_result(signal._value)
     
     def _signal_changed(self, signal):
         # Set esid to 0 if it originates from Py, or to what we got from JS
@@ -304,9 +500,13 @@ class Model(with_metaclass(ModelMeta, react.HasSignals)):
         if not isinstance(signal, JSSignal) and not signal.flags.get('nosync', False):
             #txt = json.dumps(signal.value)
             txt = serializer.saves(signal.value)
+            if self._session._construct is not None:
+                self._session._construct_signal(self._id, signal.name, txt, esid)
+                return
             cmd = 'flexx.instances.%s._set_signal_from_py(%s, %s, %s);' % (
                 self._id, reprs(signal.name), reprs(txt), reprs(esid))
-            self._session._exec(cmd)
+            # The key allows the session to coalesce updates of this signal
+            self._session._exec(cmd, 'signal %s %s' % (self._id, signal.name))
     
     def _link_js_signal(self, name, link=True):
         """ Make a link between a JS signal and its proxy in Python.
@@ -323,6 +523,78 @@ class Model(with_metaclass(ModelMeta, react.HasSignals)):
                                                                reprs(name), link)
         self._session._exec(cmd)
     
+    def _set_js_signal_lazy(self, name, lazy=True):
+        """ Tell JS whether the given signal should not be synced to Py
+        until it is requested.
+        """
+        lazy = 'true' if lazy else 'false'
+        cmd = 'flexx.instances.%s._set_signal_lazy(%s, %s);' % (self._id,
+                                                                reprs(name), lazy)
+        self._session._exec(cmd)
+    
+    def _request_js_signal(self, name):
+        """ Ask JS to send the current value of the given signal. Returns
+        a Future that is resolved when the value is received.
+        """
+        future = Future()
+        if self._session._closed or self._session.status == self._session.STATUS.CLOSED:
+            future.set_exception(RuntimeError('Cannot request signal %r; '
+                                              'session is closed.' % name))
+            return future
+        self._js_signal_requests.setdefault(name, []).append(future)
+        cmd = 'flexx.instances.%s._request_signal(%s);' % (self._id, reprs(name))
+        self._session._exec(cmd)
+        return future
+    
+    def _call_js_method(self, name, args):
+        """ Call the given method in JS. Returns a Future that is
+        resolved with the return value.
+        """
+        future = Future()
+        if self._session._closed or self._session.status == self._session.STATUS.CLOSED:
+            future.set_exception(RuntimeError('Cannot call %r; '
+                                              'session is closed.' % name))
+            return future
+        self._js_call_count += 1
+        call_id = self._js_call_count
+        self._js_calls[call_id] = name, future
+        txt = serializer.saves(list(args))
+        cmd = 'flexx.instances.%s._call_from_py(%i, %s, %s);' % (
+            self._id, call_id, reprs(name), reprs(txt))
+        self._session._exec(cmd)
+        return future
+    
+    def _set_call_result_from_js(self, call_id, ok, text):
+        """ Resolve the future of a call to an offloaded method.
+        """
+        name, future = self._js_calls.pop(int(call_id), (None, None))
+        if future is None or future.done():
+            return
+        if ok == '1':
+            future.set_result(serializer.loads(text))
+        else:
+            future.set_exception(RuntimeError('Error in JS method %r: %s' %
+                                              (name, json.loads(text))))
+    
+    def _cancel_js_calls(self, reason):
+        """ Fail the pending calls to offloaded methods.
+        """
+        calls, self._js_calls = self._js_calls, {}
+        for name, future in calls.values():
+            if not future.done():
+                future.set_exception(RuntimeError('Call to %r failed: %s' %
+                                                  (name, reason)))
+    
+    def _cancel_js_signal_requests(self, reason):
+        """ Fail the pending requests for JS signal values.
+        """
+        requests, self._js_signal_requests = self._js_signal_requests, {}
+        for name, futures in requests.items():
+            for future in futures:
+                if not future.done():
+                    future.set_exception(RuntimeError('Request for signal %r '
+                                                      'failed: %s' % (name, reason)))
+    
     def call_js(self, call):
         cmd = 'flexx.instances.%s.%s;' % (self._id, call)
         self._session._exec(cmd)
@@ -343,6 +615,10 @@ class Model(with_metaclass(ModelMeta, react.HasSignals)):
             self.__id = self._id = self.id = id
             
             self._linked_signals = {}  # use a list as a set
+            self._lazy_signals = {}  # signals that only sync on request
+            
+            # Signal that holds broadcast signals (name -> signal)
+            self.broadcasts = window.flexx.get_broadcasts()
             
             # Call _init now. This gives subclasses a chance to init at a time
             # when the id is set, but *before* the signals are connected.
@@ -365,7 +641,7 @@ class Model(with_metaclass(ModelMeta, react.HasSignals)):
                 signal._esid = 0  # mark signal as updated from py
         
         def _signal_changed(self, signal):
-            if window.flexx.ws is None:  # we could be exported or in an nbviewer
+            if not window.flexx.can_send():  # we could be exported or in an nbviewer
                 return
             if self._signal_emit_lock:
                 self._signal_emit_lock = False
@@ -374,13 +650,79 @@ class Model(with_metaclass(ModelMeta, react.HasSignals)):
             # todo: what signals do we sync? all but private signals? or only linked?
             # signals like `text` should always sync, signals like a 100Hz
             # timer not, mouse_pos maybe neither unless linked against
-            if signal.flags.nosync:
+            if signal.flags.nosync or self._lazy_signals[signal._name]:
                 return
             if signal.signal_type != 'PySignal' and not signal._name.startswith('_'):
-                #txt = JSON.stringify(signal.value)
-                txt = window.flexx.serializer.saves(signal.value)
-                window.flexx.ws.send('SIGNAL ' + [self.id, signal._esid,
-                                                  signal._name, txt].join(' '))
+                mode = signal.flags.syncmode
+                if not mode or mode == 'immediate':
+                    self._sync_signal(signal)
+                else:
+                    self._schedule_sync(signal, mode, signal.flags.syncrate)
+        
+        def _schedule_sync(self, signal, mode, rate):
+            """ Schedule sending the signal to Py, according to its syncmode.
+            Changes in the mean time are coalesced into the latest value.
+            """
+            if signal._sync_pending:
+                return
+            signal._sync_pending = True
+            sync = lambda: self._sync_signal(signal)
+            if mode == 'frame':
+                window.flexx.call_on_frame(sync)
+            elif mode == 'idle':
+                window.flexx.call_on_idle(sync)
+            else:
+                elapsed = window.Date.now() - (signal._sync_time or 0)
+                delay = 1000 / rate - elapsed
+                if delay <= 0:
+                    self._sync_signal(signal)
+                else:
+                    window.setTimeout(sync, delay)
+        
+        def _sync_signal(self, signal):
+            """ Send the current value of the given signal to Py.
+            """
+            signal._sync_pending = False
+            signal._sync_time = window.Date.now()
+            if not window.flexx.can_send():  # connection may be lost by now
+                return
+            #txt = JSON.stringify(signal.value)
+            txt = window.flexx.serializer.saves(signal.value)
+            window.flexx.send('SIGNAL ' + [self.id, signal._esid,
+                                           signal._name, txt].join(' '))
+        
+        def _set_signal_lazy(self, name, lazy):
+            if lazy:
+                self._lazy_signals[name] = True
+            elif self._lazy_signals[name]:
+                del self._lazy_signals[name]
+        
+        def _request_signal(self, name):
+            self._sync_signal(self[name])
+        
+        def _call_from_py(self, call_id, name, text):
+            """ Call an offloaded method and send the result to Py.
+            """
+            def send(ok, txt):
+                window.flexx.send('RESULT ' + [self.id, call_id, ok, txt].join(' '))
+            
+            def on_result(result):
+                if result is undefined:
+                    result = None
+                send(1, window.flexx.serializer.saves(result))
+            
+            def on_error(err):
+                send(0, window.JSON.stringify(str(err)))
+            
+            try:
+                result = self[name].apply(self, window.flexx.serializer.loads(text))
+            except Exception as err:
+                on_error(err)
+                return
+            if result and typeof(result.then) is 'function':
+                result.then(on_result, on_error)
+            else:
+                on_result(result)
         
         def _link_js_signal(self, name, link):
             if link:
@@ -2,13 +2,19 @@
 Definition of App class and the app manager.
 """
 
+import sys
 import time
+import json
+import weakref
 import logging
+from collections import deque
 
 from .. import react
 from ..react.hassignals import new_type
 
-from .model import Model
+from .model import Model, BroadcastSignal
+from . import metrics
+from .serialize import serializer
 from .assetstore import SessionAssets
 
 
@@ -19,6 +25,161 @@ def valid_app_name(name):
     return name and name[0] in T[:-10] and all([c in T for c in name])
 
 
+class CommandQueue:
+    """ Queue for the outgoing commands of a session.
+    
+    Commands are queued while the session is pending, and while the
+    client has not yet received the previously sent commands. The
+    number of bytes that are queued or being written is tracked. When
+    it exceeds the high watermark, the queue becomes *congested*, until
+    it drops below the low watermark. While congested, the overflow
+    policy applies to commands that have a key (e.g. signal updates):
+    
+    * 'coalesce': a command replaces the queued command with the same
+      key, so that only the latest value is sent.
+    * 'drop': the command is dropped.
+    * 'disconnect': the session is disconnected (any command).
+    
+    Commands without a key (e.g. code to define classes) cannot be
+    dropped without breaking the client. Under all policies, the session
+    is disconnected when such a command is put while the high watermark
+    is exceeded, so that the queue stays bounded.
+    
+    The defaults for new sessions can be changed via the class attributes.
+    """
+    
+    POLICIES = 'coalesce', 'drop', 'disconnect'
+    
+    HIGH_WATERMARK = 2**20  # 1 MiB
+    LOW_WATERMARK = 2**18  # 256 KiB
+    POLICY = 'coalesce'
+    
+    def __init__(self, high_watermark=None, low_watermark=None, policy=None):
+        self._commands = []  # list of [key, command]
+        self._keys = {}  # key -> item in self._commands
+        self._nbytes = 0  # queued
+        self._nbytes_writing = 0  # popped, but not yet written
+        self.configure(high_watermark or self.HIGH_WATERMARK,
+                       low_watermark or self.LOW_WATERMARK,
+                       policy or self.POLICY)
+        self.congested = False
+        self.congestion_count = 0
+        self.max_nbytes = 0
+        self.coalesced = 0
+        self.dropped = 0
+    
+    def __len__(self):
+        return len(self._commands)
+    
+    def configure(self, high_watermark=None, low_watermark=None, policy=None):
+        """ Set the high and low watermarks (in bytes) and overflow policy.
+        """
+        high = int(high_watermark or self.high_watermark)
+        low = int(low_watermark or self.low_watermark)
+        policy = policy or self.policy
+        if policy not in self.POLICIES:
+            raise ValueError('Invalid queue policy %r, must be one of %r' %
+                             (policy, self.POLICIES))
+        if not 0 <= low <= high:
+            raise ValueError('Queue watermarks must satisfy 0 <= low <= high.')
+        self.high_watermark, self.low_watermark, self.policy = high, low, policy
+    
+    @property
+    def nbytes(self):
+        """ The number of bytes that are queued or being written. For
+        str commands, the number of characters is used.
+        """
+        return self._nbytes + self._nbytes_writing
+    
+    def put(self, command, key=None):
+        """ Add a command to the queue. Returns False if the session
+        should be disconnected.
+        """
+        if not self.congested and self.nbytes >= self.high_watermark:
+            self.congested = True
+            self.congestion_count += 1
+        if self.congested:
+            if self.policy == 'disconnect':
+                return False
+            elif key is None:
+                if self.nbytes >= self.high_watermark:
+                    return False
+            elif self.policy == 'drop':
+                self.dropped += 1
+                return True
+            elif key in self._keys:
+                item = self._keys[key]
+                self._nbytes += len(command) - len(item[1])
+                item[1] = command
+                self.coalesced += 1
+                return True
+        item = [key, command]
+        self._commands.append(item)
+        if key is not None:
+            self._keys[key] = item
+        self._nbytes += len(command)
+        self.max_nbytes = max(self.max_nbytes, self.nbytes)
+        return True
+    
+    def pop_all(self):
+        """ Get all queued commands. They count as being written until
+        ``done()`` is called.
+        """
+        commands = [item[1] for item in self._commands]
+        self._commands = []
+        self._keys = {}
+        self._nbytes_writing += self._nbytes
+        self._nbytes = 0
+        return commands
+    
+    def done(self):
+        """ Mark the popped commands as written.
+        """
+        self._nbytes_writing = 0
+        if self.congested and self.nbytes <= self.low_watermark:
+            self.congested = False
+    
+    def clear(self):
+        """ Remove all commands.
+        """
+        self.pop_all()
+        self.done()
+    
+    def get_commands(self):
+        """ Get a list of the queued commands.
+        """
+        return [item[1] for item in self._commands]
+    
+    def get_stats(self):
+        """ Get a dict with metrics for this queue.
+        """
+        return dict(depth=len(self._commands), nbytes=self.nbytes,
+                    max_nbytes=self.max_nbytes, congested=self.congested,
+                    congestion_count=self.congestion_count,
+                    coalesced=self.coalesced, dropped=self.dropped)
+
+
+class SessionPool:
+    """ Pre-built sessions for an app, so that a page can be served
+    without waiting for the app to be instantiated.
+    
+    Building a session blocks the event loop, so the pool is only filled
+    when no session was handed out in the last ``IDLE_TIME`` seconds
+    (i.e. not while the client is loading the page and connecting).
+    """
+    
+    IDLE_TIME = 0.5
+    
+    def __init__(self, size, max_age):
+        self.size = int(size)
+        self.max_age = float(max_age)
+        self.sessions = []
+        self.token = 0  # identifies the most recently scheduled fill
+        self.last_take = 0
+        self.hits = 0
+        self.misses = 0
+
+
 class AppManager:
     """ Manage apps, or more specifically, the session objects.
     
@@ -33,8 +194,15 @@ class AppManager:
         # name -> (ModelClass, pending, connected) - lists contain proxies
         self._proxies = {'__default__': (None, [], [])}
         self._last_check_time = time.time()
+        # Closed sessions that are still alive (because models refer to them)
+        self._closed_sessions = weakref.WeakValueDictionary()
+        # Broadcast signals: name -> signal, and signal -> list of sessions
+        self._broadcasts = {}
+        self._broadcast_subscribers = {}
+        # Pools of pre-built sessions: name -> SessionPool
+        self._pools = {}
     
-    def register_app_class(self, cls):
+    def register_app_class(self, cls, pool_size=None, pool_max_age=None):
         """ Register a Model class as being an application.
         
         Applications are identified by the ``__name__`` attribute of
@@ -42,6 +210,13 @@ class AppManager:
         
         After registering a class, it becomes possible to connect to 
         "http://address:port/ClassName". 
+        
+        If ``pool_size`` is given, a pool of that many sessions is
+        built in the background (one per event loop iteration), from
+        which sessions are handed out and replenished. Pooled sessions
+        older than ``pool_max_age`` seconds (default 300) are replaced.
+        A pool size of zero disables the pool. If not given, the pool
+        settings of a previous registration are kept.
         """
         assert isinstance(cls, type) and issubclass(cls, Model)
         name = cls.__name__
@@ -52,7 +227,74 @@ class AppManager:
             oldCls, pending, connected = self._proxies[name]
             logging.warn('Re-registering app class %r' % name)
             #raise ValueError('App with name %r already registered' % name)
+            if pool_size is None and name in self._pools:
+                # Pooled sessions are of the old class
+                pool = self._pools[name]
+                pool_size, pool_max_age = pool.size, pool.max_age
         self._proxies[name] = cls, pending, connected
+        if pool_size is not None:
+            self._set_pool(name, pool_size, pool_max_age)
+    
+    def _set_pool(self, name, size, max_age=None):
+        pool = self._pools.pop(name, None)
+        if pool is not None:
+            pool.token += 1  # cancel scheduled fill
+            for session in pool.sessions:
+                self._close_session(session)
+        if size > 0:
+            self._pools[name] = SessionPool(size, 300 if max_age is None else max_age)
+            self._schedule_pool_fill(name, 0)
+    
+    def _schedule_pool_fill(self, name, delay):
+        from .funcs import call_later  # noqa - import here to avoid circular import
+        pool = self._pools[name]
+        pool.token += 1
+        call_later(max(0, delay), self._fill_pool, name, pool.token)
+    
+    def _fill_pool(self, name, token):
+        """ Replace expired sessions in the pool, and add one session
+        if the pool is not full. Then schedule the next fill.
+        """
+        pool = self._pools.get(name, None)
+        if pool is None or pool.token != token:
+            return  # pool was removed or another fill is scheduled
+        now = time.time()
+        if now - pool.last_take < pool.IDLE_TIME:
+            self._schedule_pool_fill(name, pool.last_take + pool.IDLE_TIME - now)
+            return
+        for session in list(pool.sessions):
+            if now - session._creation_time >= pool.max_age:
+                pool.sessions.remove(session)
+                self._close_session(session)
+        if len(pool.sessions) < pool.size:
+            try:
+                pool.sessions.append(self._build_session(self._proxies[name][0]))
+            except Exception as err:
+                # Don't retry in a loop; the next handed out session retries
+                logging.error('Could not pre-build session for %r: %s' % (name, err))
+                return
+            self._schedule_pool_fill(name, 0)  # next one in a next iteration
+        else:
+            oldest = min([session._creation_time for session in pool.sessions])
+            self._schedule_pool_fill(name, oldest + pool.max_age - now)
+    
+    def _take_from_pool(self, name):
+        """ Get a session from the pool for the given app, or None.
+        """
+        pool = self._pools.get(name, None)
+        if pool is None:
+            return None
+        now = pool.last_take = time.time()
+        self._schedule_pool_fill(name, pool.IDLE_TIME)  # replenish
+        while pool.sessions:
+            session = pool.sessions.pop(0)
+            if now - session._creation_time < pool.max_age:
+                # The client gets the normal time to connect
+                session._creation_time = now
+                pool.hits += 1
+                return session
+            self._close_session(session)
+        pool.misses += 1
     
     def get_default_session(self):
         """ Get the default session that is used for interactive use.
@@ -78,10 +320,11 @@ class AppManager:
                 if name == '__default__':
                     continue
                 _, pending, _ = self._proxies[name]
-                to_remove = [s for s in pending
-                             if (time.time() - s._creation_time) > 10]
+                to_remove = [s for s in pending if s._detached_time is None and
+                             (time.time() - s._creation_time) > 10]
                 for s in to_remove:
                     pending.remove(s)
+                    self._close_session(s)
                 count += len(to_remove)
             if count:
                 logging.warn('Cleared %i old pending sessions' % count)
@@ -109,11 +352,7 @@ class AppManager:
             raise ValueError('Can only instantiate a session with a valid app name.')
         
         cls, pending, connected = self._proxies[name]
-        
-        # Session and app class need each-other, thus the _set_app()
-        session = Session(cls.__name__)
-        app = cls(session=session, is_app=True)  # is_app marks this Model as "main"
-        session._set_app(app)
+        session = self._take_from_pool(name) or self._build_session(cls)
         
         # Now wait for the client to connect. The client will be served
         # a page that contains the session_id. Upon connecting, the id
@@ -123,8 +362,18 @@ class AppManager:
         logging.debug('Instantiate app client %s' % session.app_name)
         return session
     
-    def connect_client(self, ws, name, app_id):
+    def _build_session(self, cls):
+        # Session and app class need each-other, thus the _set_app()
+        session = Session(cls.__name__)
+        app = cls(session=session, is_app=True)  # is_app marks this Model as "main"
+        session._set_app(app)
+        return session
+    
+    def connect_client(self, ws, name, app_id, seq=None):
         """ Connect a client to a session that was previously created.
+        
+        To resume a session after the connection was lost, ``seq`` is
+        the number of messages that the client has received.
         """
         logging.debug('connecting %s %s' %(name, app_id))
         cls, pending, connected = self._proxies[name]
@@ -135,29 +384,84 @@ class AppManager:
                 pending.remove(session)
                 break
         else:
-            raise RuntimeError('Asked for app id %r, but could not find it' % app_id)
+            for session in connected:
+                if (session.id == app_id and seq is not None and
+                        session._can_resume()):
+                    # The client noticed that the connection was lost
+                    # before we did; drop the stale connection and resume
+                    connected.remove(session)
+                    self._drop_stale_ws(session)
+                    break
+            else:
+                raise RuntimeError('Asked for app id %r, but could not find it' %
+                                   app_id)
     
         # Add app to connected, set ws
         assert session.status == Session.STATUS.PENDING
-        session._set_ws(ws)
+        try:
+            session._set_ws(ws, seq)
+        except Exception:
+            self._close_session(session)
+            self.connections_changed._set(session.app_name)
+            raise
         connected.append(session)
-        AppManager.total_sessions += 1
+        if seq is None:
+            AppManager.total_sessions += 1
         self.connections_changed._set(session.app_name)
         return session  # For the ws
     
+    def _drop_stale_ws(self, session):
+        """ Detach a session from its websocket, which is closed without
+        disconnecting the session.
+        """
+        ws = session._ws
+        session._detach()
+        ws._session = None  # so that closing it does not disconnect the session
+        try:
+            ws.close(1000, 'Session was resumed on another connection')
+        except Exception as err:  # pragma: no cover - connection may be broken
+            logging.warn('Could not close stale connection: %s' % str(err))
+    
     def disconnect_client(self, session):
         """ Close a connection to a client.
         
         This is called by the websocket when the connection is closed.
         The manager will remove the session from the list of connected
-        instances.
+        instances. If the session is resumable (see
+        ``Session.configure_resume()``) and the connection was lost
+        (rather than closed by the client), the session is kept as
+        pending until the client reconnects or the timeout expires.
         """
         cls, pending, connected = self._proxies[session.app_name]
         try:
             connected.remove(session)
         except ValueError:
             pass
+        if session._can_resume():
+            session._detach()
+            pending.append(session)
+            from .funcs import call_later
+            call_later(session._resume_timeout, self._expire_session,
+                       session, session._detached_time)
+        else:
+            self._close_session(session)
+        self.connections_changed._set(session.app_name)
+    
+    def _close_session(self, session):
+        self.unsubscribe(session)
         session.close()
+        self._closed_sessions[session.id] = session
+    
+    def _expire_session(self, session, detached_time):
+        """ Close a detached session if its client did not reconnect in time.
+        """
+        if session._detached_time != detached_time:
+            return  # resumed in the mean time
+        cls, pending, connected = self._proxies[session.app_name]
+        if session in pending:
+            pending.remove(session)
+        logging.info('Session %s was not resumed in time' % session.id)
+        self._close_session(session)
         self.connections_changed._set(session.app_name)
     
     def has_app_name(self, name):
@@ -188,6 +492,132 @@ class AppManager:
         cls, pending, connected = self._proxies[name]
         return list(connected)
     
+    def subscribe(self, session, signal):
+        """ Subscribe a session to a broadcast signal (see ``broadcast()``).
+        
+        The current value of the signal is sent to the session right
+        away, and subsequent values are sent each time that the signal
+        changes. Sessions are unsubscribed automatically when they are
+        closed.
+        """
+        if not isinstance(signal, BroadcastSignal):
+            raise ValueError('Can only subscribe to broadcast signals.')
+        if self._broadcasts.get(signal.name, signal) is not signal:
+            raise ValueError('Another broadcast signal named %r is already '
+                             'in use.' % signal.name)
+        self._broadcasts[signal.name] = signal
+        sessions = self._broadcast_subscribers.setdefault(signal, [])
+        if session not in sessions:
+            sessions.append(session)
+            command = self._get_broadcast_command(signal)
+            if command is not None:
+                session._send_command(command, 'broadcast ' + signal.name)
+    
+    def unsubscribe(self, session, signal=None):
+        """ Unsubscribe a session from the given broadcast signal, or
+        from all broadcast signals if ``signal`` is not given.
+        """
+        signals = [signal] if signal is not None else list(self._broadcast_subscribers)
+        for signal in signals:
+            sessions = self._broadcast_subscribers.get(signal, [])
+            while session in sessions:
+                sessions.remove(session)
+            if not sessions:
+                self._broadcast_subscribers.pop(signal, None)
+                self._broadcasts.pop(signal.name, None)
+    
+    def _get_broadcast_command(self, signal):
+        """ Get the command to send the value of a broadcast signal,
+        encoded as bytes, so that it is ready to be written to any socket.
+        """
+        if signal._value is react.undefined:
+            return None
+        command = 'BROADCAST %s %s' % (signal.name, serializer.saves(signal._value))
+        return command.encode('utf-8')
+    
+    def _broadcast(self, signal):
+        """ Send the value of the broadcast signal to all subscribed
+        sessions. Called when the signal changes.
+        """
+        sessions = self._broadcast_subscribers.get(signal, None)
+        if sessions:
+            command = self._get_broadcast_command(signal)  # serialize once
+            key = 'broadcast ' + signal.name
+            for session in list(sessions):
+                session._send_command(command, key)
+    
+    def get_diagnostics(self):
+        """ Get a dict with information that helps detect memory leaks.
+        
+        The dict contains the number of pending and connected sessions,
+        the total number of live Model instances, and for each closed
+        session that still has live Model instances: the app name, the
+        number of models per class, and an estimate of the memory that
+        these models retain. The field "retained_memory" holds the
+        estimated total (in bytes). In a healthy server, closed sessions
+        disappear from this report soon after they are closed. The field
+        "pools" holds the size, number of available sessions, hits and
+        misses of each session pool. Pending sessions include the
+        sessions that wait to be resumed, of which the number is in the
+        field "detached".
+        """
+        pending_count = connected_count = detached_count = 0
+        for cls, pending, connected in self._proxies.values():
+            pending_count += len(pending)
+            connected_count += len(connected)
+            detached_count += len([s for s in pending if s._detached_time])
+        closed = {}
+        total_memory = 0
+        for id, session in list(self._closed_sessions.items()):
+            models = list(session._models)
+            if not models:
+                continue
+            classes = {}
+            for model in models:
+                name = model.__class__.__name__
+                classes[name] = classes.get(name, 0) + 1
+            memory = sum([_estimate_size(model) for model in models])
+            total_memory += memory
+            closed[id] = dict(app_name=session.app_name, models=len(models),
+                              classes=classes, memory=memory)
+        pools = {}
+        for name, pool in self._pools.items():
+            pools[name] = dict(size=pool.size, available=len(pool.sessions),
+                               hits=pool.hits, misses=pool.misses)
+        return dict(pending=pending_count, connected=connected_count,
+                    detached=detached_count, live_models=len(Model._instances),
+                    closed_sessions=closed, retained_memory=total_memory, pools=pools)
+    
+    def _get_session_counts(self):
+        """ Get a dict (app_name, status) -> number of sessions, for metrics.
+        """
+        counts = {}
+        for name, (cls, pending, connected) in self._proxies.items():
+            if name != '__default__':
+                detached = len([s for s in pending if s._detached_time])
+                counts[(name, 'pending')] = len(pending) - detached
+                counts[(name, 'detached')] = detached
+                counts[(name, 'connected')] = len(connected)
+                counts[(name, 'closed')] = 0
+                counts[(name, 'pooled')] = 0
+        for name, pool in self._pools.items():
+            counts[(name, 'pooled')] = len(pool.sessions)
+        for session in list(self._closed_sessions.values()):
+            key = session.app_name, 'closed'
+            counts[key] = counts.get(key, 0) + 1
+        return counts
+    
+    def _get_queue_totals(self, field):
+        """ Get a dict (app_name, ) -> total of the given queue stat
+        over the pending and connected sessions, for metrics.
+        """
+        totals = {}
+        for name, (cls, pending, connected) in self._proxies.items():
+            if name != '__default__':
+                totals[(name, )] = sum([s._queue.get_stats()[field]
+                                        for s in pending + connected])
+        return totals
+    
     @react.source
     def connections_changed(self, name):
         """ Emits the name of the app for which a connection is added
@@ -196,9 +626,30 @@ class AppManager:
         return str(name)
 
 
+def _estimate_size(model):
+    """ Rough estimate of the memory used by a Model instance, including
+    its signals and their values (but not objects that these refer to).
+    """
+    size = sys.getsizeof(model) + sys.getsizeof(model.__dict__)
+    for val in model.__dict__.values():
+        if isinstance(val, react.Signal):
+            size += sys.getsizeof(val) + sys.getsizeof(val.__dict__)
+            size += sys.getsizeof(val._value)
+        else:
+            size += sys.getsizeof(val)
+    return size
+
+
 # Create global app manager object
 manager = AppManager()
 
+metrics.Gauge('flexx_sessions', 'Number of sessions per app and status.',
+              ('app', 'status'), func=manager._get_session_counts)
+metrics.Gauge('flexx_queue_depth', 'Number of queued outgoing commands.',
+              ('app', ), func=lambda: manager._get_queue_totals('depth'))
+metrics.Gauge('flexx_queue_bytes', 'Number of outgoing bytes queued or in transit.',
+              ('app', ), func=lambda: manager._get_queue_totals('nbytes'))
+
 
 class Session(SessionAssets):
     """ A session between Python and the client runtime
@@ -209,6 +660,17 @@ class Session(SessionAssets):
     
     STATUS = new_type('Enum', (), {'PENDING': 1, 'CONNECTED': 2, 'CLOSED': 0})
     
+    # Whether to send the construction of a tree of models as one command
+    CONSTRUCT_BATCHING = True
+    
+    # Defaults for resuming sessions (see configure_resume())
+    RESUME_TIMEOUT = 0
+    RESUME_BUFFER_SIZE = 1000
+    
+    # Close codes for which a session is not resumed: closed by the
+    # client, going away, protocol failure, and send queue overflow.
+    FINAL_CLOSE_CODES = 1000, 1001, 1003, 1008
+    
     def __init__(self, app_name):
         super().__init__()
         
@@ -222,11 +684,32 @@ class Session(SessionAssets):
         self._ws = None  # init websocket, will be set when a connection is made
         self._model = None  # Model instance, None if app_name is __default__
         
-        # While the client is not connected, we keep a queue of
-        # commands, which are send to the client as soon as it connects
-        self._pending_commands = []
+        # The Model instances in this session (weak, to detect leaks)
+        self._models = weakref.WeakSet()
+        
+        # Outgoing commands are queued while the client is not connected,
+        # and while the previously sent commands are still being written
+        self._queue = CommandQueue()
+        self._writing = False
+        self._write_future = None
+        
+        # To resume after the connection is lost, we count the sent
+        # commands and keep the most recent ones, to resend the missed ones
+        self._seq = 0
+        self._sent = None
+        self._resume_timeout = 0
+        self._resume_buffer_size = self.RESUME_BUFFER_SIZE
+        self._detached_time = None  # set while waiting to be resumed
+        if self.RESUME_TIMEOUT:
+            self.configure_resume(self.RESUME_TIMEOUT)
+        
+        # Commands to construct a tree of models, collected while constructing
+        self._construct = None
+        self._construct_depth = 0
+        self._construct_signals = None
         
         self._creation_time = time.time()
+        self._closed = False  # set by close(), also if never connected
     
     def __repr__(self):
         s = self.status.lower()
@@ -252,23 +735,59 @@ class Session(SessionAssets):
         """
         return self._runtime
     
-    def _set_ws(self, ws):
+    def _set_ws(self, ws, seq=None):
         """ A session is always first created, so we know what page to
         serve. The client will connect the websocket, and communicate
         the session_id so it can be connected to the correct Session
-        via this method
+        via this method. When the client resumes the session, ``seq``
+        is the number of messages that it received.
         """
         if self._ws is not None:
             raise RuntimeError('Session is already connected.')
+        if seq is not None:
+            if self._detached_time is None:
+                raise RuntimeError('Session %s is not waiting to be resumed.' % self.id)
+            missed = self._get_missed_commands(seq)
+        elif self._detached_time is not None:
+            raise RuntimeError('Session %s can only be resumed.' % self.id)
         # Set websocket object - this is what changes the status to CONNECTED
         self._ws = ws  
+        self._detached_time = None
         # todo: make icon and title work again. Also in exported docs.
         # Set some app specifics
         # self._ws.command('ICON %s.ico' % self.id)
         # self._ws.command('TITLE %s' % self._config.title)
-        # Send pending commands
-        for command in self._pending_commands:
-            self._ws.command(command)
+        # Resend the commands that the client missed, then the pending commands
+        if seq is not None:
+            self._write(missed)
+        self._flush()
+    
+    def _get_missed_commands(self, seq):
+        """ Get the commands that were sent after the first seq commands.
+        """
+        sent = self._sent or ()
+        n = self._seq - seq
+        if not 0 <= n <= len(sent):
+            raise RuntimeError('Cannot resume session %s from message %i; '
+                               'sent %i messages, of which the last %i are '
+                               'kept.' % (self.id, seq, self._seq, len(sent)))
+        return list(sent)[len(sent) - n:]
+    
+    def _can_resume(self):
+        """ Whether the session can be resumed after its connection closed.
+        """
+        code = self._ws.close_code if self._ws is not None else None
+        return bool(self._resume_timeout) and code not in self.FINAL_CLOSE_CODES
+    
+    def _detach(self):
+        """ Forget the websocket, so that commands are queued until the
+        client resumes the session.
+        """
+        self._ws = None
+        self._writing = False
+        self._write_future = None
+        self._queue.done()
+        self._detached_time = time.time()
    
     def _set_app(self, model):
         if self._model is not None:
@@ -285,11 +804,17 @@ class Session(SessionAssets):
         """ Close the runtime, if possible
         """
         # todo: close via JS
+        self._closed = True
         if self._runtime:
             self._runtime.close()
-        if self._model:
-            self._model.disconnect_signals()
-            self._model = None  # break circular reference
+        # Disconnect signals of all models (not just the app) so that
+        # connections between them do not keep the widget tree alive
+        for model in list(self._models):
+            model.disconnect_signals()
+            model._cancel_js_calls('session closed')
+            model._cancel_js_signal_requests('session closed')
+        self._model = None  # break circular reference
+        self._queue.clear()
     
     @property
     def status(self):
@@ -298,6 +823,9 @@ class Session(SessionAssets):
         * status 1: pending
         * statys 2: connected
         * status 0: closed
+        
+        A resumable session that lost its connection is pending until
+        the client reconnects.
         """
         if self._ws is None:
             return self.STATUS.PENDING  # not connected yet
@@ -306,16 +834,114 @@ class Session(SessionAssets):
         else:
             return self.STATUS.CLOSED  # connection closed
     
-    def _send_command(self, command):
-        """ Send the command, add to pending queue.
+    def configure_queue(self, high_watermark=None, low_watermark=None, policy=None):
+        """ Configure the queue for outgoing commands. See ``CommandQueue``
+        for details.
+        
+        Parameters:
+            high_watermark (int): the number of bytes that can be queued
+                or in transit before the overflow policy applies.
+            low_watermark (int): the number of bytes to get below to
+                stop applying the overflow policy.
+            policy (str): 'coalesce', 'drop', or 'disconnect'.
+        """
+        self._queue.configure(high_watermark, low_watermark, policy)
+    
+    def get_queue_stats(self):
+        """ Get a dict with metrics of the queue for outgoing commands:
+        depth (number of queued commands), nbytes (queued or in transit),
+        max_nbytes, congested, congestion_count, coalesced and dropped.
         """
-        if self.status == self.STATUS.CONNECTED:
-            self._ws.command(command)
-        elif self.status == self.STATUS.PENDING:
-            self._pending_commands.append(command)
+        return self._queue.get_stats()
+    
+    def configure_resume(self, timeout=None, buffer_size=None):
+        """ Make this session resumable. When the connection is lost
+        (e.g. due to a network hiccup or a laptop going to sleep), the
+        session is kept for ``timeout`` seconds. In that time, the client
+        tries to reconnect, and the server resends the commands that
+        the client missed, so that the app does not have to be rebuilt.
+        Commands sent by the client while the connection was down, but
+        before the client noticed, are lost.
+        
+        The defaults for new sessions can be set via the
+        ``RESUME_TIMEOUT`` and ``RESUME_BUFFER_SIZE`` class attributes.
+        
+        Parameters:
+            timeout (float): the number of seconds to wait for the client
+                to reconnect. Zero (the default) means that the session is
+                closed when the connection is lost.
+            buffer_size (int): the number of most recently sent commands
+                to keep. If the client missed more, the session cannot be
+                resumed. Default 1000.
+        """
+        timeout = self._resume_timeout if timeout is None else float(timeout)
+        if buffer_size is None:
+            buffer_size = self._resume_buffer_size
+        buffer_size = int(buffer_size)
+        if timeout < 0:
+            raise ValueError('Resume timeout must not be negative.')
+        if buffer_size < 1:
+            raise ValueError('Resume buffer size must be at least 1.')
+        self._resume_buffer_size = buffer_size
+        if timeout:
+            self._sent = deque(self._sent or (), buffer_size)
         else:
+            self._sent = None
+        if timeout != self._resume_timeout:
+            self._resume_timeout = timeout
+            self._send_command('RESUME %s' % timeout)  # let the client know
+    
+    def _send_command(self, command, key=None):
+        """ Send the command, via the queue. Commands with the same key
+        (e.g. updates of the same signal) may be coalesced or dropped
+        when the client cannot keep up.
+        """
+        if self._closed or self.status == self.STATUS.CLOSED:
             #raise RuntimeError('Cannot send commands; app is closed')
             logging.warn('Cannot send commands; app is closed')
+        elif not self._queue.put(command, key):
+            logging.warn('Closing session %s; the client cannot keep up.' % self.id)
+            self._queue.clear()
+            self._resume_timeout = 0  # the cleared commands cannot be resent
+            if self._ws is not None:
+                self._ws.close(1008, 'Send queue overflow')
+        else:
+            self._flush()
+    
+    def _flush(self):
+        """ Write the queued commands, unless the previous commands are
+        still being written, so that the websocket does not buffer more
+        than one batch.
+        """
+        if self._writing or self.status != self.STATUS.CONNECTED:
+            return
+        commands = self._queue.pop_all()
+        self._seq += len(commands)
+        if self._sent is not None:
+            self._sent.extend(commands)  # can be resent if they get lost
+        self._write(commands)
+    
+    def _write(self, commands):
+        future = None
+        try:
+            for command in commands:
+                future = self._ws.command(command)
+        except Exception as err:  # e.g. the websocket was closed
+            logging.warn('Could not send commands: %s' % err)
+            future = None
+        if future is None:
+            self._queue.done()
+        else:
+            self._writing = True
+            self._write_future = future
+            future.add_done_callback(self._on_written)
+    
+    def _on_written(self, future):
+        if future is not self._write_future:
+            return  # written to a connection that has been lost
+        self._writing = False
+        self._queue.done()
+        self._flush()
     
     def _receive_command(self, command):
         """ Received a command from JS.
@@ -330,6 +956,16 @@ class Session(SessionAssets):
             print(command[5:].strip())
         elif command.startswith('INFO '):
             logging.info('JS - ' + command[5:].strip())
+        elif command.startswith('MULTI '):
+            # A batch of commands, combined by the client
+            for subcommand in json.loads(command[6:]):
+                self._receive_command(subcommand)
+        elif command.startswith('RESULT '):
+            # Return value of an offloaded method
+            _, id, call_id, ok, txt = command.split(' ', 4)
+            ob = Model._instances.get(id, None)
+            if ob is not None:
+                ob._set_call_result_from_js(call_id, ok, txt)
         elif command.startswith('SIGNAL '):
             # todo: seems weird to deal with here. implement by registring some handler?
             _, id, esid, signal_name, txt = command.split(' ', 4)
@@ -339,10 +975,53 @@ class Session(SessionAssets):
         else:
             logging.warn('Unknown command received from JS:\n%s' % command)
     
-    def _exec(self, code):
+    def _begin_construct(self):
+        """ Start collecting the commands to construct models. Calls
+        can be nested; the commands are sent when the outer call ends.
+        
+        While collecting, ``_construct`` is a dict with lists
+        "instances" ([id, class_name] for each new model), "steps"
+        (signal updates, and JS code to execute, in order), and
+        "connect" (ids of models to connect the signals of). The client
+        creates all instances, then applies the steps, and finally
+        connects the signals.
+        """
+        self._construct_depth += 1
+        if self._construct_depth == 1 and self.CONSTRUCT_BATCHING:
+            self._construct = dict(instances=[], steps=[], connect=[])
+            self._construct_signals = {}  # (id, name) -> index in steps
+    
+    def _construct_signal(self, id, name, txt, esid):
+        """ Add a signal update to the construction. Only the latest
+        value of each signal is sent.
+        """
+        steps = self._construct['steps']
+        index = self._construct_signals.get((id, name), None)
+        if index is not None:
+            steps[index] = None
+        self._construct_signals[(id, name)] = len(steps)
+        steps.append([id, name, txt, esid])
+    
+    def _end_construct(self):
+        """ Stop collecting construction commands and send them as one
+        command.
+        """
+        self._construct_depth -= 1
+        if self._construct_depth == 0 and self._construct is not None:
+            construct, self._construct = self._construct, None
+            self._construct_signals = None
+            construct['steps'] = [step for step in construct['steps']
+                                  if step is not None]
+            if construct['instances'] or construct['steps'] or construct['connect']:
+                self._send_command('CONSTRUCT ' + json.dumps(construct))
+    
+    def _exec(self, code, key=None):
         """ Like eval, but without returning the result value.
         """
-        self._send_command('EXEC ' + code)
+        if self._construct is not None:
+            self._construct['steps'].append(code)
+        else:
+            self._send_command('EXEC ' + code, key)
     
     def eval(self, code):
         """ Evaluate the given JavaScript code in the client
@@ -43,6 +43,8 @@ def test_asset_store_simple():
     
     s = AssetStore()
     assert len(s.get_asset_names()) == 1  # reset.css
+    assert s.has_asset('reset.css')
+    assert not s.has_asset('foo.css')
     assert not s._cache
     
     raises(IndexError, s.load_asset, 'foo.js')
@@ -100,6 +102,21 @@ def test_asset_store_export():
     s.export(dir)
     assert len(os.listdir(dir)) == 3
     
+    # Export with content-hashed names
+    hashed_name = s.get_hashed_name('foo.js')
+    assert hashed_name.startswith('foo-') and hashed_name.endswith('.js')
+    assert s.get_hashed_name('foo.css') == hashed_name[:-3] + '.css'
+    s.add_asset('bar.js', b'yy\n')
+    assert s.get_hashed_name('bar.js') != hashed_name
+    s.export(dir, ['foo.js', 'bar.js'], hashed=True)
+    assert len(os.listdir(dir)) == 5
+    assert hashed_name in os.listdir(dir)
+    
+    # Remove asset
+    s.remove_asset('bar.js')
+    assert not s.has_asset('bar.js')
+    s.remove_asset('bar.js')  # no-op
+    
     # Fail
     raises(ValueError, s.export, os.path.join(dir, 'doesnotexist'))
 
@@ -156,6 +173,15 @@ def test_session_assets():
     s.add_global_asset('eggs.js', b'12345\x00')
     assert s.get_used_asset_names()[-1] == 'eggs.js'
     assert store.load_asset('eggs.js') == b'12345\x00'
+    
+    # Insert before another asset
+    s.add_global_asset('ham.js', b'123456\x00', before='spam.js')
+    names = s.get_used_asset_names()
+    assert names.index('ham.js') == names.index('spam.js') - 1
+    assert names[-1] == 'eggs.js'
+    s.use_global_asset('ham.js', before='eggs.js')  # already used, no change
+    assert s.get_used_asset_names() == names
+    raises(ValueError, s.use_global_asset, 'reset.css', before='unknown.js')
     raises(ValueError, s.use_global_asset, 3)
     
     # Remote assets
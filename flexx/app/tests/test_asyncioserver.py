@@ -0,0 +1,231 @@
+""" Test the asyncio server, mostly without a client.
+"""
+
+import os
+import sys
+import time
+import struct
+import socket
+import threading
+
+from pytest import raises, skip
+from flexx.util.testing import run_tests_if_main
+
+if sys.version_info < (3, 4):
+    skip('asyncio needs Python 3.4+', allow_module_level=True)
+
+import asyncio
+
+from flexx.app import funcs
+from flexx.app.asyncioserver import AsyncioServer, RequestHandler, WebSocket
+from flexx.app.asyncioserver import HTTPProtocol, PeriodicTimer, _unmask
+
+
+class FakeTransport:
+
+    def __init__(self):
+        self.data = b''
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+
+    def is_closing(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+class RecordingWebSocket(WebSocket):
+
+    def __init__(self, protocol):
+        WebSocket.__init__(self, protocol)
+        self.messages = []
+        self.pongs = []
+
+    def on_message(self, message):
+        self.messages.append(message)
+
+    def on_pong(self, data):
+        self.pongs.append(data)
+
+
+def frame(opcode, payload, fin=True, mask=b'abcd'):
+    """ Create a frame like a client would.
+    """
+    head = struct.pack('!B', (0x80 if fin else 0) | opcode)
+    if len(payload) < 126:
+        head += struct.pack('!B', 0x80 | len(payload))
+    else:
+        head += struct.pack('!BH', 0x80 | 126, len(payload))
+    return head + mask + _unmask(mask, payload)
+
+
+def create_ws():
+    server = AsyncioServer(asyncio.new_event_loop())
+    protocol = HTTPProtocol(server)
+    protocol.connection_made(FakeTransport())
+    return RecordingWebSocket(protocol)
+
+
+def test_unmask():
+    assert _unmask(b'abcd', b'') == b''
+    data = os.urandom(1001)
+    assert _unmask(b'\x00\x00\x00\x00', data) == data
+    masked = _unmask(b'wxyz', data)
+    assert masked != data
+    assert masked[:4] == bytes([data[i] ^ b'wxyz'[i] for i in range(4)])
+    assert _unmask(b'wxyz', masked) == data
+
+
+def test_websocket_frames():
+    ws = create_ws()
+
+    # Text and binary messages, also when arriving in pieces
+    data = frame(0x1, 'hi ☃'.encode()) + frame(0x2, b'x' * 300)
+    for i in range(0, len(data), 7):
+        ws.data_received(data[i:i+7])
+    assert ws.messages == ['hi ☃', b'x' * 300]
+
+    # Fragmented message
+    ws.data_received(frame(0x1, b'foo', False) + frame(0x9, b'p') +
+                     frame(0x0, b'bar', False) + frame(0x0, b'!'))
+    assert ws.messages[-1] == 'foobar!'
+    assert ws.transport.data == b'\x8a\x01p'  # pong in between
+
+    # Pong
+    ws.data_received(frame(0xA, b'x'))
+    assert ws.pongs == [b'x']
+
+    # Sending
+    ws.transport.data = b''
+    assert ws.command('EXEC foo') is None
+    assert ws.transport.data == b'\x82\x08EXEC foo'
+
+    # Close handshake initiated by client
+    ws.transport.data = b''
+    ws.data_received(frame(0x8, struct.pack('!H', 1001) + b'bye'))
+    assert ws.close_code == 1001 and ws.close_reason == 'bye'
+    assert ws.transport.data == b'\x88\x02\x03\xe9'
+    assert ws.transport.closed
+    with raises(RuntimeError):
+        ws.command('EXEC foo')
+
+
+def test_websocket_invalid_frames():
+
+    # Frames must be masked
+    ws = create_ws()
+    ws.data_received(b'\x81\x02hi')
+    assert ws.messages == []
+    assert ws.transport.data[2:4] == struct.pack('!H', 1002)
+
+    # Text must be utf-8
+    ws = create_ws()
+    ws.data_received(frame(0x1, b'\xff\xfe'))
+    assert ws.messages == []
+    assert ws.transport.data[2:4] == struct.pack('!H', 1007)
+
+    # Continuation without start
+    ws = create_ws()
+    ws.data_received(frame(0x0, b'foo'))
+    assert ws.messages == []
+    assert ws.transport.data[2:4] == struct.pack('!H', 1002)
+
+
+def test_request_handler():
+    server = AsyncioServer(asyncio.new_event_loop())
+    server.serving_at = 'localhost', 8080
+
+    handler = RequestHandler(server, {'host': 'localhost:8080'}, 'session_id=x&a=1&a=2')
+    assert handler.get_argument('a') == '2'
+    assert handler.get_argument('session_id') == 'x'
+    assert handler.get_argument('b', 'foo') == 'foo'
+
+    handler.handle_get('')
+    assert handler.status == 200
+    assert b'Index of available apps' in handler.get_body()
+
+    # Metrics are only served to localhost
+    handler = RequestHandler(server, {'host': 'localhost:8080'}, '')
+    handler.handle_get('__metrics__')
+    assert b'# TYPE flexx_sessions gauge' in handler.get_body()
+    handler = RequestHandler(server, {'host': 'example.com:8080'}, '')
+    handler.handle_get('__metrics__')
+    assert handler.get_body() == b'403'
+
+    handler = RequestHandler(server, {}, '')
+    handler.handle_get('foo/not_an_asset.js')
+    assert handler.status == 404
+    assert b'404' in handler.get_body()
+
+    handler = RequestHandler(server, {}, '')
+    handler.send_error(500, exc_info=(ValueError, ValueError('oops'), None))
+    assert handler.status == 500
+    assert b'oops' in handler.get_body()
+
+
+def test_call_later_and_timer():
+    loop = asyncio.new_event_loop()
+    server = AsyncioServer(loop)
+    calls = []
+
+    server.call_later(0, calls.append, 1)
+    server.call_later(0.01, lambda x, y=0: calls.append(x + y), 2, y=1)
+    timer = PeriodicTimer(loop, lambda: calls.append('tick'), 0.005)
+    loop.call_later(0.1, loop.stop)
+    loop.run_forever()
+    timer.stop()
+    assert calls[:1] == [1]
+    assert 3 in calls
+    assert calls.count('tick') > 2
+    loop.close()
+
+
+def test_backend_selection():
+    server = funcs.server
+
+    with raises(ValueError):
+        funcs._use_backend('foo')
+    assert funcs.server is server
+
+    try:
+        funcs._use_backend('asyncio')
+        assert isinstance(funcs.server, AsyncioServer)
+        funcs._use_backend('tornado')
+        assert funcs.server is server
+    finally:
+        funcs.server = server
+
+
+def test_serving():
+    loop = asyncio.new_event_loop()
+    server = AsyncioServer(loop)
+    server.open('localhost', None)
+    with raises(RuntimeError):
+        server.open('localhost', None)
+    host, port = server.serving_at
+
+    t = threading.Thread(target=server.start)
+    t.start()
+    try:
+        s = socket.create_connection((host, port))
+        s.settimeout(5)
+        s.sendall(b'GET /foo/not_an_asset.js HTTP/1.1\r\nHost: localhost\r\n\r\n' +
+                  b'POST / HTTP/1.1\r\nContent-Length: 0\r\n\r\n')
+        data = b''
+        while data.count(b'HTTP/1.1') < 2:
+            data += s.recv(4096)
+        assert data.startswith(b'HTTP/1.1 404 Not Found\r\n')
+        assert b'HTTP/1.1 405 Method Not Allowed\r\n' in data
+        s.close()
+    finally:
+        server.stop()
+        t.join(5)
+    assert not t.is_alive()
+    time.sleep(0.01)
+    loop.close()
+
+
+run_tests_if_main()
@@ -0,0 +1,96 @@
+""" Test the load test tool against an app that is served in-process.
+"""
+
+import sys
+
+from pytest import raises, skip
+from flexx.util.testing import run_tests_if_main
+
+if sys.version_info < (3, 4):
+    skip('asyncio needs Python 3.4+', allow_module_level=True)
+
+import asyncio
+
+from flexx import app, react
+from flexx.app.asyncioserver import AsyncioServer
+from flexx.app.loadtest import LoadTest, percentile
+
+
+class LoadTestApp(app.Model):
+
+    @react.input
+    def value(v=0):
+        return v
+
+    @react.input
+    def text(v=''):
+        return str(v)
+
+app.serve(LoadTestApp)
+
+
+def serve():
+    loop = asyncio.new_event_loop()
+    server = AsyncioServer(loop)
+    server.open('localhost', None)
+    return server, 'http://localhost:%i/LoadTestApp/' % server.serving_at[1]
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+    assert percentile(values, 0) == 1
+    assert percentile([3], 90) == 3
+
+
+def test_loadtest_url():
+    with raises(ValueError):
+        LoadTest('ws://localhost:8080/Foo/ws')
+    test = LoadTest('http://localhost:8080/Foo', loop=asyncio.new_event_loop())
+    assert test.path == '/Foo/' and test.ws_path == '/Foo/ws'
+    assert test.netloc == 'localhost:8080'
+
+
+def test_loadtest_signal():
+    server, url = serve()
+    test = LoadTest(url, clients=5, rate=20, duration=0.5, ramp=0.1,
+                    signal='value', loop=server.loop)
+    stats = test.run()
+    server.heartbeat.stop()
+
+    assert stats['connected'] == 5
+    assert stats['errors'] == 0
+    assert stats['sent'] > 20
+    assert stats['received'] >= stats['sent']
+    assert stats['echoed'] == stats['sent']  # values change; all are echoed
+    assert 0 < stats['latency_p50'] <= stats['latency_p99'] <= stats['latency_p100']
+    assert stats['connect_p50'] > 0
+    assert 'Echoed:' in test.report()
+
+
+def test_loadtest_script():
+    server, url = serve()
+    script = [('text', 'foo'), ('text', 'bar'), ('value', 3)]
+    test = LoadTest(url, clients=2, rate=20, duration=0.3, ramp=0.0,
+                    script=script, loop=server.loop)
+    stats = test.run()
+    server.heartbeat.stop()
+
+    assert stats['connected'] == 2 and stats['errors'] == 0
+    assert stats['sent'] >= 6  # each client runs the script at least once
+    assert stats['echoed'] == stats['sent']
+
+
+def test_loadtest_errors():
+    server, url = serve()
+    test = LoadTest(url.replace('LoadTestApp', 'NotAnApp'), clients=2,
+                    duration=0.1, ramp=0.0, loop=server.loop)
+    stats = test.run()
+    assert stats['connected'] == 0 and stats['errors'] == 2
+    assert 'could not' in test.report()
+
+
+run_tests_if_main()
@@ -0,0 +1,109 @@
+""" Test the metrics registry and the metrics of the app module.
+"""
+
+from pytest import raises
+from flexx.util.testing import run_tests_if_main
+
+from flexx import app
+from flexx.app import metrics
+from flexx.app.tornadoserver import command_type, IN_COMMANDS, OUT_COMMANDS
+
+
+def test_counter_and_gauge():
+    registry = metrics.Registry()
+    c = metrics.Counter('test_total', 'A test counter.', ('kind', ), registry)
+    g = metrics.Gauge('test_level', 'A test gauge.', registry=registry)
+    
+    c.inc(labels=('a', ))
+    c.inc(3, ('a', ))
+    c.inc(2, ('b"c', ))
+    g.set(0.5)
+    assert c.get(('a', )) == 4
+    assert c.get(('x', )) == 0
+    
+    with raises(ValueError):
+        c.inc(-1, ('a', ))
+    with raises(ValueError):
+        c.inc(1)  # missing label
+    with raises(ValueError):
+        metrics.Counter('test_total', 'Again', registry=registry)
+    
+    text = registry.render()
+    assert text.splitlines() == ['# HELP test_total A test counter.',
+                                 '# TYPE test_total counter',
+                                 'test_total{kind="a"} 4',
+                                 'test_total{kind="b\\"c"} 2',
+                                 '# HELP test_level A test gauge.',
+                                 '# TYPE test_level gauge',
+                                 'test_level 0.5']
+    
+    registry.unregister(c)
+    assert registry.get('test_total') is None
+    assert registry.get('test_level') is g
+
+
+def test_gauge_func():
+    registry = metrics.Registry()
+    values = {('x', ): 3}
+    metrics.Gauge('test_level', 'A test gauge.', ('name', ), registry,
+                  func=lambda: values)
+    assert 'test_level{name="x"} 3' in registry.render()
+    values = {('y', ): 4}
+    text = registry.render()
+    assert 'test_level{name="x"}' not in text
+    assert 'test_level{name="y"} 4' in text
+
+
+def test_histogram():
+    registry = metrics.Registry()
+    h = metrics.Histogram('test_seconds', 'A histogram.', registry=registry,
+                          buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 3):
+        h.observe(value)
+    assert h.get_count() == 4
+    assert h.get_sum() == 4.05
+    
+    lines = registry.render().splitlines()[2:]
+    assert lines == ['test_seconds_bucket{le="0.1"} 1',
+                     'test_seconds_bucket{le="1"} 3',
+                     'test_seconds_bucket{le="+Inf"} 4',
+                     'test_seconds_sum 4.05',
+                     'test_seconds_count 4']
+
+
+def test_command_type():
+    assert command_type('SIGNAL a b c', IN_COMMANDS) == 'SIGNAL'
+    assert command_type('hiflexx 123', IN_COMMANDS) == 'hiflexx'
+    assert command_type('FOO bar', IN_COMMANDS) == 'other'
+    assert command_type(b'BROADCAST x {}', OUT_COMMANDS) == 'BROADCAST'
+    assert command_type('EXEC', OUT_COMMANDS) == 'EXEC'
+
+
+def test_app_metrics():
+    
+    class MetricsApp(app.Model):
+        pass
+    
+    app.serve(MetricsApp)
+    transpile = metrics.registry.get('flexx_transpile_duration_seconds')
+    assert transpile.get_count() > 0
+    
+    session = app.manager.create_session('MetricsApp')
+    depth = session.get_queue_stats()['depth']  # commands wait for the client
+    
+    text = metrics.registry.render()
+    assert 'flexx_sessions{app="MetricsApp",status="pending"} 1' in text
+    assert 'flexx_sessions{app="MetricsApp",status="connected"} 0' in text
+    assert 'flexx_queue_depth{app="MetricsApp"} %i' % depth in text
+    for name in ('flexx_messages_received_total', 'flexx_sent_bytes_total',
+                 'flexx_command_duration_seconds', 'flexx_page_duration_seconds',
+                 'flexx_asset_loads_total'):
+        assert '# TYPE %s ' % name in text
+    
+    loads = metrics.registry.get('flexx_asset_loads_total')
+    n = loads.get(('hit', ))
+    app.assets.load_asset('reset.css')
+    assert loads.get(('hit', )) == n + 1
+
+
+run_tests_if_main()
@@ -61,6 +61,21 @@ class Foo4(Foo3):
             return v + 2
 
 
+class Foo5(Model):
+    
+    @react.syncmode('rate', 10)
+    @react.nosync
+    @react.input
+    def speed(v=0):
+        return v
+    
+    class JS:
+        
+        @react.syncmode('frame')
+        @react.source
+        def pos(v=0):
+            return v
+
 
 def test_signal_pairing1():
     
@@ -159,4 +174,17 @@ def test_no_duplicate_code():
     assert '_red_func' in Foo4.JS.CODE
 
 
+def test_syncmode():
+    # Sync flags are copied to the proxy, but nosync is not
+    assert Foo5.speed.flags == {'syncmode': 'rate', 'syncrate': 10.0,
+                                'nosync': True}
+    assert Foo5.JS.speed.flags == {'syncmode': 'rate', 'syncrate': 10.0}
+    assert Foo5.JS.pos.flags == {'syncmode': 'frame'}
+    assert Foo5.pos.flags == {}
+    
+    assert '_speed_func.flags' in Foo5.JS.CODE
+    assert '\\"syncrate\\": 10.0' in Foo5.JS.CODE
+    assert '_schedule_sync' in Model.JS.CODE
+
+
 run_tests_if_main()
@@ -0,0 +1,743 @@
+""" Test the Session class and the app manager.
+"""
+
+import os
+import gc
+import json
+import shutil
+import tempfile
+from concurrent.futures import Future
+
+from flexx.util.testing import run_tests_if_main, raises
+
+from flexx import app, react
+from flexx.app.session import Session, AppManager, CommandQueue
+from flexx.app.assetstore import assets, compact_commands, get_export_js
+from flexx.pyscript import evaljs
+
+
+class SessionTester(app.Model):
+    
+    @react.input
+    def foo(v=0):
+        return v
+    
+    @react.input
+    def bar(v=0):
+        return v
+    
+    class JS:
+        
+        @react.source
+        def spam(v=0):
+            return v
+
+
+def test_receive_multi():
+    session = Session('xx')
+    m = SessionTester(session=session)
+    assert m.foo() == 0 and m.bar() == 0
+    
+    cmd1 = 'SIGNAL %s 1 foo 3' % m.id
+    cmd2 = 'SIGNAL %s 2 bar "x"' % m.id
+    session._receive_command('MULTI ' + json.dumps([cmd1, cmd2]))
+    assert m.foo() == 3
+    assert m.bar() == 'x'
+    
+    # In JS, signals, log messages and return values are batched in order
+    code = 'var root = global, location = {hostname: "", port: "", pathname: ""};\n'
+    code += assets.load_asset('flexx-app.js').decode() + '\n'
+    code += 'global.flexx = flexx; setTimeout(process.exit, 10);  // FlexxJS stays alive\n'
+    code += 'flexx.initSocket = function () {};\n'
+    code += 'var sent = [];\n'
+    code += 'flexx.ws = {readyState: 1, send: sent.push.bind(sent), close: function () {}};\n'
+    code += 'flexx.init();\n'
+    code += 'flexx.send("SIGNAL x"); console.log("hi"); flexx.command("EVAL 3");\n'
+    code += 'console.info("ho"); flexx._flush_send_queue();\n'
+    code += 'console.log = console.ori_log; console.info = console.ori_info;\n'
+    code += 'sent.join("\\n");'
+    sent = evaljs(code).splitlines()[2:]  # after the logged "hi" and "ho"
+    assert len(sent) == 1 and sent[0].startswith('MULTI ')
+    assert json.loads(sent[0][6:]) == ['SIGNAL x', 'PRINT hi', 'RET 3', 'INFO ho']
+
+
+def test_lazy_js_signal():
+    session = Session('xx')
+    m = SessionTester(session=session)
+    
+    @react.connect('m.spam')
+    def spam_copy(v):
+        return v
+    
+    assert m.spam._linked
+    assert not m.spam.lazy
+    
+    # Going lazy unlinks the signal, and tells JS
+    n = len(session._queue.get_commands())
+    m.spam.set_lazy()
+    assert m.spam.lazy and not m.spam._linked
+    assert '_set_signal_lazy("spam", true)' in session._queue.get_commands()[n]
+    
+    # Request a value
+    f1 = m.spam.request()
+    f2 = m.spam.request()
+    assert not f1.done()
+    assert '_request_signal("spam")' in session._queue.get_commands()[-1]
+    
+    # Reply from JS resolves the futures
+    session._receive_command('SIGNAL %s 1 spam 42' % m.id)
+    assert f1.result() == 42 and f2.result() == 42
+    assert m.spam() == 42
+    assert spam_copy() == 42
+    
+    # If setting the value fails, so do the requests
+    def fail(value):
+        raise ValueError('invalid value')
+    f1 = m.spam.request()
+    m.spam._set = fail
+    raises(ValueError, session._receive_command, 'SIGNAL %s 1 spam 43' % m.id)
+    del m.spam._set
+    assert isinstance(f1.exception(0), ValueError)
+    
+    # Going back to push mode links again
+    m.spam.set_lazy(False)
+    assert not m.spam.lazy and m.spam._linked
+    assert '_set_signal_lazy("spam", false)' in session._queue.get_commands()[-2]
+    
+    # Pending requests fail when the session closes, new ones right away
+    f3 = m.spam.request()
+    session.close()
+    assert isinstance(f3.exception(0), RuntimeError)
+    assert isinstance(m.spam.request().exception(0), RuntimeError)
+
+
+
+class FakeWebSocket:
+    
+    close_code = None
+    
+    def command(self, cmd):
+        pass
+
+
+def test_diagnostics():
+    manager = AppManager()
+    manager.register_app_class(SessionTester)
+    session = manager.create_session('SessionTester')
+    d = manager.get_diagnostics()
+    assert d['pending'] == 1 and d['connected'] == 0
+    
+    ws = FakeWebSocket()
+    manager.connect_client(ws, 'SessionTester', session.id)
+    m = SessionTester(session=session)
+    d = manager.get_diagnostics()
+    assert d['pending'] == 0 and d['connected'] == 1
+    assert d['closed_sessions'] == {}
+    assert d['live_models'] >= 2
+    
+    # Close; our reference to m keeps it alive
+    ws.close_code = 1000
+    manager.disconnect_client(session)
+    gc.collect()
+    d = manager.get_diagnostics()
+    assert d['connected'] == 0
+    info = d['closed_sessions'][session.id]
+    assert info['app_name'] == 'SessionTester'
+    assert info['models'] == 1
+    assert info['classes'] == {'SessionTester': 1}
+    assert info['memory'] > 0
+    assert d['retained_memory'] == info['memory']
+    
+    # Release it
+    del m
+    gc.collect()
+    d = manager.get_diagnostics()
+    assert d['closed_sessions'] == {}
+    assert d['retained_memory'] == 0
+
+
+def test_session_pool():
+    manager = AppManager()
+    manager.register_app_class(SessionTester, pool_size=2, pool_max_age=100)
+    pool = manager._pools['SessionTester']
+    
+    # The pool is only filled when no sessions were handed out recently
+    session = manager.create_session('SessionTester')
+    manager._fill_pool('SessionTester', pool.token)
+    assert len(pool.sessions) == 0
+    pool.IDLE_TIME = 0
+    
+    def fill():  # what the event loop would do
+        manager._fill_pool('SessionTester', pool.token)
+    
+    fill()
+    fill()
+    assert len(pool.sessions) == 2
+    fill()  # no-op when full
+    assert len(pool.sessions) == 2
+    assert manager.get_diagnostics()['pending'] == 1
+    pooled = list(pool.sessions)
+    
+    # Pooled sessions are not affected by pending-session expiry
+    for session in pooled:
+        session._creation_time -= 50
+    manager._clear_old_pending_sessions()
+    assert pool.sessions == pooled
+    
+    # Sessions are handed out, with a fresh creation time
+    session = manager.create_session('SessionTester')
+    assert session is pooled[0]
+    assert session.app is not None
+    assert manager.get_session_by_id('SessionTester', session.id) is session
+    assert session._creation_time > pooled[1]._creation_time + 40
+    assert pool.sessions == pooled[1:]
+    fill()
+    assert len(pool.sessions) == 2
+    
+    # Expired sessions are replaced (and unsubscribed from broadcasts)
+    manager.subscribe(pooled[1], global_value)
+    pooled[1]._creation_time -= 100
+    fill()
+    assert pooled[1] not in pool.sessions
+    assert pooled[1].id in manager._closed_sessions
+    assert manager._broadcast_subscribers == {}
+    fill()
+    assert len(pool.sessions) == 2
+    
+    # When the pool is empty, sessions are built on demand
+    manager.create_session('SessionTester')
+    manager.create_session('SessionTester')
+    session = manager.create_session('SessionTester')
+    assert session.app is not None
+    assert manager.get_diagnostics()['pools']['SessionTester'] == dict(
+        size=2, available=0, hits=3, misses=2)
+    
+    # Re-registering without pool args keeps the pool, size zero removes it
+    manager.register_app_class(SessionTester)
+    assert manager._pools['SessionTester'] is pool
+    manager.register_app_class(SessionTester, pool_size=0)
+    assert 'SessionTester' not in manager._pools
+
+
+class Leaf(app.Model):
+    
+    @react.input
+    def value(v=0):
+        return v
+    
+    class JS:
+        
+        @react.connect('value')
+        def double(self, v):
+            return v * 2
+
+
+class Tree(app.Model):
+    
+    def _init(self):
+        self.leaves = [Leaf(session=self.session, value=i) for i in range(3)]
+        self.leaves[0].value(10)
+        self.first = self.leaves[0]  # synced attribute, sent as code
+
+
+def test_construct_batching():
+    session = Session('x')
+    tree = Tree(session=session)
+    commands = session._queue.get_commands()
+    assert len(commands) == 1
+    assert commands[0].startswith('CONSTRUCT ')
+    spec = json.loads(commands[0][10:])
+    assert spec['instances'] == [[tree.id, 'Tree']] + [[leaf.id, 'Leaf']
+                                                       for leaf in tree.leaves]
+    assert spec['connect'] == []
+    # Only the latest value of a signal is sent
+    values = [step[2] for step in spec['steps'] if step[:2] == [tree.leaves[0].id, 'value']]
+    assert values == ['10']
+    assert 'flexx.instances.%s.first' % tree.id in spec['steps'][-1]
+    
+    # Commands after construction are sent as usual
+    tree.leaves[1].value(5)
+    assert session._queue.get_commands()[-1].startswith('EXEC ')
+    
+    # Construct the tree in JS
+    code = 'var root = global, location = {hostname: "", port: "", pathname: ""};\n'
+    code += assets.load_asset('flexx-app.js').decode() + '\n'
+    code += 'global.flexx = flexx; setTimeout(process.exit, 10);  // FlexxJS stays alive\n'
+    code += 'flexx.initSocket = flexx.initLogging = function () {};\n'
+    code += ''.join([cls.JS.CODE for cls in (app.Model, Leaf, Tree)])
+    code += 'flexx.command(%s);\n' % json.dumps(commands[0])
+    code += 'var t = flexx.instances.%s;\n' % tree.id
+    code += 't.first.id + " " + t.first.double() + " " + flexx.instances.%s.double();' % (
+            tree.leaves[2].id)
+    assert evaljs(code) == '%s 20 4' % tree.leaves[0].id
+    
+    # Batching can be turned off
+    session = Session('x')
+    session.CONSTRUCT_BATCHING = False
+    tree = Tree(session=session)
+    assert len(session._queue.get_commands()) > 5
+
+
+
+class Offloader(app.Model):
+    
+    @app.offload
+    def count_primes(self, n):
+        """ Count primes below n. """
+        count = 0
+        for i in range(2, n):
+            for j in range(2, i):
+                if i % j == 0:
+                    break
+            else:
+                count += 1
+        return count
+    
+    @app.offload
+    def fail(self):
+        raise ValueError('oops')
+
+
+def test_offload():
+    session = Session('xx')
+    m = Offloader(session=session)
+    assert Offloader.count_primes.__doc__.strip() == 'Count primes below n.'
+    assert 'count_primes' in Offloader.JS.CODE
+    raises(ValueError, app.offload, 3)
+    
+    # Calling sends the args to JS, and returns a future
+    f1 = m.count_primes(10)
+    f2 = m.count_primes(100)
+    assert isinstance(f1, Future) and not f1.done()
+    cmd = session._queue.get_commands()[-1]
+    assert '_call_from_py(2, "count_primes", "[100]")' in cmd
+    
+    # Results (and errors) from JS resolve the futures
+    session._receive_command('RESULT %s 2 1 25' % m.id)
+    assert f2.result() == 25 and not f1.done()
+    f3 = m.fail()
+    session._receive_command('RESULT %s 3 0 "ValueError: oops"' % m.id)
+    with raises(RuntimeError) as err:
+        f3.result()
+    assert 'oops' in str(err.value)
+    session._receive_command('RESULT %s 3 1 3' % m.id)  # ignored
+    
+    # The method runs in JS, and sends back the result
+    code = 'var root = global, location = {hostname: "", port: "", pathname: ""};\n'
+    code += assets.load_asset('flexx-app.js').decode() + '\n'
+    code += 'global.flexx = flexx; setTimeout(process.exit, 10);  // FlexxJS stays alive\n'
+    code += 'flexx.initSocket = flexx.initLogging = function () {};\n'
+    code += 'var sent = []; flexx.send = function (msg) { sent.push(msg); };\n'
+    code += ''.join([cls.JS.CODE for cls in (app.Model, Offloader)])
+    code += 'flexx.instances.%s = new flexx.classes.Offloader("%s");\n' % (m.id, m.id)
+    code += cmd[5:] + '\n'
+    code += 'flexx.instances.%s._call_from_py(9, "fail", "[]");\n' % m.id
+    code += 'sent.join("\\n");'
+    result, error = evaljs(code).splitlines()
+    assert result == 'RESULT %s 2 1 25' % m.id
+    assert error.startswith('RESULT %s 9 0 ' % m.id) and 'oops' in error
+    
+    # Pending calls fail when the session closes, new calls fail right away
+    session.close()
+    with raises(RuntimeError):
+        f1.result()
+    assert isinstance(m.count_primes(3).exception(0), RuntimeError)
+
+
+def test_model_pool():
+    pool = app.ModelPool.__new__(app.ModelPool)  # without launching
+    sessions = [Session('xx'), Session('xx')]
+    pool._models = [Offloader(session=session) for session in sessions]
+    pool._pending = [0, 0]
+    assert '2 instances' in repr(pool)
+    
+    # Calls go to the instance with the fewest pending calls
+    f1 = pool.submit('count_primes', 10)
+    f2 = pool.submit('count_primes', 20)
+    f3 = pool.submit('count_primes', 30)
+    assert pool._pending == [2, 1]
+    model = pool.models[1]
+    model.session._receive_command('RESULT %s 1 1 8' % model.id)
+    assert f2.result() == 8
+    assert pool._pending == [2, 0]
+    assert not (f1.done() or f3.done())
+    
+    # Instances of which the session is closed are skipped
+    sessions[0].close()
+    assert f1.exception(0) and f3.exception(0)
+    f4 = pool.submit('count_primes', 40)
+    assert pool._pending == [0, 1]
+    sessions[1].close()
+    assert f4.exception(0)
+    raises(RuntimeError, pool.submit, 'count_primes', 10)
+    
+    pool.close()
+    assert pool._pending == [0, 0]
+    raises(RuntimeError, pool.submit, 'count_primes', 10)
+    raises(ValueError, app.ModelPool, Offloader, 0)
+
+
+def test_export_snapshot():
+    session = Session('x')
+    session.CONSTRUCT_BATCHING = False
+    tree = Tree(session=session)
+    tree.leaves[1].value(5)
+    tree.leaves[1].value(6)
+    commands = session._queue.get_commands()
+    commands.insert(0, 'TITLE foo')
+    
+    # The commands are collapsed, only the latest signal values are kept
+    items = compact_commands(commands)
+    assert len(commands) > 10 and len(items) == 2
+    assert items[0] == 'TITLE foo'
+    spec = items[1]
+    assert spec['instances'] == [[tree.id, 'Tree']] + [[leaf.id, 'Leaf']
+                                                       for leaf in tree.leaves]
+    values = [step[2] for step in spec['steps'] if step[:2] == [tree.leaves[1].id, 'value']]
+    assert values == ['6']
+    assert len([step for step in spec['steps'] if isinstance(step, str)]) == 1
+    assert compact_commands(['CONSTRUCT ' + json.dumps(spec)]) == [spec]
+    
+    # Hydrate in JS, without evaluating strings
+    commands.append('EXEC global.foo = 7;  // code can end with a comment')
+    js = get_export_js(commands)
+    assert 'flexx.command' in js and 'flexx.construct(' in js and 'EXEC' not in js
+    code = 'var root = global, location = {hostname: "", port: "", pathname: ""};\n'
+    code += assets.load_asset('flexx-app.js').decode() + '\n'
+    code += 'global.flexx = flexx; setTimeout(process.exit, 10);  // FlexxJS stays alive\n'
+    code += 'flexx.init = function () {};\n'
+    code += ''.join([cls.JS.CODE for cls in (app.Model, Leaf, Tree)])
+    code += js + 'flexx.runExportedApp();\n'
+    code += 'var t = flexx.instances.%s;\n' % tree.id
+    code += 't.first.id + " " + t.first.double() + " " + flexx.instances.%s.double()' % (
+            tree.leaves[1].id)
+    code += ' + " " + foo;'
+    assert evaljs(code) == '%s 20 12 7' % tree.leaves[0].id
+
+
+def test_notebook_command_buffer():
+    from flexx.app import funcs
+    sent = []
+    buffer = funcs.NotebookCommandBuffer(sent.append)
+    
+    # Commands of a cell execution are sent in one piece
+    buffer.pre_execute()
+    for i in range(3):
+        buffer.send_command('EXEC flexx.instances.x._set_signal_from_py'
+                            '("value", "%i", 0);' % i)
+    buffer.send_command(b'TITLE foo')
+    assert sent == []
+    buffer.post_execute()
+    assert len(sent) == 1
+    assert sent[0].count('flexx.construct(') == 1 and sent[0].count('flexx.command(') == 1
+    assert '"2"' in sent[0] and '"1"' not in sent[0]
+    
+    # Outside of a cell execution, send in the next iteration
+    calls = []
+    call_later = funcs.call_later
+    funcs.call_later = lambda delay, func: calls.append(func)
+    try:
+        buffer.send_command('TITLE foo')
+        buffer.send_command('TITLE bar')
+    finally:
+        funcs.call_later = call_later
+    assert len(calls) == 1 and len(sent) == 1
+    calls[0]()
+    assert len(sent) == 2 and 'bar' in sent[1]
+    buffer.flush()
+    assert len(sent) == 2
+
+
+class ExportTester(app.Model):
+    
+    @react.input
+    def title(v='exported'):
+        return str(v)
+
+
+def test_export_many():
+    dirname = os.path.join(tempfile.gettempdir(), 'flexx_export_many')
+    if os.path.isdir(dirname):
+        shutil.rmtree(dirname)
+    n_assets = len(assets.get_asset_names())
+    
+    # Export in worker processes, shared assets have a hashed name
+    exported = app.export_many([SessionTester, ExportTester], dirname, workers=2)
+    assert exported == ['SessionTester', 'ExportTester']
+    filenames = os.listdir(dirname)
+    assert 'SessionTester.html' in filenames and 'flexx-export.json' in filenames
+    hashed_name = assets.get_hashed_name('flexx-app.js')
+    assert hashed_name in filenames and 'flexx-app.js' not in filenames
+    with open(os.path.join(dirname, 'ExportTester.html'), 'rb') as f:
+        html = f.read().decode()
+    assert hashed_name in html and 'exported' in html
+    
+    # Unchanged apps are skipped, unless forced
+    mtime = os.path.getmtime(os.path.join(dirname, hashed_name))
+    assert app.export_many([ExportTester], dirname, workers=0) == []
+    target = ExportTester.__module__ + ':ExportTester'
+    assert app.export_many([target], dirname, workers=0, force=True) == ['ExportTester']
+    assert os.path.getmtime(os.path.join(dirname, hashed_name)) == mtime
+    
+    # The exported sessions are released
+    assert len(assets.get_asset_names()) == n_assets
+    
+    # Apps whose assets changed are exported again
+    filename = os.path.join(dirname, 'flexx-export.json')
+    with open(filename, 'rb') as f:
+        manifest = json.loads(f.read().decode())
+    manifest['ExportTester']['assets']['flexx-app.js'] = 'flexx-app-xxx.js'
+    with open(filename, 'wb') as f:
+        f.write(json.dumps(manifest).encode())
+    assert app.export_many([SessionTester, ExportTester], dirname, workers=0) == \
+        ['ExportTester']
+    
+    raises(ValueError, app.export_many, ['test_session.ExportTester'], dirname)
+    shutil.rmtree(dirname)
+
+
+@app.broadcast
+def global_value(v=0):
+    return float(v)
+
+
+def test_broadcast():
+    manager = app.manager
+    s1, s2, s3 = Session('xx'), Session('xx'), Session('xx')
+    
+    raises(ValueError, manager.subscribe, s1, SessionTester.foo)
+    raises(ValueError, app.broadcast, 3)
+    
+    manager.subscribe(s1, global_value)
+    manager.subscribe(s2, global_value)
+    manager.subscribe(s2, global_value)  # no-op
+    assert s1._queue.get_commands()[-1] == b'BROADCAST global_value 0.0'
+    n1, n2, n3 = [len(s._queue.get_commands()) for s in (s1, s2, s3)]
+    
+    # The command is serialized and encoded once for all sessions
+    global_value(3)
+    assert len(s1._queue.get_commands()) == n1 + 1
+    assert len(s2._queue.get_commands()) == n2 + 1
+    assert len(s3._queue.get_commands()) == n3
+    assert s1._queue.get_commands()[-1] == b'BROADCAST global_value 3.0'
+    assert s1._queue.get_commands()[-1] is s2._queue.get_commands()[-1]
+    
+    # Unsubscribe
+    manager.unsubscribe(s1, global_value)
+    global_value(4)
+    assert len(s1._queue.get_commands()) == n1 + 1
+    assert len(s2._queue.get_commands()) == n2 + 2
+    manager.unsubscribe(s2)
+    assert manager._broadcast_subscribers == {}
+    
+    # Names must be unique
+    @app.broadcast
+    def global_value2(v=0):
+        return v
+    global_value2._name = 'global_value'
+    manager.subscribe(s1, global_value)
+    raises(ValueError, manager.subscribe, s1, global_value2)
+    manager.unsubscribe(s1)
+    
+    # Old pending sessions that are cleared are unsubscribed
+    manager = AppManager()
+    manager.register_app_class(SessionTester)
+    session = manager.create_session('SessionTester')
+    manager.subscribe(session, global_value)
+    session._creation_time -= 100
+    manager._clear_old_pending_sessions()
+    assert manager._broadcast_subscribers == {}
+
+
+
+def test_command_queue():
+    q = CommandQueue(100, 20)
+    assert q.policy == 'coalesce'
+    raises(ValueError, q.configure, policy='foo')
+    raises(ValueError, q.configure, 10, 20)
+    
+    q.put('x' * 40)
+    q.put('a1' + 'x' * 18, 'a')
+    q.put('b1' + 'x' * 18, 'b')
+    assert len(q) == 3 and q.nbytes == 80
+    q.put('a2' + 'x' * 18, 'a')  # not congested yet
+    assert len(q) == 4 and q.nbytes == 100
+    
+    # Congested, coalesce commands with the same key
+    q.put('a3', 'a')
+    q.put('b2', 'b')
+    q.put('c1', 'c')
+    assert q.congested
+    assert q.get_commands() == ['x' * 40, 'a1' + 'x' * 18, 'b2', 'a3', 'c1']
+    stats = q.get_stats()
+    assert stats['coalesced'] == 2 and stats['depth'] == 5
+    assert stats['congestion_count'] == 1
+    
+    # Commands without a key are not queued beyond the high watermark
+    assert q.put('y' * 40)
+    assert not q.put('z')
+    assert len(q) == 6 and q.nbytes == 106
+    
+    # Popped commands count until done
+    commands = q.pop_all()
+    assert len(commands) == 6 and len(q) == 0
+    assert q.nbytes == 106
+    assert q.congested
+    q.done()
+    assert q.nbytes == 0 and not q.congested
+    
+    # Drop
+    q = CommandQueue(10, 5, 'drop')
+    q.put('x' * 10, 'a')
+    assert q.put('x', 'a') and not q.put('y')
+    assert q.get_commands() == ['x' * 10]
+    assert q.dropped == 1
+    
+    # Disconnect
+    q = CommandQueue(10, 5, 'disconnect')
+    assert q.put('x' * 10)
+    assert not q.put('x')
+
+
+class AsyncWebSocket:
+    
+    close_code = None
+    
+    def __init__(self):
+        self.commands = []
+        self.futures = []
+    
+    def command(self, cmd):
+        self.commands.append(cmd)
+        self.futures.append(Future())
+        return self.futures[-1]
+    
+    def close(self, code, reason):
+        self.close_code = code
+
+
+def test_session_backpressure():
+    session = Session('xx')
+    session.configure_queue(50, 10)
+    session._send_command('a')
+    session._send_command('b')
+    
+    # On connect, the pending commands are written
+    ws = AsyncWebSocket()
+    session._set_ws(ws)
+    assert ws.commands == ['a', 'b']
+    
+    # Until these are written, new commands are queued (and coalesced)
+    session._send_command('x' * 50)
+    for i in range(5):
+        session._send_command('v%i' % i, 'foo')
+    assert ws.commands == ['a', 'b']
+    assert session.get_queue_stats()['depth'] == 2
+    assert session.get_queue_stats()['coalesced'] == 4
+    
+    ws.futures[-1].set_result(None)
+    assert ws.commands == ['a', 'b', 'x' * 50, 'v4']
+    ws.futures[-1].set_result(None)
+    assert session.get_queue_stats()['nbytes'] == 0
+    assert not session.get_queue_stats()['congested']
+    
+    # Too many commands without a key
+    session._send_command('x' * 50)
+    assert ws.close_code is None
+    session._send_command('y', 'bar')
+    assert ws.close_code is None
+    session._send_command('z')
+    assert ws.close_code == 1008
+    
+    # Disconnect policy
+    session = Session('xx')
+    session.configure_queue(50, 10, 'disconnect')
+    ws = AsyncWebSocket()
+    session._set_ws(ws)
+    session._send_command('a')
+    session._send_command('x' * 50)
+    assert ws.close_code is None
+    session._send_command('y')
+    assert ws.close_code == 1008
+    
+    # Closed sessions do not queue commands, also if they never connected
+    session = Session('xx')
+    session.close()
+    assert session.status == session.STATUS.PENDING
+    session._send_command('a')
+    assert len(session._queue) == 0
+
+
+
+def test_session_resume():
+    manager = AppManager()
+    manager.register_app_class(SessionTester)
+    session = manager.create_session('SessionTester')
+    raises(ValueError, session.configure_resume, -1)
+    raises(ValueError, session.configure_resume, 10, 0)
+    session.configure_resume(10, 4)
+    assert session._queue.get_commands()[-1] == 'RESUME 10.0'
+    
+    ws = AsyncWebSocket()
+    manager.connect_client(ws, 'SessionTester', session.id)
+    for i in range(5):
+        session._send_command('c%i' % i)
+        ws.futures[-1].set_result(None)
+    assert ws.commands[-5:] == ['c0', 'c1', 'c2', 'c3', 'c4']
+    
+    # Connection lost: the session waits to be resumed, commands are queued
+    ws.close_code = 1006
+    manager.disconnect_client(session)
+    assert session.status == session.STATUS.PENDING
+    assert manager.get_diagnostics()['detached'] == 1
+    session._send_command('c5')
+    
+    # A new client cannot connect, and one cannot resume too far back
+    raises(RuntimeError, session._set_ws, AsyncWebSocket())
+    raises(RuntimeError, session._set_ws, AsyncWebSocket(), session._seq - 5)
+    
+    # The client resumes, having missed two commands
+    ws = AsyncWebSocket()
+    manager.connect_client(ws, 'SessionTester', session.id, session._seq - 2)
+    assert ws.commands == ['c3', 'c4']
+    ws.futures[-1].set_result(None)
+    assert ws.commands == ['c3', 'c4', 'c5']
+    assert manager.get_connections('SessionTester') == [session]
+    assert manager.get_diagnostics()['detached'] == 0
+    
+    # The client resumes before the server noticed that the connection
+    # was lost: the stale connection is closed, without affecting the session
+    session._send_command('c6')
+    ws.futures[-1].set_result(None)
+    stale_ws = ws
+    stale_ws._session = session  # what the server's websocket handler does
+    ws = AsyncWebSocket()
+    manager.connect_client(ws, 'SessionTester', session.id, session._seq - 1)
+    assert ws.commands == ['c6']
+    assert stale_ws.close_code == 1000 and stale_ws._session is None
+    assert manager.get_connections('SessionTester') == [session]
+    assert session.status == session.STATUS.CONNECTED
+    raises(RuntimeError, manager.connect_client, AsyncWebSocket(), 'SessionTester',
+           session.id)  # not when connecting anew
+    
+    # Expires if not resumed in time
+    ws.close_code = 1006
+    manager.disconnect_client(session)
+    manager._expire_session(session, session._detached_time)
+    assert session.app is None
+    assert manager.get_diagnostics()['pending'] == 0
+    raises(RuntimeError, manager.connect_client, AsyncWebSocket(), 'SessionTester',
+           session.id, session._seq)
+    
+    # Closed by the client: not resumed
+    session = manager.create_session('SessionTester')
+    session.configure_resume(10)
+    ws = AsyncWebSocket()
+    manager.connect_client(ws, 'SessionTester', session.id)
+    ws.close_code = 1000
+    manager.disconnect_client(session)
+    assert session.app is None
+    assert manager.get_diagnostics()['pending'] == 0
+
+
+run_tests_if_main()
@@ -0,0 +1,192 @@
+""" Test parts of the Tornado server that can be tested without a client.
+"""
+
+import time
+
+import tornado.websocket
+from tornado.iostream import StreamClosedError
+from pytest import raises
+from flexx.util.testing import run_tests_if_main
+
+from flexx.app import tornadoserver
+from flexx.app.tornadoserver import Heartbeat, MessageCounter
+from flexx.app.tornadoserver import TornadoServer, WSHandler, server
+
+
+class FakeWebSocket:
+    
+    def __init__(self):
+        self.pings = 0
+        self.close_code = None
+    
+    def ping(self, data):
+        self.pings += 1
+    
+    def close(self, code, reason):
+        self.close_code = code
+
+
+def test_heartbeat_slots():
+    hb = Heartbeat(interval=2, timeout=20, nslots=4)
+    connections = [FakeWebSocket() for i in range(10)]
+    for ws in connections:
+        hb.register(ws)
+    hb.register(connections[0])  # no-op
+    assert len(hb) == 10
+    assert hb._timer is not None
+    
+    # Each tick pings one slot, each rotation pings all
+    hb._tick()
+    assert [ws.pings for ws in connections] == [1, 0, 0, 0, 1, 0, 0, 0, 1, 0]
+    for i in range(3):
+        hb._tick()
+    assert [ws.pings for ws in connections] == [1] * 10
+    
+    # Unregistering frees the index, which is reused
+    hb.unregister(connections[3])
+    hb.unregister(connections[3])  # no-op
+    assert len(hb) == 9
+    ws = FakeWebSocket()
+    hb.register(ws)
+    assert ws._heartbeat_index == 3
+    
+    for ws in list(hb._connections):
+        hb.unregister(ws)
+    assert len(hb) == 0
+    assert hb._timer is None
+
+
+def test_heartbeat_timeout():
+    hb = Heartbeat(interval=2, timeout=20, nslots=2)
+    ws1, ws2, ws3 = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+    for ws in (ws1, ws2, ws3):
+        hb.register(ws)
+    hb.unregister(ws3)
+    
+    # Pretend ws2 was last heard from long ago
+    hb._pongtimes[ws2._heartbeat_index] = time.time() - 30
+    hb._pongtimes[ws1._heartbeat_index] = time.time() - 30
+    hb.pong(ws1)
+    
+    hb._tick()
+    assert ws2.close_code is None  # sweep only once per rotation
+    hb._tick()
+    assert ws1.close_code is None
+    assert ws2.close_code == 1000
+    assert ws3.close_code is None
+    assert len(hb) == 1
+    hb.stop()
+
+
+def test_message_counter():
+    mc = MessageCounter()
+    for i in range(10):
+        mc.trigger()
+    assert mc.mps >= 0
+    mc.notify()
+    assert mc._notify_time > 0
+
+
+class FakeCompressor:
+    
+    def __init__(self, persistent):
+        self._compressor = object() if persistent else None
+
+
+class FakeConnection:
+    """ Mimics Tornado's WebSocketProtocol13.
+    """
+    
+    def __init__(self, compressor):
+        self._compressor = compressor
+        self._message_bytes_out = 0
+        self.frames = []
+    
+    def _write_frame(self, fin, opcode, data, flags=0):
+        if self.frames is None:
+            raise StreamClosedError()
+        self.frames.append(('raw', data))
+    
+    def write_message(self, message, binary=False):
+        self.frames.append(('compressed' if self._compressor else 'raw', message))
+
+
+def test_compression_config():
+    s = TornadoServer()
+    assert s.compression['enabled']
+    
+    s.configure_compression(level=6, threshold=512)
+    assert s.compression['level'] == 6
+    assert s.compression['threshold'] == 512
+    options = s.get_client_ws_options()['perMessageDeflate']
+    assert options['threshold'] == 512
+    assert options['zlibDeflateOptions'] == dict(level=6, memLevel=8)
+    assert not options['serverNoContextTakeover']
+    
+    with raises(ValueError):
+        s.configure_compression(level=10)
+    with raises(ValueError):
+        s.configure_compression(level=1, mem_level=0)
+    
+    s.configure_compression(enabled=False)
+    assert s.get_client_ws_options() == dict(perMessageDeflate=False)
+
+
+def test_compression_threshold():
+    
+    def create_handler(compressor):
+        ws = WSHandler.__new__(WSHandler)
+        ws.ws_connection = FakeConnection(compressor)
+        ws._init_compression()
+        return ws
+    
+    small, big = b'EXEC x' + b' ' * 100, b'EXEC x' + b' ' * 1000
+    
+    # No compression negotiated
+    ws = create_handler(None)
+    ws.command(small)
+    ws.command(big)
+    assert [kind for kind, _ in ws.ws_connection.frames] == ['raw', 'raw']
+    
+    # Context takeover: compress all
+    ws = create_handler(FakeCompressor(True))
+    ws.command(small)
+    ws.command(big)
+    assert [kind for kind, _ in ws.ws_connection.frames] == ['compressed'] * 2
+    
+    # Without context takeover: compress only bigger messages
+    ws = create_handler(FakeCompressor(False))
+    ws.command(small)
+    ws.command(big.decode())
+    assert [kind for kind, _ in ws.ws_connection.frames] == ['raw', 'compressed']
+    assert ws.ws_connection._message_bytes_out == len(small)
+    
+    # Server can disable context takeover, even if client allows it
+    compression = server.compression.copy()
+    try:
+        server.configure_compression(context_takeover=False, threshold=2000)
+        ws = create_handler(FakeCompressor(True))
+        assert ws.ws_connection._compressor._compressor is None
+        ws.command(big)
+        assert [kind for kind, _ in ws.ws_connection.frames] == ['raw']
+    finally:
+        server.compression = compression
+    
+    # Errors are like those of write_message()
+    ws = create_handler(FakeCompressor(False))
+    ws.ws_connection.frames = None
+    with raises(tornado.websocket.WebSocketClosedError):
+        ws.command(small)
+    
+    # The private API is only used with the Tornado version it was tested with
+    private_ws_api = tornadoserver._PRIVATE_WS_API
+    try:
+        tornadoserver._PRIVATE_WS_API = False
+        ws = create_handler(FakeCompressor(False))
+        ws.command(small)
+        assert [kind for kind, _ in ws.ws_connection.frames] == ['compressed']
+    finally:
+        tornadoserver._PRIVATE_WS_API = private_ws_api
+
+
+run_tests_if_main()
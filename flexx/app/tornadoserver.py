@@ -1,10 +1,13 @@
 """
-Serve web page and handle web sockets. Uses Tornado, though this
-can be generalized.
+Serve web page and handle web sockets. Uses Tornado. The logic to serve
+pages and to handle the websocket protocol is in ``PageHandlerMixin``
+and ``WSHandlerMixin``, which are shared with other servers (see
+asyncioserver.py).
 """
 
 import json
 import time
+import array
 import logging
 import traceback
 from urllib.parse import urlparse
@@ -14,13 +17,44 @@ import tornado.web
 import tornado.ioloop
 import tornado.websocket
 from tornado import gen
+from tornado.iostream import StreamClosedError
 
 from .session import manager, valid_app_name
 from .assetstore import assets
+from . import metrics
 
 # todo: threading, or even multi-process
 #executor = ThreadPoolExecutor(4)
 
+# Command types for the metrics; other commands are counted as "other"
+IN_COMMANDS = ('hiflexx', 'SIGNAL', 'MULTI', 'RET', 'PRINT', 'INFO', 'WARN', 'ERROR')
+OUT_COMMANDS = ('EXEC', 'EVAL', 'CONSTRUCT', 'DEFINE-JS', 'DEFINE-CSS', 'PRINT',
+                'BROADCAST', 'TITLE', 'ICON', 'OPEN', 'RESUME')
+
+_messages_in = metrics.Counter('flexx_messages_received_total',
+                               'Number of received websocket messages.', ('command', ))
+_bytes_in = metrics.Counter('flexx_received_bytes_total',
+                            'Number of received websocket bytes.', ('command', ))
+_messages_out = metrics.Counter('flexx_messages_sent_total',
+                                'Number of sent websocket messages.', ('command', ))
+_bytes_out = metrics.Counter('flexx_sent_bytes_total',
+                             'Number of sent websocket bytes.', ('command', ))
+_command_duration = metrics.Histogram('flexx_command_duration_seconds',
+                                      'Time to handle received messages.',
+                                      ('command', ))
+_page_duration = metrics.Histogram('flexx_page_duration_seconds',
+                                   'Time to create a session and its page.', ('app', ))
+
+
+def command_type(command, known):
+    """ Get the type of a command (str or bytes), i.e. its first word,
+    or "other" if it's not in the given known types.
+    """
+    if isinstance(command, bytes):
+        command = command[:16].decode('utf-8', 'ignore')
+    kind = command.split(' ', 1)[0]
+    return kind if kind in known else 'other'
+
 
 class AbstractServer:
     """ This is an attempt to generalize the server, so that in the
@@ -31,6 +65,12 @@ class AbstractServer:
     server assets to the client.
     """
     
+    backend = None  # name of the backend, for app.start()
+    
+    def get_client_ws_options(self):
+        """ Get the options for the websocket of the nodejs runtime. """
+        return dict(perMessageDeflate=False)
+    
     def open(self, host, port):
         """ Open the connection as a host. If port is None, auto-select one. """
         raise NotImplementedError()
@@ -52,9 +92,79 @@ class TornadoServer(AbstractServer):
     """ Flexx Server implemented in Tornado.
     """
     
+    backend = 'tornado'
+    
     def __init__(self):
         self._app = None
         self._loop = tornado.ioloop.IOLoop.instance()
+        self.heartbeat = Heartbeat()
+        self.compression = dict(enabled=True, level=1, mem_level=8,
+                                threshold=None, context_takeover=True)
+    
+    def configure_compression(self, enabled=None, level=None, mem_level=None,
+                              threshold=None, context_takeover=None):
+        """ Configure permessage-deflate compression of websocket
+        messages. Applies to connections that are made after this call.
+        The client must support compression too (browsers and the nodejs
+        runtime do).
+        
+        Parameters:
+            enabled (bool): whether to compress messages. Default True.
+            level (int): zlib compression level (0-9). Default 1, which
+                costs less than half the CPU of level 6, for about 20%
+                more bytes.
+            mem_level (int): zlib memory level (1-9). Default 8.
+            threshold (int): messages smaller than this number of bytes
+                are sent uncompressed. Default None (automatic): all
+                messages are compressed if the connection uses context
+                takeover, otherwise messages smaller than 256 bytes are
+                sent uncompressed, because they would hardly shrink.
+            context_takeover (bool): whether the compression context is
+                kept between messages, so that repeated content (e.g.
+                similar signal updates) compresses better. Costs about
+                300 KiB of memory per connection. Default True. The
+                client can also ask to not use context takeover.
+        
+        The threshold and disabling context takeover on the server side
+        rely on internals of Tornado, and are only applied with Tornado
+        4.5. With other versions, all messages are compressed if
+        compression is enabled.
+        
+        See ``examples/app/compression_benchmark.py`` for the effect of
+        these settings on bandwidth and CPU usage.
+        """
+        if level is not None and not 0 <= level <= 9:
+            raise ValueError('Compression level must be between 0 and 9.')
+        if mem_level is not None and not 1 <= mem_level <= 9:
+            raise ValueError('Compression mem_level must be between 1 and 9.')
+        c = self.compression
+        if enabled is not None:
+            c['enabled'] = bool(enabled)
+        if level is not None:
+            c['level'] = int(level)
+        if mem_level is not None:
+            c['mem_level'] = int(mem_level)
+        if threshold is not None:
+            c['threshold'] = int(threshold)
+        if context_takeover is not None:
+            c['context_takeover'] = bool(context_takeover)
+    
+    def get_client_ws_options(self):
+        """ Get the options for the websocket of the nodejs runtime
+        (as used by the "ws" package) that match the compression settings.
+        """
+        c = self.compression
+        if not c['enabled']:
+            return dict(perMessageDeflate=False)
+        threshold = c['threshold']
+        if threshold is None:
+            threshold = 0 if c['context_takeover'] else 256
+        deflate = dict(threshold=threshold,
+                       clientNoContextTakeover=not c['context_takeover'],
+                       serverNoContextTakeover=not c['context_takeover'],
+                       zlibDeflateOptions=dict(level=c['level'],
+                                               memLevel=c['mem_level']))
+        return dict(perMessageDeflate=deflate)
     
     def open(self, host, port):
         
@@ -95,6 +205,7 @@ class TornadoServer(AbstractServer):
         """
         # todo: explicitly close all websocket connections
         print('Stopping server')
+        self._loop.add_callback(self.heartbeat.stop)
         self._loop.add_callback(self._loop.stop)
     
     def call_later(self, delay, callback, *args, **kwargs):
@@ -104,8 +215,6 @@ class TornadoServer(AbstractServer):
             self._loop.add_timeout(self._loop.time() + delay, callback, *args, **kwargs)
             #self._loop.call_later(delay, callback, *args, **kwargs)  # v4.0+
 
-# Create server instance
-server = TornadoServer()
 
 
 def port_hash(name):
@@ -123,16 +232,17 @@ def port_hash(name):
     return 49152 + (val % 2**14)
 
 
-class MainHandler(tornado.web.RequestHandler):
-    """ Handler for http requests: serve pages
+class PageHandlerMixin:
+    """ Serves pages and assets over http, independent of the server
+    implementation. The class that this is mixed into must implement
+    ``get_argument()``, ``set_header()``, ``write()``, ``redirect()`` and
+    ``send_error()`` like Tornado's ``RequestHandler``, and have the
+    attributes ``request`` (with a ``host`` attribute) and ``flexx_server``.
     """
-    def initialize(self, **kwargs):
-        # kwargs == dict set as third arg in url spec
-        # print('init request')
-        pass
     
-    @gen.coroutine
-    def get(self, path=None):
+    def handle_get(self, path):
+        """ Handle a GET request for the given path (without leading slash).
+        """
         
         # Analyze path to derive components
         # app_name - class name of the app, must be a valid identifier
@@ -160,6 +270,14 @@ class MainHandler(tornado.web.RequestHandler):
             all_apps = ', '.join(all_apps)
             self.write('Index of available apps: %s' % all_apps)
         
+        elif app_name == '__metrics__':
+            # Metrics for monitoring, e.g. scraped by Prometheus, only from localhost
+            if not self.request.host.startswith('localhost:'):
+                self.write('403')
+                return
+            self.set_header('Content-Type', metrics.CONTENT_TYPE)
+            self.write(metrics.registry.render())
+        
         elif app_name == '__cmd__':
             # Control the server using http, but only from localhost
             if not self.request.host.startswith('localhost:'):
@@ -167,14 +285,14 @@ class MainHandler(tornado.web.RequestHandler):
                 return
             
             if file_name == 'info':
-                info = dict(address=self.application.serving_at,
+                info = dict(address=self.flexx_server.serving_at,
                             app_names=manager.get_app_names(),
                             nsessions=sum([len(manager.get_connections(x))
                                            for x in manager.get_app_names()]),
                             )
                 self.write(json.dumps(info))
             elif file_name == 'stop':
-                server.stop()
+                self.flexx_server.stop()
             else:
                 self.write('unknown command')
         
@@ -189,13 +307,14 @@ class MainHandler(tornado.web.RequestHandler):
                     # If session_id matches a pending app, use that session
                     session = manager.get_session_by_id(app_name, session_id)
                     if session and session.status == session.STATUS.PENDING:
-                        self.write(session.get_page().encode())
+                        self._write_page(session, metrics.timer())
                     else:
                         self.redirect('/%s/' % app_name)  # redirect for normal serve
                 elif manager.has_app_name(app_name):
                     # Create session - client will connect to it via session_id
+                    t0 = metrics.timer()
                     session = manager.create_session(app_name)
-                    self.write(session.get_page().encode())
+                    self._write_page(session, t0)
                 else:
                     self.write('No app "%s" is currently hosted.' % app_name)
             elif file_name and '.js:' in file_name:
@@ -229,7 +348,7 @@ class MainHandler(tornado.web.RequestHandler):
                     res = assets.load_asset(file_name)
                 except (IOError, IndexError):
                     #self.write('invalid resource')
-                    super().write_error(404)
+                    self.send_error(404)
                 else:
                     self.write(res)
         
@@ -241,6 +360,28 @@ class MainHandler(tornado.web.RequestHandler):
             # In theory this cannot happen
             self.write('This should not happen')
     
+    def _write_page(self, session, t0):
+        page = session.get_page().encode()
+        _page_duration.observe(metrics.timer() - t0, (session.app_name, ))
+        self.write(page)
+
+
+class MainHandler(PageHandlerMixin, tornado.web.RequestHandler):
+    """ Handler for http requests: serve pages
+    """
+    def initialize(self, **kwargs):
+        # kwargs == dict set as third arg in url spec
+        # print('init request')
+        pass
+    
+    @property
+    def flexx_server(self):
+        return server
+    
+    @gen.coroutine
+    def get(self, path=None):
+        self.handle_get(path)
+    
     def write_error(self, status_code, **kwargs):
         if status_code == 404:  # does not work?
             self.write('flexx.ui wants you to connect to root (404)')
@@ -262,7 +403,8 @@ class MainHandler(tornado.web.RequestHandler):
 
 class MessageCounter:
     """ Simple class to count incoming messages and periodically log
-    the number of messages per second.
+    the number of messages per second. One instance is shared by all
+    connections; ``notify()`` is called by the heartbeat.
     """
     
     def __init__(self):
@@ -273,9 +415,7 @@ class MessageCounter:
         self._mps = [(time.time(), 0)]  # tuples of (time, count)
         self._collect_count = 0
         self._collect_stoptime = 0
-        
-        self._stop = False
-        self._notify()
+        self._notify_time = 0
     
     def trigger(self):
         t = time.time()
@@ -286,7 +426,10 @@ class MessageCounter:
             self._collect_count = 1
             self._collect_stoptime = t + self._collect_interval
     
-    def _notify(self):
+    @property
+    def mps(self):
+        """ The number of messages per second, over a sliding window.
+        """
         mintime = time.time() - self._window_interval
         self._mps = [x for x in self._mps if x[0] > mintime]
         if self._mps:
@@ -294,17 +437,133 @@ class MessageCounter:
             T = self._mps[-1][0] - self._mps[0][0] + self._collect_interval
         else:
             n, T = 0, self._collect_interval
-        logging.debug('Websocket messages per second: %1.1f' % (n / T))
+        return n / T
+    
+    def notify(self):
+        """ Log the messages per second, if the notify interval has passed.
+        """
+        t = time.time()
+        if t - self._notify_time >= self._notify_interval:
+            self._notify_time = t
+            logging.debug('Websocket messages per second: %1.1f' % self.mps)
+
+
+class Heartbeat:
+    """ Pings all websocket connections, and closes connections that do
+    not respond, using a single timer for all connections.
+    
+    Connections are distributed over a number of slots (a timer wheel).
+    On each tick, the connections in one slot are pinged, so that each
+    connection is pinged once per interval, while the pings are spread
+    out in time. The times of the last pong (or message) are stored in a
+    single array, and once per rotation all connections that timed out
+    are closed in one sweep. The timer only runs while there are
+    connections.
+    """
+    
+    def __init__(self, interval=2.0, timeout=20.0, nslots=8):
+        self.interval = float(interval)
+        self.timeout = float(timeout)
+        self.nslots = int(nslots)
+        self.message_counter = MessageCounter()
         
-        if not self._stop:
-            server.call_later(self._notify_interval, self._notify)
+        self._connections = []  # index -> ws or None
+        self._pongtimes = array.array('d')  # index -> time of last pong
+        self._free = []  # indices that can be reused
+        self._count = 0
+        self._slot = 0
+        self._timer = None
+    
+    def __len__(self):
+        return self._count
+    
+    def register(self, ws):
+        """ Start pinging the given websocket handler.
+        """
+        if getattr(ws, '_heartbeat_index', None) is not None:
+            return
+        if self._free:
+            i = self._free.pop()
+            self._connections[i] = ws
+            self._pongtimes[i] = time.time()
+        else:
+            i = len(self._connections)
+            self._connections.append(ws)
+            self._pongtimes.append(time.time())
+        ws._heartbeat_index = i
+        self._count += 1
+        if self._timer is None:
+            self._timer = self._create_timer(self._tick, self.interval / self.nslots)
+    
+    def unregister(self, ws):
+        """ Stop pinging the given websocket handler.
+        """
+        i = getattr(ws, '_heartbeat_index', None)
+        if i is None or self._connections[i] is not ws:
+            return
+        ws._heartbeat_index = None
+        self._connections[i] = None
+        self._pongtimes[i] = float('inf')  # never times out
+        self._free.append(i)
+        self._count -= 1
+        if self._count == 0:
+            self.stop()
+    
+    def pong(self, ws):
+        """ Mark the given websocket handler as alive.
+        """
+        i = getattr(ws, '_heartbeat_index', None)
+        if i is not None:
+            self._pongtimes[i] = time.time()
     
     def stop(self):
-        self._stop = True
+        """ Stop the timer (it starts again when a connection registers).
+        """
+        if self._timer is not None:
+            self._timer.stop()
+            self._timer = None
+    
+    def _create_timer(self, callback, interval):
+        """ Create and start a timer that calls the callback every
+        interval seconds. The returned object must have a stop() method.
+        """
+        timer = tornado.ioloop.PeriodicCallback(callback, 1000 * interval)
+        timer.start()
+        return timer
+    
+    def _tick(self):
+        # Ping the connections in the current slot
+        connections = self._connections
+        for i in range(self._slot, len(connections), self.nslots):
+            ws = connections[i]
+            if ws is not None:
+                try:
+                    ws.ping(b'x')
+                except Exception:
+                    pass  # closed; on_close() will unregister it
+        self._slot = (self._slot + 1) % self.nslots
+        # Once per rotation, evict connections that timed out
+        if self._slot == 0:
+            self._sweep()
+            self.message_counter.notify()
+    
+    def _sweep(self):
+        deadline = time.time() - self.timeout
+        pongtimes = self._pongtimes
+        for i in range(len(pongtimes)):
+            if pongtimes[i] < deadline:
+                ws = self._connections[i]
+                self.unregister(ws)
+                ws.close(1000, 'Conection timed out (no pong).')
 
 
-class WSHandler(tornado.websocket.WebSocketHandler):
-    """ Handler for websocket.
+class WSHandlerMixin:
+    """ Handles the Flexx protocol on a websocket, independent of the
+    server implementation. The class that this is mixed into must
+    implement ``command()``, ``close()`` and ``ping()``, call
+    ``on_message()``, ``on_pong()`` and ``on_close()``, and have the
+    attributes ``close_code``, ``close_reason`` and ``flexx_server``
+    (which has a ``heartbeat``).
     """
     
     # https://tools.ietf.org/html/rfc6455#section-7.4.1
@@ -314,19 +573,11 @@ class WSHandler(tornado.websocket.WebSocketHandler):
                      1003: 'could not accept data',
                      }
     
-    # --- callbacks
-    
-    def open(self, path=None):
-        """ Called when a new connection is made.
+    def _open_app(self, path):
+        """ Associate this connection with the app at the given path.
+        Returns False (and closes the connection) if there is no such app.
         """
-        if not hasattr(self, 'close_code'):  # old version of Tornado?
-            self.close_code, self.close_reason = None, None
-        
         self._session = None
-        self._mps_counter = MessageCounter()
-        
-        # Don't collect messages to send them more efficiently, just send asap
-        # self.set_nodelay(True)
         
         if isinstance(path, bytes):
             path = path.decode()
@@ -334,12 +585,11 @@ class WSHandler(tornado.websocket.WebSocketHandler):
         
         print('new ws connection', path)
         if manager.has_app_name(self.app_name):
-            if tornado.version_info < (4, ):
-                tornado.ioloop.IOLoop.current().add_callback(self.pinger)
-            else:
-                tornado.ioloop.IOLoop.current().spawn_callback(self.pinger)
+            self.flexx_server.heartbeat.register(self)
+            return True
         else:
             self.close(1003, "Could not associate socket with an app.")
+            return False
     
     # todo: @gen.coroutine?
     def on_message(self, message):
@@ -348,19 +598,38 @@ class WSHandler(tornado.websocket.WebSocketHandler):
         We now have a very basic protocol for receiving messages,
         we should at some point define a real formalized protocol.
         """
-        self._mps_counter.trigger()
+        heartbeat = self.flexx_server.heartbeat
+        heartbeat.message_counter.trigger()
+        heartbeat.pong(self)
         
-        self._pongtime = time.time()
+        kind = command_type(message, IN_COMMANDS)
+        _messages_in.inc(1, (kind, ))
+        _bytes_in.inc(len(message if isinstance(message, bytes) else message.encode()),
+                      (kind, ))
+        t0 = metrics.timer()
+        try:
+            self._handle_message(message)
+        finally:
+            _command_duration.observe(metrics.timer() - t0, (kind, ))
+    
+    def _handle_message(self, message):
         if self._session is None:
             if message.startswith('hiflexx '):
-                session_id = message.split(' ', 1)[1].strip()
+                # "hiflexx <session_id>", or "hiflexx <session_id> <seq>"
+                # to resume a session of which seq messages were received
+                parts = message.split(' ')
+                session_id = parts[1].strip()
+                seq = int(parts[2]) if len(parts) > 2 else None
                 try:
                     self._session = manager.connect_client(self, self.app_name,
-                                                           session_id)
+                                                           session_id, seq)
                 except Exception as err:
-                    self.close(1003, "Could not launch app: %r" % err)
+                    # A failed resume is not final; the client may try again
+                    code = 1003 if seq is None else 1011
+                    self.close(code, "Could not launch app: %r" % err)
                     raise
-                self.write_message("PRINT Flexx server says hi", binary=True)
+                if seq is None:
+                    self._session._send_command("PRINT Flexx server says hi")
         else:
             self._session._receive_command(message)
     
@@ -370,39 +639,22 @@ class WSHandler(tornado.websocket.WebSocketHandler):
         self.close_code = code = self.close_code or 0
         reason = self.close_reason or self.known_reasons.get(code, '')
         print('detected close: %s (%i)' % (reason, code))
-        self._mps_counter.stop()
+        self.flexx_server.heartbeat.unregister(self)
         if self._session is not None:
             manager.disconnect_client(self._session)
             self._session = None  # Allow cleaning up
     
-    @gen.coroutine
-    def pinger(self):
-        """ Check for timeouts. This helps remove lingering false connections.
-        """
-        self._pongtime = time.time()
-        while self.close_code is None:
-            self.ping(b'x')
-            yield gen.sleep(2)
-            if time.time() - self._pongtime > 20:
-                self.close(1000, 'Conection timed out (no pong).')
-                return
-    
     def on_pong(self, data):
         """ Called when our ping is returned.
         """
-        logging.debug('pong')
-        self._pongtime = time.time()
-    
-    # --- methods
+        self.flexx_server.heartbeat.pong(self)
     
-    def command(self, cmd):
-        self.write_message(cmd, binary=True)
-    
-    def close(self, *args):
-        try:
-            tornado.websocket.WebSocketHandler.close(self, *args)
-        except TypeError:
-            tornado.websocket.WebSocketHandler.close(self)  # older Tornado
+    def _count_command(self, cmd):
+        """ Update the metrics for an outgoing command (bytes).
+        """
+        kind = command_type(cmd, OUT_COMMANDS)
+        _messages_out.inc(1, (kind, ))
+        _bytes_out.inc(len(cmd), (kind, ))
     
     def close_this(self):
         """ Call this to close the websocket
@@ -412,7 +664,7 @@ class WSHandler(tornado.websocket.WebSocketHandler):
     def check_origin(self, origin):
         """ Handle cross-domain access; override default same origin policy.
         """
-        host, port = self.application.serving_at  # set by us
+        host, port = self.flexx_server.serving_at  # set by us
         incoming_host = urlparse(origin).hostname
         if host == 'localhost':
             return True  # Safe
@@ -423,3 +675,89 @@ class WSHandler(tornado.websocket.WebSocketHandler):
         else:
             print('Connection refused from %s' % origin)
             return False
+
+
+# Sending small messages uncompressed, and disabling context takeover from
+# the server side, needs Tornado's private websocket API. It is only used
+# with the Tornado version that it was tested with.
+_PRIVATE_WS_API = tornado.version_info[:2] == (4, 5)
+
+
+class WSHandler(WSHandlerMixin, tornado.websocket.WebSocketHandler):
+    """ Handler for websocket.
+    """
+    
+    @property
+    def flexx_server(self):
+        return server
+    
+    # --- callbacks
+    
+    def open(self, path=None):
+        """ Called when a new connection is made.
+        """
+        if not hasattr(self, 'close_code'):  # old version of Tornado?
+            self.close_code, self.close_reason = None, None
+        
+        # Don't collect messages to send them more efficiently, just send asap
+        # self.set_nodelay(True)
+        
+        if self._open_app(path):
+            self._init_compression()
+    
+    def _init_compression(self):
+        self._compress_threshold = None  # None means send all via write_message
+        if not _PRIVATE_WS_API:
+            return
+        compressor = getattr(self.ws_connection, '_compressor', None)
+        if compressor is None or not hasattr(self.ws_connection, '_write_frame'):
+            return
+        c = server.compression
+        if not c['context_takeover']:
+            # Use a fresh context for each message, even if the client
+            # did not ask for it; the client can decompress either way
+            compressor._compressor = None
+        self._compress_threshold = c['threshold']
+        if self._compress_threshold is None:
+            # Small messages compress well only when the context is kept
+            persistent = compressor._compressor is not None
+            self._compress_threshold = 0 if persistent else 256
+    
+    def get_compression_options(self):
+        """ Enable permessage-deflate if configured (see
+        ``TornadoServer.configure_compression()``).
+        """
+        c = server.compression
+        if c['enabled']:
+            return dict(compression_level=c['level'], mem_level=c['mem_level'])
+    
+    # --- methods
+    
+    def command(self, cmd):
+        """ Send a command. Returns a Future that resolves when the data
+        has been written (this is used by the session for backpressure).
+        """
+        if not isinstance(cmd, bytes):
+            cmd = cmd.encode()
+        self._count_command(cmd)
+        threshold = getattr(self, '_compress_threshold', None)
+        if threshold and len(cmd) < threshold and self.ws_connection is not None:
+            # Small messages are not worth compressing. RFC 7692 allows
+            # sending them as is; they don't affect the compression context.
+            conn = self.ws_connection
+            conn._message_bytes_out += len(cmd)
+            try:
+                return conn._write_frame(True, 0x2, cmd)
+            except StreamClosedError:
+                raise tornado.websocket.WebSocketClosedError()  # as write_message
+        return self.write_message(cmd, binary=True)
+    
+    def close(self, *args):
+        try:
+            tornado.websocket.WebSocketHandler.close(self, *args)
+        except TypeError:
+            tornado.websocket.WebSocketHandler.close(self)  # older Tornado
+
+
+# Create server instance
+server = TornadoServer()
@@ -309,8 +309,8 @@ something we'd need to work out ...
 """
 
 from .signals import SignalValueError, Signal, undefined  # noqa
-from .signals import Signal, SourceSignal, InputSignal, LazySignal  # noqa
-from .decorators import connect, source, input, lazy, nosync  # noqa
+from .signals import Signal, SourceSignal, InputSignal, LazySignal, AutoSignal  # noqa
+from .decorators import connect, source, input, lazy, auto, nosync, syncmode  # noqa
 from .hassignals import HasSignals  # noqa
 from .functional import map, filter, reduce, merge  # noqa
 
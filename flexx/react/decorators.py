@@ -5,6 +5,7 @@ The decorator functions that make up the core API for flexx.react.
 import sys
 
 from .signals import Signal, SourceSignal, InputSignal, LazySignal, PropSignal
+from .signals import AutoSignal
 
 
 def _first_arg_is_func(ii):
@@ -176,9 +177,74 @@ def lazy(*input_signals):
     return _lazy    
 
 
+def auto(func):
+    """ Decorator to transform a function into an AutoSignal object.
+    
+    An auto signal does not specify its upstream signals. Instead, it
+    keeps track of the signals that are read (i.e. called) while its
+    function is evaluated, and connects to exactly these signals. The
+    dependencies are updated each time that the signal is evaluated, so
+    it only reacts to signals that are actually used. The function
+    takes no arguments (except ``self`` for methods).
+    
+    Example:
+        
+        .. code-block:: py
+        
+            @react.auto
+            def total_flex(self):
+                return sum([child.flex()[0] for child in self.children()])
+    """
+    if isinstance(func, Signal) or not callable(func):
+        raise ValueError('Auto signal must be used as a plain decorator.')
+    frame = sys._getframe(1)
+    return AutoSignal(func, [], frame=frame)
+
+
 def nosync(signal):
     """ Decorator for signals that should not be synced.
     In Flexx.app this means no syncing between Py and JS.
     """
     signal.flags['nosync'] = True
     return signal
+
+
+SYNC_MODES = 'immediate', 'frame', 'rate', 'idle'
+
+def syncmode(mode, rate=None):
+    """ Decorator to specify how often changes of a signal are synced.
+    In Flexx.app this determines how a signal that changes in JS is
+    sent to Python. Intermediate values are coalesced; only the latest
+    value is sent.
+    
+    Modes:
+    
+    * 'immediate' - send each change right away (the default).
+    * 'frame' - send at most once per animation frame.
+    * 'rate' - send at most ``rate`` times per second.
+    * 'idle' - send when the client is idle.
+    
+    Example:
+        
+        .. code-block:: py
+        
+            @react.syncmode('rate', 10)
+            @react.source
+            def mouse_pos(pos=(0, 0)):
+                return pos
+    """
+    if mode not in SYNC_MODES:
+        raise ValueError('Invalid syncmode %r, must be one of %r.' %
+                         (mode, SYNC_MODES))
+    if mode == 'rate':
+        if not (isinstance(rate, (int, float)) and rate > 0):
+            raise ValueError('Syncmode "rate" needs a positive rate.')
+    elif rate is not None:
+        raise ValueError('Only syncmode "rate" takes a rate.')
+    
+    def _syncmode(signal):
+        signal.flags['syncmode'] = mode
+        if rate is not None:
+            signal.flags['syncrate'] = float(rate)
+        return signal
+    return _syncmode
@@ -0,0 +1,288 @@
+"""
+Opt-in instrumentation of the reactive graph.
+
+A ``Profiler`` records, for each signal, how often its function is
+evaluated and how much time that takes. It also records *transactions*:
+everything that is evaluated as a consequence of setting a source
+signal, with the propagation depth (the longest chain of signals that
+were updated) and fan-out (the number of signals that were updated).
+
+.. code-block:: py
+
+    from flexx.react.profiling import Profiler, dump_graph
+
+    with Profiler() as profiler:
+        ob.first_name('jane')
+    print(profiler.report())
+    print(dump_graph(ob, profiler))
+
+When no profiler is active, the only cost is a check for ``None`` each
+time that the function of a signal is called. Profiling is only
+available in Python (not for signals that live in JS).
+"""
+
+import json
+import time
+import weakref
+
+from . import signals as _signals
+
+_timer = getattr(time, 'perf_counter', time.time)  # legacy Python has no perf_counter
+
+
+class SignalStats:
+    """ Statistics for a single signal.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def __repr__(self):
+        return '<SignalStats %r: %i calls, %0.3f ms total, %0.3f ms max>' % (
+            self.name, self.count, self.total_time * 1000, self.max_time * 1000)
+
+    def to_dict(self):
+        return dict(name=self.name, count=self.count,
+                    total_time=self.total_time, max_time=self.max_time)
+
+
+class Transaction:
+    """ The evaluations that followed from setting a source signal.
+    """
+
+    def __init__(self, source):
+        self.source = _signal_name(source)
+        self.depth = 0
+        self.fanout = 0
+        self._source = source
+        self._depths = {source: 0}
+
+    def __repr__(self):
+        return '<Transaction from %r: depth %i, fan-out %i>' % (
+            self.source, self.depth, self.fanout)
+
+    def to_dict(self):
+        return dict(source=self.source, depth=self.depth, fanout=self.fanout)
+
+
+class Profiler:
+    """ Records evaluation statistics of all signals in Python.
+
+    Only one profiler can be active at a time. Use ``start()`` and
+    ``stop()``, or use the profiler as a context manager.
+
+    Parameters:
+        max_transactions (int): the number of most recent transactions
+            to keep. Default 1000.
+    """
+
+    def __init__(self, max_transactions=1000):
+        self._max_transactions = int(max_transactions)
+        self.reset()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    def reset(self):
+        """ Clear all recorded statistics.
+        """
+        self._stats = weakref.WeakKeyDictionary()
+        self._transactions = []
+        self._transaction_count = 0
+        self._current = None
+        self._stack = []
+
+    def start(self):
+        """ Start recording.
+        """
+        if _signals._profiler not in (None, self):
+            raise RuntimeError('Another profiler is already active.')
+        _signals._profiler = self
+
+    def stop(self):
+        """ Stop recording.
+        """
+        if _signals._profiler is self:
+            _signals._profiler = None
+        self._close_transaction()
+
+    @property
+    def active(self):
+        """ Whether this profiler is currently recording.
+        """
+        return _signals._profiler is self
+
+    def get_stats(self, signal):
+        """ Get the ``SignalStats`` for the given signal, or None if
+        the signal was not evaluated while profiling.
+        """
+        return self._stats.get(signal, None)
+
+    def stats(self):
+        """ Get a list of ``SignalStats`` objects for the signals that
+        are alive, sorted by cumulative time (highest first).
+        """
+        stats = list(self._stats.values())
+        stats.sort(key=lambda s: s.total_time, reverse=True)
+        return stats
+
+    @property
+    def transactions(self):
+        """ The most recent (completed) transactions.
+        """
+        if self._current is not None and not self._current._source._is_being_set:
+            self._close_transaction()
+        return list(self._transactions)
+
+    @property
+    def transaction_count(self):
+        """ The total number of recorded transactions.
+        """
+        self.transactions  # close finished transaction
+        return self._transaction_count
+
+    def report(self, n=20):
+        """ Get a human readable summary of the ``n`` most expensive
+        signals and the transactions.
+        """
+        lines = ['%-40s %8s %12s %12s' % ('signal', 'calls', 'total [ms]', 'max [ms]')]
+        for s in self.stats()[:n]:
+            lines.append('%-40s %8i %12.3f %12.3f' % (
+                         s.name[:40], s.count, s.total_time * 1000, s.max_time * 1000))
+        transactions = self.transactions
+        if transactions:
+            depths = [t.depth for t in transactions]
+            fanouts = [t.fanout for t in transactions]
+            lines.append('%i transactions, depth max %i mean %0.1f, '
+                         'fan-out max %i mean %0.1f' %
+                         (self._transaction_count,
+                          max(depths), sum(depths) / len(depths),
+                          max(fanouts), sum(fanouts) / len(fanouts)))
+        return '\n'.join(lines)
+
+    def _close_transaction(self):
+        t, self._current = self._current, None
+        if t is not None:
+            t._depths = None
+            self._transaction_count += 1
+            self._transactions.append(t)
+            if len(self._transactions) > self._max_transactions:
+                self._transactions.pop(0)
+
+    def _call_func(self, signal, args):
+        """ Call the function of the signal, while keeping track of time
+        and transactions. Called from ``Signal._call_func()``.
+        """
+        # Determine in which transaction this evaluation occurs
+        t = self._current
+        new = not self._stack and getattr(signal, '_is_being_set', False)
+        if t is not None and (new or not t._source._is_being_set):
+            self._close_transaction()
+            t = None
+        depth = 0
+        if new:
+            t = self._current = Transaction(signal)
+        elif t is not None and signal not in t._depths:
+            depth = -1
+            for s in signal._upstream:
+                depth = max(depth, t._depths.get(s, -1))
+            if self._stack:  # e.g. a source being set by another signal
+                depth = max(depth, self._stack[-1])
+            depth += 1
+            t._depths[signal] = depth
+            t.depth = max(t.depth, depth)
+            t.fanout += 1
+
+        # Call
+        func = signal._func
+        if signal._func_is_method and signal._ob is not None:
+            args = (signal._ob(), ) + args
+        self._stack.append(depth)
+        t0 = _timer()
+        try:
+            return func(*args)
+        finally:
+            t1 = _timer() - t0
+            self._stack.pop()
+            stats = self._stats.get(signal, None)
+            if stats is None:
+                stats = self._stats[signal] = SignalStats(_signal_name(signal))
+            stats.count += 1
+            stats.total_time += t1
+            stats.max_time = max(stats.max_time, t1)
+
+
+def _signal_name(signal):
+    ob = signal._self
+    if ob is None:
+        return signal._name
+    return '%s.%s' % (ob.__class__.__name__, signal._name)
+
+
+def dump_graph(ob, profiler=None, format='dot'):
+    """ Get a graph of the signals of the given ``HasSignals`` instance
+    and the signals that they are directly connected to.
+
+    Parameters:
+        ob (HasSignals): the object to get the graph for.
+        profiler (Profiler, optional): if given, the nodes are annotated
+            with the recorded statistics.
+        format (str): 'dot' (for Graphviz) or 'json'.
+
+    Returns:
+        str: the graph in the requested format.
+    """
+    if format not in ('dot', 'json'):
+        raise ValueError('Graph format must be "dot" or "json", not %r.' % format)
+
+    # Collect signals and connections
+    signals = []
+    edges = []
+    
+    def add(s):
+        if s not in signals:
+            signals.append(s)
+    for name in ob.__signals__:
+        add(getattr(ob, name))
+    for s in list(signals):
+        for s2 in s._upstream:
+            add(s2)
+            edges.append((s2, s))
+        for s2 in s._downstream:
+            if s2._self is not ob:
+                add(s2)
+                edges.append((s, s2))
+
+    # Build nodes
+    nodes = []
+    for s in signals:
+        node = dict(id='s%x' % id(s), name=_signal_name(s), type=s.__class__.__name__,
+                    status=s._status, fanout=len(list(s._downstream)))
+        stats = profiler.get_stats(s) if profiler is not None else None
+        if stats is not None:
+            node.update(count=stats.count, total_time=stats.total_time,
+                        max_time=stats.max_time)
+        nodes.append(node)
+
+    if format == 'json':
+        edges = [('s%x' % id(a), 's%x' % id(b)) for a, b in edges]
+        return json.dumps(dict(nodes=nodes, edges=edges), indent=2, sort_keys=True)
+
+    lines = ['digraph signals {', '    node [shape=box];']
+    for node in nodes:
+        label = '%s\\n%s' % (node['name'], node['type'])
+        if 'count' in node:
+            label += '\\n%i calls, %0.3f ms' % (node['count'],
+                                                node['total_time'] * 1000)
+        lines.append('    %s [label="%s"];' % (node['id'], label))
+    for a, b in edges:
+        lines.append('    s%x -> s%x;' % (id(a), id(b)))
+    lines.append('}')
+    return '\n'.join(lines)
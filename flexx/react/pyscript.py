@@ -7,7 +7,7 @@ import json
 from ..pyscript import py2js as py2js_, undefined
 from ..pyscript.parser2 import get_class_definition
 
-from .signals import Signal, SourceSignal
+from .signals import Signal, SourceSignal, AutoSignal
 
 Object = Date = None  # fool pyflake
 
@@ -31,6 +31,7 @@ class HasSignalsJS:
     contains the auto-generated JavaScript for this class.
     """
     __signals__ = []
+    _signal_trackers = []  # shared stack for AutoSignal objects
     
     def __init__(self):
         self._create_signals()
@@ -104,6 +105,15 @@ class HasSignalsJS:
         selff._active = False
         return selff
     
+    def _create_AutoSignal(self, func, upstream, selff=None):
+        selff = self._create_Signal(func, upstream, selff)
+        
+        AutoSignal__track_from_py  # noqa
+        AutoSignal__update_value_from_py  # noqa
+        AutoSignal__update_upstream_from_py  # noqa
+        
+        return selff
+    
     def _create_Signal(self, func, upstream, selff=None):
         # We create the selff function which then serves as the signal object
         # that we populate with attributres, properties and functions.
@@ -139,6 +149,7 @@ class HasSignalsJS:
         selff._downstream = []
         selff._upstream_reconnect = []
         selff._downstream_reconnect = []
+        selff._trackers = obj._signal_trackers
         
         # Functions that we re-use from the Python implementation of signals
         BaseSignal_connect_from_py  # noqa
@@ -204,9 +215,11 @@ class HasSignalsJS:
 def patch_HasSignals(jscode):
     """ Insert code from the Python implementation of signals.
     """
-    for signal_type, cls in [('BaseSignal', Signal), ('SourceSignal', SourceSignal)]:
+    for signal_type, cls in [('BaseSignal', Signal), ('SourceSignal', SourceSignal),
+                             ('AutoSignal', AutoSignal)]:
         for name in ('connect', 'disconnect', '_subscribe', '_unsubscribe', '_set',
-                     '_get_value', '_update_value', '_set_status', '_seek_signal'):
+                     '_get_value', '_update_value', '_set_status', '_seek_signal',
+                     '_track', '_update_upstream'):
             if name in cls.__dict__:
                 code = py2js(cls.__dict__[name], 'selff.' + name, indent=1,
                              docstrings=False)
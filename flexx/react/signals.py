@@ -4,6 +4,7 @@ Implements the different signal classes.
 
 import sys
 import time
+import types
 import inspect
 import weakref
 import logging
@@ -22,6 +23,11 @@ class SignalValueError(Exception):
     pass
 
 
+# Set by flexx.react.profiling.Profiler; checking for None is all that
+# it costs when profiling is disabled.
+_profiler = None
+
+
 class ObjectFrame:
     """ A proxy frame that gives access to the class instance (usually
     from HasSignals) as a frame, combined with the frame that the class
@@ -62,6 +68,105 @@ class ObjectFrame:
         return ObjectFrame(self._ob(), self._frame.f_back)
 
 
+class FrameSnapshot:
+    """ A light-weight replacement for a function frame, which only
+    holds on to the local variables that a signal needs to (re)connect.
+    Real frames keep all their locals (and thereby objects) alive.
+    """
+    
+    def __init__(self, frame, names):
+        locals = frame.f_locals
+        self.f_locals = dict([(n, locals[n]) for n in names if n in locals])
+        self.f_globals = frame.f_globals
+    
+    @property
+    def f_back(self):
+        return self
+
+
+class SubscriberList:
+    """ List-like container for the downstream signals of a signal.
+    
+    Signals that are associated with an object (e.g. a HasSignals
+    instance) are kept alive by that object, and are therefore referenced
+    weakly, so that an upstream signal does not keep them alive. Other
+    signals are referenced normally, since often nothing else refers
+    to them. Only used in Python; in JS these are plain arrays.
+    """
+    
+    __slots__ = ['_items', '_index', '_dead', '_shared']
+    
+    def __init__(self):
+        self._items = []  # signals and weak references to signals
+        self._index = {}  # id(signal) -> item, for fast membership tests
+        self._dead = 0  # number of dead references in _items
+        self._shared = False  # whether _items may be in use by an iteration
+    
+    def _deref(self, item):
+        return item() if isinstance(item, weakref.ref) else item
+    
+    def _writable(self):
+        # Copy on write, so that ongoing iterations are not affected
+        if self._shared:
+            self._items = list(self._items)
+            self._shared = False
+    
+    def _on_dead(self, key, ref):
+        if self._index.get(key) is ref:
+            del self._index[key]
+            self._dead += 1
+    
+    def append(self, signal):
+        self._writable()
+        # Compact when half of the references is dead, so that the cost
+        # is amortized
+        if self._dead * 2 > len(self._items):
+            self._items = [item for item in self._items
+                           if self._deref(item) is not None]
+            self._dead = 0
+        key = id(signal)
+        if signal._ob is not None:
+            item = weakref.ref(signal, lambda ref: self._on_dead(key, ref))
+        else:
+            item = signal
+        self._items.append(item)
+        self._index[key] = item
+    
+    def remove(self, signal):
+        item = self._index.pop(id(signal), None)
+        if item is None or self._deref(item) is not signal:
+            raise ValueError('Signal not in subscriber list.')
+        self._writable()
+        for i, x in enumerate(self._items):
+            if x is item:
+                del self._items[i]
+                return
+    
+    def __contains__(self, signal):
+        item = self._index.get(id(signal), None)
+        return item is not None and self._deref(item) is signal
+    
+    def __iter__(self):
+        # The list is not modified while it is shared, so we iterate over
+        # a snapshot, allowing modifications on the fly
+        items = self._items
+        self._shared = True
+        for item in items:
+            signal = self._deref(item)
+            if signal is not None:
+                yield signal
+    
+    def __bool__(self):
+        for signal in self:
+            return True
+        return False
+    
+    __nonzero__ = __bool__  # legacy Python
+    
+    def __repr__(self):
+        return '<SubscriberList %r>' % list(iter(self))
+
+
 class Signal:
     """ A Signal is an object that provides a value that changes over time.
     The current value can be obtained by calling the signal object or via
@@ -71,6 +176,7 @@ class Signal:
     """
     _IS_SIGNAL = True  # poor man's isinstance in JS (because class name mangling)
     _active = True
+    _trackers = []  # stack of AutoSignal objects (shared by all signals)
     
     def __init__(self, func, upstream, frame=None, ob=None, flags=None):
         # Check and set func
@@ -89,9 +195,9 @@ class Signal:
             assert isinstance(s, str) or isinstance(s, Signal)
         self._upstream_given = [s for s in upstream]
         self._upstream = []
-        self._downstream = []
+        self._downstream = SubscriberList()
         self._upstream_reconnect = []
-        self._downstream_reconnect = []
+        self._downstream_reconnect = SubscriberList()
         
         # Frame and object
         self._frame = frame or sys._getframe(1)
@@ -301,6 +407,14 @@ class Signal:
                 self._upstream = []
                 return msg
         
+        # Release the frame if we can: a real frame holds on to all of
+        # its local variables. We only need the names that we resolve.
+        frame = self._frame
+        if isinstance(frame, types.FrameType) and frame.f_locals is not frame.f_globals:
+            names = [n.split('.')[0] for n in self._upstream_given
+                     if not getattr(n, '_IS_SIGNAL', False)]
+            self._frame = FrameSnapshot(frame, names)
+        
         return False  # no error
     
     def _subscribe(self, signal, reconnect=False):
@@ -382,6 +496,16 @@ class Signal:
         """ Get the current value. Some overhead is put here to keep
         update_value compact.
         """
+        # Let the AutoSignal that is being evaluated know that we're read.
+        # Reads that happen while we update ourselves are not tracked.
+        trackers = self._trackers
+        if len(trackers) and trackers[len(trackers) - 1] is not None:
+            trackers[len(trackers) - 1]._track(self)
+            trackers.append(None)
+            try:
+                return self._get_value()
+            finally:
+                trackers.pop()
         if self._not_connected:
             self.connect(False)
         if self._status == 1:
@@ -414,6 +538,8 @@ class Signal:
                                'which signal %r is not.' % self._name)
     
     def _call_func(self, *args):
+        if _profiler is not None:
+            return _profiler._call_func(self, args)
         if self._func_is_method and self._ob is not None:
             return self._func(self._ob(), *args)
         else:
@@ -449,7 +575,7 @@ class Signal:
         if self is initial_initiator:
             return
         # Allow downstream to update
-        for signal in self._downstream_reconnect[:]:  # list may be modified
+        for signal in list(self._downstream_reconnect):  # list may be modified
             signal.connect(False)
         for signal in self._downstream:
             signal._set_status(status, initiator)
@@ -498,7 +624,7 @@ class SourceSignal(Signal):
             self._set_value(value)
             if value is undefined:
                 return  # no need to update
-            for signal in self._downstream_reconnect[:]:  # list may be modified
+            for signal in list(self._downstream_reconnect):  # list may be modified
                 signal.connect(False)
             for signal in self._downstream:
                 signal._set_status(1, self)  # do not set status of *this* signal!
@@ -547,3 +673,39 @@ class LazySignal(Signal):
     the latest upstream values at the last moment.
     """
     _active = False
+
+
+class AutoSignal(Signal):
+    """ A signal that has no explicitly specified upstream signals, but
+    that records which signals it reads while its function is evaluated.
+    It subscribes to exactly these signals, and updates the subscriptions
+    incrementally each time that it is evaluated.
+    """
+    
+    def _track(self, signal):
+        """ Called by signals that are read during our evaluation.
+        """
+        if signal is not self and signal not in self._reads:
+            self._reads.append(signal)
+    
+    def _update_value(self):
+        self._reads = []
+        self._trackers.append(self)
+        try:
+            value = self._call_func()
+        finally:
+            self._trackers.pop()
+            self._update_upstream(self._reads)
+        self._set_value(value)
+    
+    def _update_upstream(self, signals):
+        """ Subscribe to the given signals, and unsubscribe from upstream
+        signals that are no longer used.
+        """
+        for s in self._upstream:
+            if s not in signals:
+                s._unsubscribe(self)
+        for s in signals:
+            if s not in self._upstream:
+                s._subscribe(self)
+        self._upstream = signals
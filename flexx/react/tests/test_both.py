@@ -17,7 +17,7 @@ single quotes.
 
 from flexx.util.testing import run_tests_if_main, raises
 
-from flexx.react import source, input, connect, lazy, HasSignals, undefined
+from flexx.react import source, input, connect, lazy, auto, HasSignals, undefined
 from flexx.react.pyscript import create_js_signals_class, HasSignalsJS, reprs
 from flexx.pyscript.functions import py2js, evaljs, evalpy, js_rename
 from flexx.pyscript.stdlib import get_std_info, get_partial_std_lib
@@ -691,4 +691,49 @@ def test_dynamism2(Cls):
     d.current_persons(())
     return d.r
 
+
+class Auto(HasSignals):
+    
+    def __init__(self):
+        self.r = []
+        self.count = 0
+        super().__init__()
+    
+    @input
+    def use_a(v=True):
+        return bool(v)
+    
+    @input
+    def a(v=1):
+        return v
+    
+    @input
+    def b(v=2):
+        return v
+    
+    @auto
+    def picked(self):
+        self.count += 1
+        if self.use_a():
+            return self.a()
+        return self.b()
+
+
+@run_in_both(Auto, "[1, 3, 5, 4, 4, 4]")
+def test_auto_signal(Cls):
+    s = Cls()
+    s.r.append(s.picked())
+    s.a(3)  # dependency
+    s.r.append(s.picked())
+    s.b(5)  # not a dependency yet
+    s.use_a(False)
+    s.r.append(s.picked())
+    s.a(6)  # no longer a dependency
+    s.b(4)
+    s.r.append(s.picked())
+    s.r.append(s.picked())
+    s.r.append(s.count)
+    return s.r
+
+
 run_tests_if_main()
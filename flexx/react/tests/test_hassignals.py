@@ -1,6 +1,7 @@
 """ Test how signals behave on classes.
 """
 
+import gc
 import sys
 import weakref
 
@@ -284,4 +285,104 @@ def test_no_memory_leak():
     assert wt() is None  # pypy fails here, maybe needs a gc.collect()?
 
 
+
+def test_subscribers_modified_while_iterating():
+    from flexx.react.signals import SubscriberList
+    
+    class Foo(HasSignals):
+        @input
+        def x(v=0):
+            return v
+    
+    foos = [Foo() for i in range(4)]
+    subscribers = SubscriberList()
+    for foo in foos[:3]:
+        subscribers.append(foo.x)
+    foos.pop(0)
+    gc.collect()
+    
+    # Appending while iterating does not affect the iteration
+    visited = []
+    for signal in subscribers:
+        visited.append(signal)
+        if signal is foos[0].x:
+            subscribers.append(foos[2].x)
+    assert visited == [foos[0].x, foos[1].x]
+    assert list(subscribers) == [foos[0].x, foos[1].x, foos[2].x]
+    
+    # Removing while iterating
+    visited = []
+    for signal in subscribers:
+        visited.append(signal)
+        subscribers.remove(signal)
+    assert len(visited) == 3 and not subscribers
+    
+    # Appending is not a copy, except after iterating
+    subscribers.append(foos[0].x)
+    items = subscribers._items
+    subscribers.append(foos[1].x)
+    assert subscribers._items is items
+    list(subscribers)
+    subscribers.append(foos[2].x)
+    assert subscribers._items is not items
+    
+    # Dead references are compacted once they make up half of the list
+    many = [Foo() for i in range(10)]
+    for foo in many:
+        subscribers.append(foo.x)
+    assert len(subscribers._items) == 13
+    del many[:], foo
+    gc.collect()
+    assert subscribers._dead == 10 and len(list(subscribers)) == 3
+    assert foos[0].x in subscribers
+    subscribers.append(Foo().x)  # temporary one dies right away
+    assert len(subscribers._items) == 4 and subscribers._dead <= 1
+
+
+def test_releasing_without_disconnect():
+    
+    @input
+    def source(v=0):
+        return v
+    
+    class Foo(HasSignals):
+        @connect(source)
+        def follow(v):
+            return v
+    
+    class Bar:
+        pass
+    
+    # Signals of an object are held weakly by their upstream signals
+    foo = Foo()
+    wfoo = weakref.ref(foo)
+    assert foo.follow in source._downstream
+    assert len(list(source._downstream)) == 1
+    del foo
+    gc.collect()
+    assert wfoo() is None
+    assert len(list(source._downstream)) == 0
+    
+    # A signal does not hold on to the local variables of its frame
+    def make_handler(bar):
+        bar2 = bar  # noqa
+        @connect(source, 'source')
+        def handler(v1, v2):
+            return v1
+        return handler
+    
+    bar = Bar()
+    wbar = weakref.ref(bar)
+    handler = make_handler(bar)
+    del bar
+    gc.collect()
+    assert wbar() is None
+    assert list(handler._frame.f_locals.keys()) == ['source']
+    
+    # But plain signals are held by their upstream
+    assert handler in source._downstream
+    source(3)
+    assert handler() == 3
+
+
 run_tests_if_main()
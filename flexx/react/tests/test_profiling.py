@@ -0,0 +1,119 @@
+""" Tests for the profiling of signals
+"""
+
+import json
+
+from flexx.util.testing import run_tests_if_main, raises
+
+from flexx import react
+from flexx.react import input, connect, HasSignals, signals
+from flexx.react.profiling import Profiler, dump_graph
+
+
+class Name(HasSignals):
+    
+    @input
+    def first_name(v='john'):
+        return str(v)
+    
+    @input
+    def last_name(v='doe'):
+        return str(v)
+    
+    @connect('first_name', 'last_name')
+    def full_name(n1, n2):
+        return n1 + ' ' + n2
+    
+    @connect('full_name')
+    def name_length(v):
+        return len(v)
+
+
+def test_profiler_stats():
+    name = Name()
+    
+    p = Profiler()
+    assert not p.active
+    with p:
+        assert p.active
+        assert signals._profiler is p
+        name.first_name('jane')
+        name.last_name('jones')
+        
+        raises(RuntimeError, Profiler().start)
+    
+    assert not p.active
+    assert signals._profiler is None
+    
+    assert p.get_stats(name.first_name).count == 1
+    assert p.get_stats(name.full_name).count == 2
+    assert p.get_stats(name.name_length).count == 2
+    assert p.get_stats(name.name_length).max_time >= 0
+    assert 'Name.full_name' in repr(p.get_stats(name.full_name))
+    assert len(p.stats()) == 4
+    
+    # Not recorded anymore
+    name.first_name('john')
+    assert p.get_stats(name.full_name).count == 2
+    
+    p.reset()
+    assert p.stats() == []
+
+
+def test_profiler_transactions():
+    name = Name()
+    
+    p = Profiler()
+    with p:
+        name.first_name('jane')
+        name.last_name('jones')
+        name.full_name()  # evaluation outside a transaction
+    
+    assert p.transaction_count == 2
+    t1, t2 = p.transactions
+    assert t1.source == 'Name.first_name'
+    assert t2.source == 'Name.last_name'
+    assert t1.depth == 2 and t1.fanout == 2
+    assert t1.to_dict() == dict(source='Name.first_name', depth=2, fanout=2)
+    
+    report = p.report()
+    assert 'Name.full_name' in report
+    assert '2 transactions' in report
+    
+    # Limited amount of transactions
+    p = Profiler(max_transactions=3)
+    with p:
+        for i in range(5):
+            name.first_name(str(i))
+    assert p.transaction_count == 5
+    assert len(p.transactions) == 3
+
+
+def test_dump_graph():
+    name = Name()
+    p = Profiler()
+    with p:
+        name.first_name('jane')
+    
+    graph = json.loads(dump_graph(name, p, 'json'))
+    names = sorted(n['name'] for n in graph['nodes'])
+    assert names == ['Name.first_name', 'Name.full_name',
+                     'Name.last_name', 'Name.name_length']
+    assert len(graph['edges']) == 3
+    for n in graph['nodes']:
+        if n['name'] == 'Name.full_name':
+            assert n['count'] == 1
+            assert n['fanout'] == 1
+        if n['name'] == 'Name.last_name':
+            assert 'count' not in n
+    
+    dot = dump_graph(name)
+    assert dot.startswith('digraph')
+    assert dot.count('->') == 3
+    assert 'calls' not in dot
+    assert 'calls' in dump_graph(name, p)
+    
+    raises(ValueError, dump_graph, name, p, 'svg')
+
+
+run_tests_if_main()
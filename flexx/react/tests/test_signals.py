@@ -7,7 +7,7 @@ from flexx.util.testing import run_tests_if_main, raises
 
 from flexx import react
 from flexx.react import connect, input, source, lazy, SignalValueError, undefined
-from flexx.react import Signal, SourceSignal, InputSignal, LazySignal
+from flexx.react import Signal, SourceSignal, InputSignal, LazySignal, AutoSignal
 
 # todo: garbage collecting
 # todo: HasSignals
@@ -410,6 +410,85 @@ def test_func_name():
     assert s.name == 'float'
 
 
+def test_flags():
+    
+    @react.nosync
+    @input
+    def s1(v=10):
+        return float(v)
+    
+    @react.syncmode('rate', 20)
+    @input
+    def s2(v=10):
+        return float(v)
+    
+    @react.syncmode('frame')
+    @input
+    def s3(v=10):
+        return float(v)
+    
+    assert s1.flags == {'nosync': True}
+    assert s2.flags == {'syncmode': 'rate', 'syncrate': 20.0}
+    assert s3.flags == {'syncmode': 'frame'}
+    
+    raises(ValueError, react.syncmode, 'foo')
+    raises(ValueError, react.syncmode, 'rate')  # needs rate
+    raises(ValueError, react.syncmode, 'rate', 0)
+    raises(ValueError, react.syncmode, 'idle', 10)  # only rate takes rate
+
+
+def test_auto_signal():
+    
+    @input
+    def s1(v=1):
+        return v
+    
+    @input
+    def s2(v=2):
+        return v
+    
+    @input
+    def use_s1(v=True):
+        return bool(v)
+    
+    calls = []
+    
+    @react.auto
+    def s3():
+        calls.append(1)
+        return s1() if use_s1() else s2()
+    
+    assert isinstance(s3, AutoSignal)
+    assert s3() == 1
+    assert set(s3._upstream) == set([use_s1, s1])
+    
+    s2(3)  # not a dependency
+    assert len(calls) == 1
+    s1(4)
+    assert s3() == 4
+    assert len(calls) == 2
+    
+    use_s1(False)
+    assert s3() == 3
+    assert set(s3._upstream) == set([use_s1, s2])
+    assert s3 not in s1._downstream
+    s1(5)  # no longer a dependency
+    assert len(calls) == 3
+    
+    # Nested auto signals track only their direct reads
+    @react.auto
+    def s4():
+        return s3() * 2
+    
+    assert s4() == 6
+    assert s4._upstream == [s3]
+    s2(10)
+    assert s4() == 20
+    
+    raises(ValueError, react.auto, 3)
+    raises(ValueError, react.auto, s1)
+
+
 def test_errors():
     
     # Capture stderr
@@ -12,7 +12,7 @@
 import threading
 
 from .. import react
-from ..app import Model
+from ..app import Model, manager
 from ..pyscript import undefined, window
 
 def _check_two_scalars(name, v):
@@ -72,6 +72,17 @@ class Widget(Model):
         if kwargs.get('is_app', False):
             kwargs['container'] = 'body'
         
+        # The widget and its children are sent to JS as one command
+        session = kwargs.get('session', None) or manager.get_default_session()
+        kwargs['session'] = session
+        session._begin_construct()
+        try:
+            self._init_tree(**kwargs)
+        finally:
+            session._end_construct()
+    
+    def _init_tree(self, **kwargs):
+        
         # Init - pass signal values via kwargs
         Model.__init__(self, **kwargs)
         
@@ -84,10 +95,15 @@ class Widget(Model):
         with self:
             self.init()
         
-        # Signal dependencies may have been added during init(), also in JS
+        # Signal dependencies may have been added during init(), also in JS.
+        # When constructing a tree, JS connects once all widgets are created.
         self.connect_signals(False)
-        cmd = 'flexx.instances.%s.connect_signals(false);' % self._id
-        self._session._exec(cmd)
+        construct = self._session._construct
+        if construct is not None:
+            construct['connect'].append(self._id)
+        else:
+            cmd = 'flexx.instances.%s.connect_signals(false);' % self._id
+            self._session._exec(cmd)
     
     def _repr_html_(self):
         """ This is to get the widget shown inline in the notebook.
@@ -116,6 +132,8 @@ class Widget(Model):
         disconnect the signals of any child widgets.
         """
         children = self.children()
+        if children is undefined:
+            children = ()  # already disconnected, e.g. by Session.close()
         Model.disconnect_signals(self, *args)
         for child in children:
             child.disconnect_signals(*args)
@@ -53,6 +53,7 @@ class CanvasWidget(Widget):
             """
             return bool(v)
         
+        @react.syncmode('frame')
         @react.source
         def mouse_pos(self, pos=(0, 0)):
             """ The current position of the mouse inside this widget.
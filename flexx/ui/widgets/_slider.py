@@ -40,6 +40,7 @@ class Slider(Widget):
     
     CSS = ".flx-Slider {min-height: 30px;}"
     
+    @react.syncmode('frame')
     @react.input
     def value(v=0):
         """ The current slider value (settable)."""
@@ -70,6 +71,7 @@ class Slider(Widget):
             #if IE10:
             #   this.node.addEventListener('change', f, False)
             
+        @react.syncmode('frame')
         @react.source
         def user_value(self, v):
             """ The slider value set by the user (updates on user interaction). """
@@ -9,8 +9,11 @@ and Python 3.2+. Depends on png.py.
 
 from __future__ import print_function, division, absolute_import
 
+import os
 import sys
 import struct
+import hashlib
+from collections import OrderedDict
 
 from .png import read_png, write_png
 
@@ -20,10 +23,13 @@ if sys.version_info[0] >= 3:
 
 VALID_SIZES = 16, 32, 48, 64, 128, 256
 
-# Little endian int encoding (for bmp/icon writing)
-w1 = lambda x: struct.pack('<B', x)
-w2 = lambda x: struct.pack('<H', x)
-w4 = lambda x: struct.pack('<I', x)
+# Encoded images (png, bmp, ico, icns) are cached in memory, keyed by the
+# content hash of the icon. If CACHE_DIR is set, they are also stored there,
+# so that the (slow) encoding is also avoided in subsequent processes.
+CACHE_DIR = None
+CACHE_SIZE = 64  # max number of blobs to keep in memory
+
+_cache = OrderedDict()
 
 
 def intl(x):
@@ -50,6 +56,7 @@ class Icon(object):
     
     def __init__(self, *filenames):
         self._ims = {}
+        self._hash = None
         for filename in filenames:
             self.read(filename)
     
@@ -108,24 +115,19 @@ class Icon(object):
         if not isinstance(filename, basestring):
             raise TypeError('Icon.write() needs a file name')
         
+        ext = filename.lower()[-4:]
         if filename.lower().endswith('.ico'):
-            data = self._to_ico()
+            data = self._encode('ico')
             with open(filename, 'wb') as f:
                 f.write(data)
         elif filename.lower().endswith('.icns'):
-            data = self._to_icns()
+            data = self._encode('icns')
             with open(filename, 'wb') as f:
                 f.write(data)
-        elif filename.lower().endswith('.png'):
+        elif ext in ('.png', '.bmp'):
             for size in sorted(self._ims):
                 filename2 = '%s%i%s' % (filename[:-4], size, filename[-4:])
-                data = self._to_png(self._ims[size])
-                with open(filename2, 'wb') as f:
-                    f.write(data)
-        elif filename.lower().endswith('.bmp'):
-            for size in sorted(self._ims):
-                filename2 = '%s%i%s' % (filename[:-4], size, filename[-4:])
-                data = self._to_bmp(self._ims[size], file_header=True)
+                data = self._encode(ext[1:], size)
                 with open(filename2, 'wb') as f:
                     f.write(data)
         else:
@@ -137,7 +139,64 @@ class Icon(object):
         This function can be used by webservers to serve the ico image
         without needing a physical representation on disk.
         """
-        return self._to_ico()
+        return self._encode('ico')
+    
+    def content_hash(self):
+        """ Get a hash (hex string) that identifies the images in this icon.
+        """
+        if self._hash is None:
+            h = hashlib.sha1()
+            for size in sorted(self._ims):
+                h.update(struct.pack('<I', size))
+                h.update(bytes(self._ims[size]))
+            self._hash = h.hexdigest()
+        return self._hash
+    
+    def _encode(self, format, size=None):
+        """ Get the icon (or the image of the given size) encoded in the
+        given format (png, bmp, ico, icns), using the cache if possible.
+        """
+        key = '%s-%i.%s' % (self.content_hash(), size or 0, format)
+        # In memory? Then mark as most recently used
+        data = _cache.pop(key, None)
+        if data is not None:
+            _cache[key] = data
+            return data
+        # On disk?
+        filename = os.path.join(CACHE_DIR, key) if CACHE_DIR else None
+        if filename and os.path.isfile(filename):
+            try:
+                with open(filename, 'rb') as f:
+                    data = f.read()
+            except (OSError, IOError):  # pragma: no cover
+                data = None
+        # Encode
+        if data is None:
+            if format == 'png':
+                data = self._to_png(self._ims[size])
+            elif format == 'bmp':
+                data = self._to_bmp(self._ims[size], file_header=True)
+            elif format == 'ico':
+                data = self._to_ico()
+            elif format == 'icns':
+                data = self._to_icns()
+            else:
+                raise ValueError('Invalid icon format %r' % format)
+            if filename:
+                # Write to temp file and rename, so that concurrent
+                # processes never see a partial file.
+                tempname = '%s.%i.tmp' % (filename, os.getpid())
+                try:
+                    with open(tempname, 'wb') as f:
+                        f.write(data)
+                    os.rename(tempname, filename)
+                except (OSError, IOError):  # pragma: no cover
+                    pass  # e.g. read-only or already exists (on Windows)
+        # Store in memory
+        _cache[key] = data
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+        return data
     
     def _image_size(self, im):
         npixels = len(im) // 4
@@ -150,6 +209,7 @@ class Icon(object):
     
     def _store_image(self, im):
         self._ims[self._image_size(im)] = im
+        self._hash = None
     
     def _from_ico(self, bb):
         # Windows icon format.
@@ -177,40 +237,34 @@ class Icon(object):
     
     def _to_ico(self):
         
-        bb = b''
+        sizes = sorted(self._ims)
+        parts = []
         imdatas = []
         
         # Header
-        bb += w2(0)
-        bb += w2(1)  # 1:ICO, 2:CUR
-        bb += w2(len(self._ims))
+        parts.append(struct.pack('<HHH', 0, 1, len(sizes)))  # 1:ICO, 2:CUR
         
         # Put offset right after the last directory entry
-        offset = len(bb) + 16 * len(self._ims)
+        offset = 6 + 16 * len(sizes)
         
         # Directory (header for each image)
-        for size in sorted(self._ims):
-            im = self._ims[size]
+        for size in sizes:
             if size >= 64:
-                imdata = self._to_png(im)
+                imdata = self._encode('png', size)
             else:
-                imdata = self._to_bmp(im)
+                imdata = self._to_bmp(self._ims[size])
             imdatas.append(imdata)
             # Prepare dimensions
             w = h = 0 if size == 256 else size
-            # Write directory entry
-            bb += w1(w)
-            bb += w1(h)
-            bb += w1(0)  # number of colors in palette, assume no palette (0)
-            bb += w1(0)  # reserved (must be 0)
-            bb += w2(0)  # color planes
-            bb += w2(32)  # bits per pixel
-            bb += w4(len(imdata))  # size of image data
-            bb += w4(offset)
+            # Write directory entry: width, height, number of colors in
+            # palette (0 for no palette), reserved, color planes, bits
+            # per pixel, size of image data, offset
+            parts.append(struct.pack('<BBBBHHII', w, h, 0, 0, 0, 32,
+                                     len(imdata), offset))
             # Set offset pointer
             offset += len(imdata)
         
-        return b''.join([bb] + imdatas)
+        return b''.join(parts + imdatas)
     
     def _to_icns(self):
         # OSX icon format. 
@@ -338,36 +392,29 @@ class Icon(object):
         im2[1::4] = im[1::4]
         im2[2::4] = im[0::4]
         im2[3::4] = im[3::4]
-        im = im2
         
         # Flip vertically
-        lines = [im[width*4*i:width*4*(i+1)] for i in range(height)]
-        im = bytearray().join(reversed(lines))
-        
-        # DIB header
-        bb = b''
-        bb += w4(40)  # header size
-        bb += w4(width)
-        bb += w4(reported_height)
-        bb += w2(1)  # 1 color plane
-        bb += w2(32)
-        bb += w4(0)  # no compression
-        bb += w4(len(im))
-        bb += w4(2835) + w4(2835)  # 2835 pixels/meter, ~ 72 dpi
-        bb += w4(0)  # number of colors in palette
-        bb += w4(0)  # number of important colors (0->all)
-        
-        # File header (not when bm is in-memory)
+        im = bytearray(len(im2))
+        stride = width * 4
+        for i in range(height):
+            j = height - 1 - i
+            im[j*stride:(j+1)*stride] = im2[i*stride:(i+1)*stride]
+        
+        # DIB header: header size, width, height, 1 color plane, bpp,
+        # no compression, data size, 2835 pixels/meter (~ 72 dpi),
+        # number of colors in palette, number of important colors (0->all)
+        bb = struct.pack('<IIIHHIIIIII', 40, width, reported_height, 1, 32,
+                         0, len(im), 2835, 2835, 0, 0)
+        
+        # File header (not when bm is in-memory): file size, reserved,
+        # pixel data offset
         header = b''
         if file_header:
-            header += b'BM'
-            header += w4(14 + 40 + len(im))  # file size
-            header += b'\x00\x00\x00\x00'
-            header += w4(14 + 40)  # pixel data offset
+            header = b'BM' + struct.pack('<III', 14 + 40 + len(im), 0, 14 + 40)
         
         # Add pixels
         # No padding, because we assume power of 2 image sizes
-        return header + bb + bytes(im)
+        return b''.join([header, bb, bytes(im)])
     
     def _from_png(self, data):
         im, shape = read_png(data)
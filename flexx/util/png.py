@@ -6,14 +6,28 @@
 Pure python module to handle for reading and writing png files. Written
 for Python 2.7 and Python 3.2+. Can only read PNG's that are not
 interlaced, have a bit depth of 8, and are either RGB or RGBA.
+
+If numpy is available, it is used to unfilter the scanlines and to
+compose the data to write, which is much faster for large images.
 """
 
 from __future__ import print_function, division, absolute_import
 
 import io
+import sys
+import mmap
 import struct
 import zlib
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Lines with the Average or Paeth filter are unfiltered with numpy if
+# there are at least this many together, and line by line otherwise
+WAVEFRONT_MIN_LINES = 8
+
 
 def write_png(im, shape=None, file=None):
     """ Write a png image.
@@ -84,9 +98,17 @@ def write_png(im, shape=None, file=None):
     
     # Chunk with pixels. Just one chunk, no fancy filters.
     line_len = w * shape[2]
-    lines = [im[i*line_len:(i+1)*line_len] for i in range(h)]
-    lines = [b'\x00' + bytes(line) for line in lines]  # prepend filter byt
-    pixels_compressed = zlib.compress(b''.join(lines), 9)
+    if np is not None:
+        lines = np.zeros((h, line_len + 1), np.uint8)  # filter byte is zero
+        lines[:, 1:] = np.frombuffer(im, np.uint8).reshape(h, line_len)
+        lines = lines.tobytes()
+    else:
+        lines = bytearray(h * (line_len + 1))
+        for i in range(h):
+            j = i * (line_len + 1) + 1
+            lines[j:j+line_len] = im[i*line_len:(i+1)*line_len]
+        lines = bytes(lines)
+    pixels_compressed = zlib.compress(lines, 9)
     add_chunk(pixels_compressed, 'IDAT')
     
     # Closing chunk
@@ -100,13 +122,17 @@ def read_png(f, return_ndarray=False):
     """ Read a png image.
     
     Parameters:
-        f (file-object, bytes): the source to read the png data from.
+        f (file-object, bytes): the source to read the png data from. Can
+            also be a bytearray, memoryview or memory-mapped file.
         return_ndarray (bool): if True, returns the result as a numpy array.
     
     If return_ndarray is False, returns (pixel_array, shape), with shape
     being NxMx3 or NxMx4, for RGB and RGBA, respectively. The
     pixel_array is a bytearray object.
     
+    The data is read chunk by chunk, and decompressed and unfiltered
+    incrementally, so that the file does not have to be loaded at once.
+    
     This is a simple implementation; can only read PNG's that are not
     interlaced, have a bit depth of 8, and are either RGB or RGBA.
     """
@@ -116,35 +142,22 @@ def read_png(f, return_ndarray=False):
     asint_map = {1: '>B', 2: '>H', 4: '>I'}
     asint = lambda x: struct.unpack(asint_map[len(x)], x)[0]
     
-    # Get bytes
-    if isinstance(f, (bytes, bytearray)):
-        bb = f
-    elif hasattr(f, 'read'):
-        bb = f.read()
-    else:
-        raise TypeError('read_png() needs file object or bytes, not %r' % f)
-    
-    # Read header
-    if not (bb[0:1] == b'\x89' and bb[1:4] == b'PNG'):
-        raise RuntimeError('Image data does not appear to have a PNG '
-                           'header: %r' % bb[:10])
-    chunk_pointer = 8
+    chunks = _iter_chunks(f)
     
     # Read first chunk
-    chunk1 = bb[chunk_pointer:]
-    chunk_length = asint(chunk1[0:4])
-    chunk_pointer += 12 + chunk_length  # size, type, crc, data
-    if not (chunk1[4:8] == b'IHDR' and chunk_length == 13):  # noqa
+    chunk_type, chunk1 = next(chunks, (None, b''))
+    if not (chunk_type == b'IHDR' and len(chunk1) == 13):  # noqa
         raise RuntimeError('Unable to read PNG data, maybe its corrupt?')
+    chunk1 = _tobytes(chunk1)
     
     # Extract info
-    width = asint(chunk1[8:12])
-    height = asint(chunk1[12:16])
-    bit_depth = asint(chunk1[16:17])
-    color_type = asint(chunk1[17:18])
-    compression_method = asint(chunk1[18:19])
-    filter_method = asint(chunk1[19:20])
-    interlace_method = asint(chunk1[20:21])
+    width = asint(chunk1[0:4])
+    height = asint(chunk1[4:8])
+    bit_depth = asint(chunk1[8:9])
+    color_type = asint(chunk1[9:10])
+    compression_method = asint(chunk1[10:11])
+    filter_method = asint(chunk1[11:12])
+    interlace_method = asint(chunk1[12:13])
     bytes_per_pixel = 3 + (color_type == 6)
     
     # Check if we can do this ....
@@ -160,46 +173,195 @@ def read_png(f, return_ndarray=False):
         # this should be the case for any PNG
         raise RuntimeError('Expected PNG compression param to be 0.')
     
-    # If this is the case ... extract pixel info
-    lines, prev = [], None
-    while True:
-        chunk = bb[chunk_pointer:]
-        if not chunk:
-            break
-        chunk_length = asint(chunk[0:4])
-        chunk_pointer += 12 + chunk_length
-        if chunk[4:8] == b'IEND':
-            break
-        elif chunk[4:8] == b'IDAT':  # Pixel data
-            # Decompress and unfilter
-            pixels_compressed = chunk[8:8+chunk_length]
-            pixels_raw = zlib.decompress(pixels_compressed)
-            s = width * bytes_per_pixel + 1  # stride
-            #print(pixels_raw[0::s])  # show filters in use
-            for i in range(height):
-                prev = _png_scanline(pixels_raw[i*s:i*s+s], prev=prev)
-                lines.append(prev)
-            
-    # Combine scanlines from all chunks
-    im = bytearray(sum([len(line) for line in lines]))
-    i = 0
+    # If this is the case ... extract pixel info, and unfilter the
+    # scanlines into the result.
     line_len = width * bytes_per_pixel
-    for line in lines:
-        if not len(line) == line_len:  # noqa
-            raise RuntimeError('Line length mismatch while reading png.')
-        im[i:i+line_len] = line
-        i += line_len
+    lines = _iter_lines(chunks, height, line_len + 1)
+    im = bytearray(height * line_len)
+    if np is not None:
+        raw = bytearray(height * (line_len + 1))  # filter byte + line
+        for i, line in enumerate(lines):
+            raw[i*(line_len+1):(i+1)*(line_len+1)] = line
+        _unfilter_numpy(raw, im, width, height, bytes_per_pixel)
+    else:
+        prev = bytearray(line_len)  # the line above the first line is zeros
+        for i, line in enumerate(lines):
+            prev = _png_scanline(line, bytes_per_pixel, prev)
+            im[i*line_len:(i+1)*line_len] = prev
     
     shape = width, height, bytes_per_pixel
     
     # Done
     if return_ndarray:
-        import numpy as np
-        return np.frombuffer(im, 'uint8').reshape(shape)
+        import numpy  # fails if numpy is not available
+        return numpy.frombuffer(im, 'uint8').reshape(shape)
     else:
         return im, shape
 
 
+def _tobytes(data):
+    return data.tobytes() if isinstance(data, memoryview) else data
+
+
+def _iter_chunks(f):
+    """ Check the PNG signature and generate (type, data) for each chunk.
+    File objects are read chunk by chunk. Bytes-like objects (including
+    memory-mapped files) are sliced via a memoryview, without copying.
+    """
+    if isinstance(f, (bytes, bytearray, memoryview, mmap.mmap)):
+        if sys.version_info[0] >= 3:
+            f = memoryview(f)
+        pos = [0]
+        
+        def read(n):
+            data = f[pos[0]:pos[0]+n]
+            pos[0] += len(data)
+            return data
+    
+    elif hasattr(f, 'read'):
+        read = f.read
+    else:
+        raise TypeError('read_png() needs file object or bytes, not %r' % f)
+    
+    # Read header
+    header = _tobytes(read(8))
+    if not (header[0:1] == b'\x89' and header[1:4] == b'PNG'):
+        raise RuntimeError('Image data does not appear to have a PNG '
+                           'header: %r' % header)
+    
+    # Read chunks: size, type, data, crc
+    while True:
+        head = _tobytes(read(8))
+        if len(head) < 8:
+            break
+        chunk_length = struct.unpack('>I', head[:4])[0]
+        data = read(chunk_length)
+        read(4)  # crc
+        yield head[4:8], data
+
+
+def _iter_lines(chunks, height, stride):
+    """ Generate the (filtered) scanlines, including the filter byte.
+    """
+    buf = bytearray()
+    count = 0
+    for pixels_raw in _iter_decompressed(chunks, max(stride * 16, 2**16)):
+        buf += pixels_raw
+        n = len(buf) // stride
+        if count + n > height:
+            raise RuntimeError('Too much pixel data while reading png.')
+        for i in range(n):
+            yield buf[i*stride:(i+1)*stride]
+        del buf[:n*stride]
+        count += n
+    if count != height or buf:
+        raise RuntimeError('Line length mismatch while reading png.')
+
+
+def _iter_decompressed(chunks, max_length):
+    """ Generate the decompressed data of the IDAT chunks, which together
+    form a single zlib stream, in pieces of at most max_length bytes.
+    """
+    decompressor = zlib.decompressobj()
+    for chunk_type, data in chunks:
+        if chunk_type == b'IEND':
+            break
+        elif chunk_type == b'IDAT':  # Pixel data
+            while data:
+                yield decompressor.decompress(data, max_length)
+                data = decompressor.unconsumed_tail
+    yield decompressor.flush()
+
+
+def _unfilter_numpy(raw, im, width, height, fu):
+    """ Unfilter all scanlines in raw (a filter byte followed by the data
+    of each line) into im, using numpy.
+    """
+    lines = np.frombuffer(raw, np.uint8).reshape(height, width * fu + 1)
+    x = lines[:, 1:]
+    out = np.frombuffer(im, np.uint8).reshape(height, width * fu)
+    filters = lines[:, 0].tolist()
+    if max(filters) > 4:
+        raise RuntimeError('Invalid filter %r' % max(filters))
+    zeros = np.zeros(width * fu, np.uint8)
+    
+    y = 0
+    while y < height:
+        filter = filters[y]
+        prev = out[y - 1] if y else zeros
+        n = 1  # number of lines to process at once
+        if filter in (3, 4):
+            # Average and paeth depend on the pixel to the left. Select
+            # lines up to the last of these, allowing short runs of
+            # other filters in between.
+            end = 1
+            while y + n < height and n - end < WAVEFRONT_MIN_LINES:
+                n += 1
+                if filters[y + n - 1] in (3, 4):
+                    end = n
+            n = end
+            if n >= WAVEFRONT_MIN_LINES:
+                _unfilter_wavefront(x[y:y+n], filters[y:y+n], prev, out[y:y+n], fu)
+            else:
+                prev = bytearray(prev.tobytes())
+                for i in range(y, y + n):
+                    prev = _png_scanline(lines[i].tobytes(), fu, prev)
+                    out[i] = np.frombuffer(prev, np.uint8)
+        elif filter == 0:
+            out[y] = x[y]
+        elif filter == 1:
+            # sub: a cumulative sum per channel
+            np.cumsum(x[y].reshape(width, fu), 0, dtype=np.uint8,
+                      out=out[y].reshape(width, fu))
+        elif filter == 2:
+            # up: a cumulative sum over successive lines
+            while y + n < height and filters[y + n] == 2:
+                n += 1
+            np.cumsum(x[y:y+n], 0, dtype=np.uint8, out=out[y:y+n])
+            out[y:y+n] += prev
+        y += n
+
+
+def _unfilter_wavefront(x, filters, prev, out, fu):
+    """ Unfilter lines that use any filter. A pixel depends on the pixels
+    to its left, above and above-left, so all pixels on an anti-diagonal
+    can be computed at once. The lines are stored skewed (line i shifted
+    i pixels to the right) and transposed, so that each anti-diagonal is
+    contiguous in memory.
+    """
+    n, m = x.shape[0], x.shape[1] // fu
+    # Skewed result, with prev as line 0 and a zero pixel at the left of
+    # each line: pixel j of line i is at s[i + j + 1, i].
+    s = np.zeros((n + m + 1, n + 1, fu), np.uint8)
+    s[1:m+1, 0] = prev.reshape(m, fu)
+    xs = np.zeros((n + m + 1, n + 1, fu), np.uint8)  # data, skewed the same
+    for i in range(1, n + 1):
+        xs[i + 1:i + m + 1, i] = x[i - 1].reshape(m, fu)
+    # Per filter that is used, a mask to select the lines that use it
+    filters = np.array([0] + list(filters)).reshape(n + 1, 1)
+    masks = dict([(f, (filters == f).astype(np.int16)) for f in set(filters.flat)])
+    for k in range(2, n + m + 1):
+        i0, i1 = max(1, k - m), min(n, k - 1) + 1  # lines on this diagonal
+        a = s[k - 1, i0:i1].astype(np.int16)
+        b = s[k - 1, i0 - 1:i1 - 1].astype(np.int16)
+        c = s[k - 2, i0 - 1:i1 - 1].astype(np.int16)
+        pred = np.zeros_like(a)
+        for f, mask in masks.items():
+            if f == 1:
+                pred += mask[i0:i1] * a
+            elif f == 2:
+                pred += mask[i0:i1] * b
+            elif f == 3:
+                pred += mask[i0:i1] * ((a + b) >> 1)
+            elif f == 4:
+                pa, pb, pc = np.abs(b - c), np.abs(a - c), np.abs(a + b - 2 * c)
+                paeth = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+                pred += mask[i0:i1] * paeth
+        s[k, i0:i1] = xs[k, i0:i1] + pred  # wraps around like uint8
+    for i in range(1, n + 1):
+        out[i - 1] = s[i + 1:i + m + 1, i].reshape(m * fu)
+
+
 def _png_scanline(line_bytes, fu=4, prev=None):
     """ Scanline unfiltering, taken from png.py
     """
@@ -12,6 +12,7 @@ from flexx.util.testing import run_tests_if_main, raises, skip
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 from util.png import write_png
 from util.icon import Icon
+from util import icon as icon_module
 
 tempdir = tempfile.gettempdir()
 
@@ -129,4 +130,67 @@ def test_export():
             icon.write(os.path.join(tempdir, name + '.foo'))
 
 
+def test_caching():
+    
+    icon = Icon()
+    icon.add(bytearray(b'\x77' * 16*16*4))
+    icon.add(bytearray(b'\x33' * 64*64*4))
+    hash1 = icon.content_hash()
+    assert len(hash1) == 40
+    
+    # Encoded blobs are reused, also by another icon with the same images
+    bb1 = icon.to_bytes()
+    assert icon.to_bytes() is bb1
+    icon2 = Icon()
+    icon2.add(bytearray(b'\x77' * 16*16*4))
+    icon2.add(bytearray(b'\x33' * 64*64*4))
+    assert icon2.content_hash() == hash1
+    assert icon2.to_bytes() is bb1
+    
+    # Adding an image invalidates
+    icon.add(bytearray(b'\x55' * 32*32*4))
+    assert icon.content_hash() != hash1
+    bb2 = icon.to_bytes()
+    assert bb2 != bb1
+    icon3 = Icon()
+    icon3._from_ico(bb2)
+    assert icon3.image_sizes() == (16, 32, 64)
+    assert icon3.content_hash() == icon.content_hash()
+    
+    # The memory cache is bounded, the least recently used blob is evicted
+    assert len(icon_module._cache) <= icon_module.CACHE_SIZE
+    cache_size = icon_module.CACHE_SIZE
+    icon_module.CACHE_SIZE = 2
+    try:
+        icon_module._cache.clear()
+        bmp1 = icon2._encode('bmp', 16)
+        bmp2 = icon._encode('bmp', 16)
+        assert icon2._encode('bmp', 16) is bmp1
+        icon._encode('bmp', 32)
+        assert list(icon_module._cache) == [hash1 + '-16.bmp',
+                                            icon.content_hash() + '-32.bmp']
+        assert icon2._encode('bmp', 16) is bmp1
+        assert icon._encode('bmp', 16) is not bmp2
+    finally:
+        icon_module.CACHE_SIZE = cache_size
+    
+    # Blobs are also stored on disk, if a cache dir is set
+    cache_dir = tempfile.mkdtemp()
+    icon_module.CACHE_DIR = cache_dir
+    try:
+        icon.add(bytearray(b'\x11' * 48*48*4))
+        bb3 = icon.to_bytes()
+        assert len(os.listdir(cache_dir)) == 2  # the ico and the 64 png
+        # Blobs are read from disk when not in memory
+        icon_module._cache.clear()
+        filename = os.path.join(cache_dir, icon.content_hash() + '-0.ico')
+        with open(filename, 'wb') as f:
+            f.write(b'from disk')
+        assert icon.to_bytes() == b'from disk'
+        assert bb3 != b'from disk'
+    finally:
+        icon_module.CACHE_DIR = None
+        icon_module._cache.clear()
+
+
 run_tests_if_main()
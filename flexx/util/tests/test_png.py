@@ -3,13 +3,19 @@ Test png module
 """
 
 import os
+import io
 import sys
+import mmap
+import zlib
+import struct
+import random
 import tempfile
 from flexx.util.testing import run_tests_if_main, raises, skip
 
 #from flexx.util.png import read_png, write_png
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 from util.png import read_png, write_png
+from util import png as png_module
 
 
 try:
@@ -196,4 +202,148 @@ def test_with_numpy():
         assert (im_check[:,:,i] == im).all()
 
 
+def filter_line(filter, line, prev, fu):
+    """ Apply a PNG filter to a line, like an encoder does.
+    """
+    out = bytearray(len(line))
+    for i in range(len(line)):
+        a = line[i - fu] if i >= fu else 0
+        b = prev[i]
+        c = prev[i - fu] if i >= fu else 0
+        if filter == 0:
+            pred = 0
+        elif filter == 1:
+            pred = a
+        elif filter == 2:
+            pred = b
+        elif filter == 3:
+            pred = (a + b) >> 1
+        else:
+            p = a + b - c
+            pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+            pred = a if (pa <= pb and pa <= pc) else (b if pb <= pc else c)
+        out[i] = (line[i] - pred) & 0xff
+    return out
+
+
+def write_filtered_png(im, shape, filters, nchunks=1):
+    """ Write a png with the given filter for each line, and the pixel
+    data divided over multiple IDAT chunks.
+    """
+    w, h, fu = shape
+    line_len = w * fu
+    prev = bytearray(line_len)
+    raw = bytearray()
+    for i in range(h):
+        line = im[i*line_len:(i+1)*line_len]
+        raw += bytearray([filters[i]]) + filter_line(filters[i], line, prev, fu)
+        prev = line
+    data = zlib.compress(bytes(raw))
+    blob = write_png(im, shape)
+    head, tail = blob[:33], blob[-12:]  # signature + IHDR, IEND
+    size = len(data) // nchunks + 1
+    chunks = []
+    for i in range(0, len(data), size):
+        part = data[i:i+size]
+        crc = zlib.crc32(part, zlib.crc32(b'IDAT')) & 0xffffffff
+        chunks.append(struct.pack('>I', len(part)) + b'IDAT' + part +
+                      struct.pack('>I', crc))
+    return head + b''.join(chunks) + tail
+
+
+def test_reading_filters():
+    
+    random.seed(0)
+    for fu in (3, 4):
+        shape = 20, 40, fu
+        # Smooth-ish image with some noise, like a typical image
+        im = bytearray([(i // 7 + random.randint(0, 3)) & 0xff
+                        for i in range(20 * 40 * fu)])
+        filter_sets = [[0] * 40, [1] * 40, [2] * 40, [3] * 40, [4] * 40,
+                       [random.choice([0, 1, 2, 3, 4]) for i in range(40)],
+                       [2, 2, 1] + [3] * 10 + [4] * 10 + [0, 2] + [4] * 15]
+        for filters in filter_sets:
+            blob = write_filtered_png(im, shape, filters, nchunks=3)
+            
+            # Pure Python
+            np_ref = png_module.np
+            png_module.np = None
+            try:
+                im2, shape2 = read_png(blob)
+            finally:
+                png_module.np = np_ref
+            assert shape2 == shape
+            assert im2 == im
+            
+            # With numpy (if available)
+            im2, shape2 = read_png(blob)
+            assert shape2 == shape
+            assert im2 == im
+    
+    # Invalid filter
+    blob = write_filtered_png(im, shape, [2] * 39 + [5])
+    with raises(RuntimeError):
+        read_png(blob)
+
+
+class RecordingFile(io.BytesIO):
+    
+    def __init__(self, *args):
+        io.BytesIO.__init__(self, *args)
+        self.reads = []
+    
+    def read(self, n=-1):
+        self.reads.append(n)
+        return io.BytesIO.read(self, n)
+
+
+def test_reading_streaming():
+    
+    random.seed(1)
+    shape = 30, 20, 4
+    im = bytearray([random.randint(0, 20) for i in range(30 * 20 * 4)])
+    filters = [random.choice([0, 1, 2, 3, 4]) for i in range(20)]
+    # Many chunks, with lines spanning chunk boundaries
+    blob = write_filtered_png(im, shape, filters, nchunks=50)
+    assert blob.count(b'IDAT') > 40
+    
+    # From a file object, read chunk by chunk
+    f = RecordingFile(blob)
+    assert read_png(f) == (im, shape)
+    assert -1 not in f.reads and None not in f.reads
+    assert max(f.reads) < len(blob) // 10
+    
+    # From memoryview and bytearray
+    assert read_png(memoryview(blob)) == (im, shape)
+    assert read_png(bytearray(blob)) == (im, shape)
+    
+    # From a memory mapped file, which can be closed afterwards
+    filename = os.path.join(tempdir, 'test_streaming.png')
+    with open(filename, 'wb') as f:
+        f.write(blob)
+    with open(filename, 'rb') as f:
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        assert read_png(m) == (im, shape)
+        m.close()
+    
+    # Truncated data
+    with raises(RuntimeError):
+        read_png(blob[:len(blob) // 2])
+    # Too much data
+    blob2 = write_filtered_png(im + im[:120], (30, 21, 4), filters + [0])
+    blob2 = blob2[:16] + blob[16:33] + blob2[33:]  # IHDR of the smaller image
+    with raises(RuntimeError):
+        read_png(blob2)
+
+
+def test_writing_without_numpy():
+    np_ref = png_module.np
+    png_module.np = None
+    try:
+        blobs = [write_png(im, shape) for im, shape in zip(ims, shapes)]
+    finally:
+        png_module.np = np_ref
+    assert blobs == [write_png(im, shape) for im, shape in zip(ims, shapes)]
+
+
 run_tests_if_main()
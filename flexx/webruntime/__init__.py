@@ -42,7 +42,7 @@ from .nodewebkit import NodeWebkitRuntime
 from .browser import BrowserRuntime
 from .qtwebkit import PyQtRuntime
 from .chromeapp import ChromeAppRuntime
-from .nodejs import NodejsRuntime
+from .nodejs import NodejsRuntime, NodejsPool  # noqa
 from .selenium import SeleniumRuntime
 
 # todo: make a 'desktop' runtime option that will try xul, nwjs, chromeapp, trident
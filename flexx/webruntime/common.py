@@ -4,14 +4,17 @@ Common code for all runtimes.
 
 import os
 import sys
+import json
 import time
 import atexit
+import hashlib
 import shutil
 import logging
 import threading
 import subprocess
 
 
+from ..util import icon as icon_module
 from ..util.icon import Icon
 
 
@@ -44,12 +47,17 @@ class BaseRuntime:
             if self._proc.stdin:  # pragma: no cover
                 self._proc.stdin.close()
             self._proc.terminate()
-            timeout = time.time() + 0.25
-            while time.time() < timeout:
-                time.sleep(0.02)
-                if self._proc.poll() is not None:
-                    break
-            else:  # pragma: no cover
+            try:
+                self._proc.wait(0.25)
+            except TypeError:  # pragma: no cover - legacy Python has no timeout
+                timeout = time.time() + 0.25
+                while time.time() < timeout:
+                    time.sleep(0.02)
+                    if self._proc.poll() is not None:
+                        break
+                else:
+                    self._proc.kill()
+            except subprocess.TimeoutExpired:  # pragma: no cover
                 self._proc.kill()
         # Discart process
         self._proc = None
@@ -149,6 +157,69 @@ class StreamReader(threading.Thread):
                           (code, '\n'.join(msgs)))
 
 
+# The app dirs (temporary and template) are tracked in an index file,
+# so we need not scan (and stat) all directories on each launch. The
+# index is occasionally checked against the directory, to catch dirs
+# that got lost, e.g. when two processes updated the index at once.
+APP_INDEX = 'index.json'
+APP_INDEX_RESCAN = 24 * 3600  # seconds
+MAX_APP_TEMPLATES = 16
+
+
+def _read_app_index(maindir):
+    """ Get the index (dict name -> timestamp) of the given dir.
+    """
+    try:
+        with open(os.path.join(maindir, APP_INDEX), 'rb') as f:
+            index = json.loads(f.read().decode())
+        if time.time() - index['scanned'] < APP_INDEX_RESCAN:
+            return index
+        dirs = index['dirs']
+    except Exception:
+        dirs = {}
+    # (Re)build the index from the directory
+    for dname in os.listdir(maindir):
+        dirname = os.path.join(maindir, dname)
+        if dname not in dirs and os.path.isdir(dirname):
+            dirs[dname] = os.path.getmtime(dirname)
+    return dict(dirs=dirs, scanned=time.time())
+
+
+def _write_app_index(maindir, index):
+    """ Write the index of the given dir (via a temp file).
+    """
+    filename = os.path.join(maindir, APP_INDEX)
+    tempname = '%s.%i.tmp' % (filename, os.getpid())
+    try:
+        with open(tempname, 'wb') as f:
+            f.write(json.dumps(index).encode())
+        if sys.platform.startswith('win') and os.path.isfile(filename):
+            os.remove(filename)  # pragma: no cover - rename won't overwrite
+        os.rename(tempname, filename)
+    except (OSError, IOError):  # pragma: no cover
+        pass
+
+
+def _remove_app_dirs(maindir, index, names):
+    """ Remove the given dirs, and drop them from the index.
+    """
+    for dname in names:
+        dirname = os.path.join(maindir, dname)
+        try:
+            if os.path.isdir(dirname):
+                shutil.rmtree(dirname)
+        except (OSError, IOError):  # pragma: no cover
+            continue  # e.g. in use on Windows, try again later
+        index['dirs'].pop(dname, None)
+
+
+def _get_app_maindir(name):
+    maindir = os.path.join(appdata_dir('flexx'), name)
+    if not os.path.isdir(maindir):  # pragma: no cover
+        os.mkdir(maindir)
+    return maindir
+
+
 def create_temp_app_dir(prefix, suffix='', cleanup=60):
     """ Create a temporary direrctory and return path
 
@@ -158,32 +229,66 @@ def create_temp_app_dir(prefix, suffix='', cleanup=60):
     """
 
     # Select main dir
-    maindir = os.path.join(appdata_dir('flexx'), 'temp_apps')
-    if not os.path.isdir(maindir):  # pragma: no cover
-        os.mkdir(maindir)
+    maindir = _get_app_maindir('temp_apps')
 
     prefix = prefix.strip(' _-') + '_'
     suffix = '' if not suffix else '_' + suffix.strip(' _-')
 
-    # Clear any old files
-    for dname in os.listdir(maindir):
-        if dname.startswith(prefix):
-            dirname = os.path.join(maindir, dname)
-            if os.path.isdir(dirname):
-                try:
-                    dirtime = int(dname.split('_')[1])
-                except Exception:  # pragma: no cover
-                    pass
-                if (time.time() - dirtime) > cleanup:  # pragma: no cover
-                    try:
-                        shutil.rmtree(dirname)
-                    except (OSError, IOError):
-                        pass
+    # Clear any old dirs
+    index = _read_app_index(maindir)
+    old = [dname for dname, dirtime in index['dirs'].items()
+           if dname.startswith(prefix) and (time.time() - dirtime) > cleanup]
+    _remove_app_dirs(maindir, index, old)
 
     # Return new dir
     id = '%i_%i' % (time.time(), os.getpid())
     path = os.path.join(maindir, prefix + id + suffix)
     os.mkdir(path)
+    index['dirs'][os.path.basename(path)] = time.time()
+    _write_app_index(maindir, index)
+    return path
+
+
+def get_app_template_dir(prefix, key, create):
+    """ Get the path of a directory with the files of a runtime app
+    that do not change between launches (e.g. icons and links to the
+    runtime executable), so that these need not be created for each
+    launch.
+
+    The directory is identified by the prefix and a hash of the key (a
+    string) and the flexx version. If it does not exist yet, create() is
+    called with the path of a new directory to populate. Templates that
+    have not been used recently are cleaned up.
+    """
+    from .. import __version__
+
+    maindir = _get_app_maindir('app_templates')
+    prefix = prefix.strip(' _-') + '_'
+    h = hashlib.sha1(('%s\n%s\n%s' % (prefix, __version__, key)).encode('utf-8'))
+    dname = prefix + h.hexdigest()[:16]
+    path = os.path.join(maindir, dname)
+
+    # Create in a temp dir first, so that a template is always complete
+    if not os.path.isdir(path):
+        tempdir = '%s_%i.tmp' % (path, os.getpid())
+        if os.path.isdir(tempdir):  # pragma: no cover
+            shutil.rmtree(tempdir)
+        os.mkdir(tempdir)
+        try:
+            create(tempdir)
+            os.rename(tempdir, path)
+        except Exception:
+            shutil.rmtree(tempdir, ignore_errors=True)
+            if not os.path.isdir(path):  # another process may have won
+                raise
+
+    # Mark as used, and remove the least recently used templates
+    index = _read_app_index(maindir)
+    dirs = index['dirs']
+    dirs[dname] = time.time()
+    old = sorted(dirs, key=lambda d: dirs[d])[:-MAX_APP_TEMPLATES]
+    _remove_app_dirs(maindir, index, old)
+    _write_app_index(maindir, index)
     return path
 
 
@@ -272,16 +377,54 @@ def default_icon():
     return icon
 
 
+# Icons that were read before, so that repeated launches need not decode
+# them again. Files are keyed by path, modification time and size.
+_icon_cache = {}
+
+
+def _copy_icon(icon):
+    # The images are not modified in-place, so a shallow copy suffices
+    # to protect the cached icon from changes made by the caller.
+    new_icon = Icon()
+    new_icon._ims = dict(icon._ims)
+    new_icon._hash = icon._hash
+    return new_icon
+
+
+def _enable_icon_disk_cache():
+    # Let the icon module store encoded icons in the appdata dir
+    if icon_module.CACHE_DIR is None:
+        cache_dir = os.path.join(appdata_dir('flexx'), 'icon_cache')
+        try:
+            if not os.path.isdir(cache_dir):
+                os.mkdir(cache_dir)
+        except (OSError, IOError):  # pragma: no cover
+            return
+        icon_module.CACHE_DIR = cache_dir
+
+
 def iconize(icon):
     """ Given a filename Icon object or None, return Icon object.
     """
     if icon is None:
-        icon = default_icon()
+        key = None
     elif isinstance(icon, Icon):
-        pass
+        _enable_icon_disk_cache()
+        return icon
     elif isinstance(icon, str):
-        icon = Icon(icon)
+        if icon.startswith('http'):
+            key = icon
+        else:
+            try:
+                st = os.stat(icon)
+            except OSError:
+                return Icon(icon)  # let Icon produce the error
+            key = os.path.abspath(icon), st.st_mtime, st.st_size
     else:
         raise ValueError('Icon must be an Icon, a filename or None, not %r' %
                          type(icon))
-    return icon
+
+    _enable_icon_disk_cache()
+    if key not in _icon_cache:
+        _icon_cache[key] = default_icon() if key is None else Icon(icon)
+    return _copy_icon(_icon_cache[key])
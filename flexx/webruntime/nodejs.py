@@ -8,11 +8,20 @@ provided to nodejs as the ``location`` variable as it is in a browser.
 
 When hooking this up with the flexx app systen, nodejs and Python can
 communicate via the websocket.
+
+Starting nodejs takes a while. For repeated launches (e.g. compute
+workers or tests), a ``NodejsPool`` can keep nodejs processes ready, in
+which the code is run in a fresh context for each launch.
 """
 
 import os
 import sys
 import json
+import queue
+import atexit
+import logging
+import weakref
+import threading
 import subprocess
 import tempfile
 from urllib.parse import urlparse
@@ -41,6 +50,21 @@ def get_node_exe():
 
 
 
+def _fix_node_path():
+    """ Set the NODE_PATH env var if needed, so that global modules are found.
+    """
+    # Fix for Windows - by default global modules are searched in wrong place
+    NODE_PATH = b'NODE_PATH' if sys.version_info[0] == 2 else 'NODE_PATH'
+    if sys.platform.startswith('win') and os.getenv(NODE_PATH) is None:
+        os.environ[NODE_PATH] = os.getenv('APPDATA') + '\\npm\\node_modules'
+    elif sys.platform.startswith('linux') and not os.getenv(NODE_PATH):
+        path = os.path.expanduser('/usr/local/lib/node_modules')
+        if os.path.isdir(path):
+            os.environ[NODE_PATH] = path
+    if sys.version_info[0] == 2 and os.getenv(NODE_PATH):  # str lits are uni
+        os.environ[NODE_PATH] = os.environ[NODE_PATH].encode()
+
+
 def get_js_from_url(url):
     """ Given an url, extract the JavaScript. This abviously does not
     work when this process/thread is the actually serving that url.
@@ -113,8 +137,23 @@ class NodejsRuntime(BaseRuntime):
     
     Arguments:
       code (str): The code to run.
+      pool (bool | NodejsPool): If given, run the code in a process
+        from the given pool (or the default pool if True). The process
+        is returned to the pool when the runtime is closed, or when the
+        code calls ``process.exit()``.
     """
     
+    _pool_process = None
+    
+    def close(self):
+        if self._pool_process is not None:
+            with self._pool_lock:  # can be called from the process' thread
+                process, self._pool_process = self._pool_process, None
+            if process is not None:
+                process.on_exit = None
+                self._pool.release(process)
+        BaseRuntime.close(self)
+    
     def _launch(self):
         
         # Get code
@@ -135,16 +174,22 @@ class NodejsRuntime(BaseRuntime):
                               'pathname': p.path.strip('/')})
         code = ('var location = %s;\n' % loc) + code
         
-        # Fix for Windows - by default global modules are searched in wrong place
-        NODE_PATH = b'NODE_PATH' if sys.version_info[0] == 2 else 'NODE_PATH'
-        if sys.platform.startswith('win') and os.getenv(NODE_PATH) is None:
-            os.environ[NODE_PATH] = os.getenv('APPDATA') + '\\npm\\node_modules'
-        elif sys.platform.startswith('linux') and not os.getenv(NODE_PATH):
-            path = os.path.expanduser('/usr/local/lib/node_modules')
-            if os.path.isdir(path):
-                os.environ[NODE_PATH] = path
-        if sys.version_info[0] == 2 and os.getenv(NODE_PATH):  # str lits are uni
-            os.environ[NODE_PATH] = os.environ[NODE_PATH].encode()
+        _fix_node_path()
+        
+        # Run in a process from the pool?
+        pool = self._kwargs.get('pool', None)
+        if pool:
+            self._pool = get_default_pool() if pool is True else pool
+            self._pool_lock = threading.Lock()
+            self._pool_process = self._pool.acquire()
+            self._pool_process.on_exit = self.close
+            try:
+                self._pool_process.run(code)
+            except Exception:
+                self._pool.release(self._pool_process)
+                self._pool_process = None
+                raise
+            return
         
         # Write code to tempfile
         f = tempfile.NamedTemporaryFile('wt', prefix='flexx_nodejs_', suffix='.js')
@@ -155,3 +200,310 @@ class NodejsRuntime(BaseRuntime):
         # Launch
         cmd = [get_node_exe(), f.name]
         self._start_subprocess(cmd)
+
+
+## Pool
+
+
+# The script that runs in a pooled nodejs process. It reads commands
+# (JSON, one per line) from stdin. Code is run in a fresh context, which
+# mimics the globals of a normal nodejs script. The timers and exit
+# handlers that the code registers are tracked, so that the context can
+# be cleaned up on reset. Replies are written to stdout, prefixed with
+# "FLEXX-POOL"; other output is logged as usual.
+POOL_JS = """
+var vm = require('vm');
+var readline = require('readline');
+
+var sandbox = null;
+var EXIT = {};  // thrown by process.exit() to stop the code, like a real exit
+
+function reply(msg) {
+    process.stdout.write('FLEXX-POOL ' + msg + '\\n');
+}
+
+function create_sandbox() {
+    var sb, timers = new Set(), handlers = [];
+    var fake_process = {
+        env: process.env, argv: process.argv, platform: process.platform,
+        version: process.version, versions: process.versions, pid: process.pid,
+        stdout: process.stdout, stderr: process.stderr,
+        cwd: process.cwd.bind(process), hrtime: process.hrtime,
+        nextTick: process.nextTick, memoryUsage: process.memoryUsage,
+        on: function (name, func) {
+            if (name == 'exit' || name == 'SIGINT') { handlers.push(func); }
+            return fake_process;
+        },
+        exit: function () {
+            if (sandbox === sb) { reset(); reply('exited'); }
+            throw EXIT;
+        }
+    };
+    var ctx = {console: console, require: require, process: fake_process,
+               module: {exports: {}}, Buffer: Buffer,
+               clearTimeout: clearTimeout, clearInterval: clearInterval};
+    ctx.setTimeout = function (func, ms) {
+        var args = Array.prototype.slice.call(arguments, 2);
+        var t = setTimeout(function () {
+            timers.delete(t);
+            func.apply(null, args);
+        }, ms);
+        timers.add(t);
+        return t;
+    };
+    ctx.setInterval = function () {
+        var t = setInterval.apply(null, arguments);
+        timers.add(t);
+        return t;
+    };
+    ctx.exports = ctx.module.exports;
+    ctx.global = ctx.root = ctx;
+    vm.createContext(ctx);
+    sb = {ctx: ctx, timers: timers, handlers: handlers};
+    return sb;
+}
+
+function reset() {
+    if (sandbox === null) { return; }
+    var sb = sandbox;
+    sandbox = null;
+    sb.handlers.forEach(function (func) {
+        try { func(); } catch (err) {
+            if (err !== EXIT) { console.log('Error on exit: ' + err); }
+        }
+    });
+    sb.timers.forEach(function (t) { clearTimeout(t); });
+}
+
+process.on('uncaughtException', function (err) {
+    if (err === EXIT) { return; }
+    console.log('Uncaught error: ' + (err && err.stack || err));
+});
+
+readline.createInterface({input: process.stdin}).on('line', function (line) {
+    var cmd = JSON.parse(line);
+    if (cmd.cmd == 'ping') {
+        reply('pong');
+    } else if (cmd.cmd == 'reset') {
+        reset();
+        reply('reset');
+    } else if (cmd.cmd == 'run') {
+        reset();
+        sandbox = create_sandbox();
+        try {
+            vm.runInContext(cmd.code, sandbox.ctx, {filename: 'flexx_app.js'});
+            reply('ok');
+        } catch (err) {
+            if (err === EXIT) { reply('ok'); return; }
+            reply('error ' + JSON.stringify(String(err && err.stack || err)));
+        }
+    }
+}).on('close', function () {
+    reset();
+    process.exit();
+});
+"""
+
+
+class NodejsProcess:
+    """ A nodejs process that can run code for multiple launches, one
+    after the other. Used by the NodejsPool.
+    """
+    
+    def __init__(self):
+        _fix_node_path()
+        self.uses = 0
+        self.on_exit = None  # called (in a thread) when the code calls process.exit()
+        self._replies = queue.Queue()
+        self._lock = threading.Lock()
+        try:
+            self._proc = subprocess.Popen([get_node_exe(), '-e', POOL_JS],
+                                          stdin=subprocess.PIPE,
+                                          stdout=subprocess.PIPE,
+                                          stderr=subprocess.STDOUT)
+        except OSError as err:  # pragma: no cover
+            raise RuntimeError('Could not start nodejs:\n%s' % str(err))
+        self._reader = threading.Thread(target=self._read)
+        self._reader.setDaemon(True)
+        self._reader.start()
+    
+    def __repr__(self):
+        return '<NodejsProcess %i with %i uses at 0x%x>' % (self._proc.pid,
+                                                            self.uses, id(self))
+    
+    def _read(self):
+        for line in iter(self._proc.stdout.readline, b''):
+            msg = line.decode('utf-8', 'ignore').rstrip()
+            if msg == 'FLEXX-POOL exited':
+                if self.on_exit is not None:
+                    # Not in this thread, because we must keep reading replies
+                    t = threading.Thread(target=self.on_exit)
+                    t.setDaemon(True)
+                    t.start()
+            elif msg.startswith('FLEXX-POOL '):
+                self._replies.put(msg[11:])
+            elif msg:
+                logging.debug('webruntime: ' + msg)
+        self._replies.put(None)  # process is dead
+    
+    def _command(self, timeout, cmd, **kwargs):
+        """ Send a command and wait for the reply. Returns None if the
+        process did not respond (in time).
+        """
+        kwargs['cmd'] = cmd
+        with self._lock:
+            try:
+                self._proc.stdin.write(json.dumps(kwargs).encode() + b'\n')
+                self._proc.stdin.flush()
+                return self._replies.get(True, timeout)
+            except (OSError, IOError, ValueError, queue.Empty):
+                return None
+    
+    def is_alive(self):
+        """ Get whether the process is running.
+        """
+        return self._proc.poll() is None
+    
+    def ping(self, timeout=5.0):
+        """ Get whether the process is running and responsive.
+        """
+        return self.is_alive() and self._command(timeout, 'ping') == 'pong'
+    
+    def run(self, code, timeout=5.0):
+        """ Run the given code in a fresh context.
+        """
+        self.uses += 1
+        reply = self._command(timeout, 'run', code=code)
+        if reply is None:
+            raise RuntimeError('Nodejs process did not respond.')
+        elif reply.startswith('error '):
+            raise RuntimeError('Error in nodejs code:\n' + json.loads(reply[6:]))
+    
+    def reset(self, timeout=5.0):
+        """ Clean up after the code that was run, i.e. call exit
+        handlers and clear timers. Returns whether this succeeded.
+        """
+        return self._command(timeout, 'reset') == 'reset'
+    
+    def kill(self):
+        """ Stop the process (and kill it if it does not respond).
+        """
+        if self._proc.poll() is None:
+            try:
+                self._proc.stdin.close()  # makes the process exit
+            except (OSError, IOError):  # pragma: no cover
+                pass
+            try:
+                self._proc.wait(0.25)
+            except subprocess.TimeoutExpired:  # pragma: no cover
+                self._proc.kill()
+                self._proc.wait()
+        self._proc.stdout.close()
+
+
+class NodejsPool:
+    """ A pool of nodejs processes that are started in advance, so that
+    the nodejs runtime can be launched without waiting for nodejs to
+    start. The code for each launch runs in a fresh context; when the
+    runtime is closed, the process is cleaned up and returned to the
+    pool.
+    
+    Use ``launch(url, 'nodejs', code=code, pool=True)`` to use the default
+    pool, or pass a ``NodejsPool`` instance to use a specific pool.
+    
+    Parameters:
+        size (int): the number of processes to keep (both idle and in use).
+            More processes are started when needed. Default 2.
+        max_uses (int): the number of launches after which a process is
+            replaced by a new one. Default 50.
+        timeout (float): the time in seconds to wait for a process to
+            respond. Processes that fail to respond are killed. Default 5.
+    """
+    
+    def __init__(self, size=2, max_uses=50, timeout=5.0):
+        self.size = int(size)
+        self.max_uses = int(max_uses)
+        self.timeout = float(timeout)
+        self._idle = []
+        self._busy = 0
+        self._lock = threading.Lock()
+        _pools.add(self)  # closed at exit, but not kept alive
+        self.fill()
+    
+    def __del__(self):
+        self.close()
+    
+    def __repr__(self):
+        return '<NodejsPool with %i idle processes at 0x%x>' % (len(self._idle),
+                                                                id(self))
+    
+    def fill(self):
+        """ Start processes until the pool has ``size`` processes.
+        """
+        with self._lock:
+            while len(self._idle) + self._busy < self.size:
+                self._idle.append(NodejsProcess())
+    
+    def acquire(self):
+        """ Get a (healthy) process from the pool, or start a new one
+        if there are no idle processes.
+        """
+        while True:
+            with self._lock:
+                process = self._idle.pop(0) if self._idle else None
+            if process is None:
+                process = NodejsProcess()
+                if not process.ping(self.timeout):
+                    process.kill()
+                    raise RuntimeError('Could not start nodejs process.')
+                break
+            elif process.ping(self.timeout):
+                break
+            logging.warn('Removing unresponsive nodejs process from pool.')
+            process.kill()
+        with self._lock:
+            self._busy += 1
+        self.fill()
+        return process
+    
+    def release(self, process):
+        """ Return a process to the pool. It is killed if it has been
+        used too often, if it does not respond, or if the pool is full.
+        """
+        with self._lock:
+            self._busy -= 1
+            keep = len(self._idle) + self._busy < self.size
+        if keep and process.uses < self.max_uses and process.reset(self.timeout):
+            with self._lock:
+                self._idle.append(process)
+        else:
+            process.kill()
+            self.fill()
+    
+    def close(self):
+        """ Kill all idle processes.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self.size = 0
+        for process in idle:
+            process.kill()
+
+
+_pools = weakref.WeakSet()
+
+@atexit.register
+def _close_pools():
+    for pool in list(_pools):
+        pool.close()
+
+
+_default_pool = None
+
+def get_default_pool():
+    """ Get the default NodejsPool, which is created on first use.
+    """
+    global _default_pool
+    if _default_pool is None:
+        _default_pool = NodejsPool()
+    return _default_pool
@@ -10,7 +10,7 @@ import os
 import sys
 import json
 
-from .common import DesktopRuntime, create_temp_app_dir
+from .common import DesktopRuntime, create_temp_app_dir, get_app_template_dir
 
 
 def get_template():
@@ -118,25 +118,33 @@ class NodeWebkitRuntime(DesktopRuntime):
         size = self._kwargs.get('size', (640, 480))
         D['window']['width'], D['window']['height'] = size[0], size[1]
         
+        # Icon and libudef fix are the same for each launch
+        icon = self._kwargs.get('icon')
+        template_path = get_app_template_dir(
+            'nw', icon.content_hash() if icon else '', self._create_template)
+        
         # Icon?
-        if self._kwargs.get('icon'):
-            icon = self._kwargs.get('icon')
-            icon_path = os.path.join(app_path, 'app.png')  # nw can handle ico
-            icon.write(icon_path)
-            smallest = '%i.png' % icon.image_sizes()[0]
-            D['window']['icon'] = icon_path.rsplit('.', 1)[0] + smallest
+        if icon:
+            smallest = 'app%i.png' % icon.image_sizes()[0]
+            D['window']['icon'] = os.path.join(template_path, smallest)
         
         # Write
         with open(os.path.join(app_path, 'package.json'), 'wb') as f:
             f.write(json.dumps(D, indent=4).encode('utf-8'))
         
         # Fix libudef bug
-        fix_libudef(app_path)
         llp = os.getenv('LD_LIBRARY_PATH', '')
         if sys.platform.startswith('linux'):
-            llp = app_path + os.pathsep + llp
+            llp = template_path + os.pathsep + llp
         
         # Launch
         exe = get_nodewebkit_exe() or 'nw'
         cmd = [exe, app_path] 
         self._start_subprocess(cmd, LD_LIBRARY_PATH=llp)
+    
+    def _create_template(self, path):
+        """ Create the files that are the same for each launch.
+        """
+        if self._kwargs.get('icon'):
+            self._kwargs.get('icon').write(os.path.join(path, 'app.png'))
+        fix_libudef(path)
@@ -4,7 +4,7 @@
 import os
 import sys
 
-from .common import DesktopRuntime, create_temp_app_dir
+from .common import DesktopRuntime, get_app_template_dir
 
 # Note that setting icon on Ubuntu (and possibly on other OS-es is broken for PyQt)
 
@@ -71,14 +71,18 @@ class PyQtRuntime(DesktopRuntime):
     
     def _launch(self):
         
-        # Write icon
+        # Write icon (reused between launches)
         iconfile = ''
         self.__class__._app_count += 1
         if self._kwargs.get('icon'):
-            app_path = create_temp_app_dir('qwebkit', str(self.__class__._app_count))
             icon = self._kwargs.get('icon')
-            iconfile = os.path.join(app_path, 'icon.png')
-            icon.write(iconfile)
+            
+            def write_icon(path):
+                icon.write(os.path.join(path, 'icon.png'))
+            
+            app_path = get_app_template_dir('qwebkit', icon.content_hash(),
+                                            write_icon)
+            iconfile = os.path.join(app_path, 'icon%i.png' % icon.image_sizes()[0])
         
         code = CODE_TO_RUN.format(url=self._kwargs['url'],
                                   title=self._kwargs.get('title', 'QWebkit runtime'),
@@ -1,6 +1,8 @@
 
 import os
+import gc
 import time
+import weakref
 import tempfile
 import subprocess
 
@@ -76,6 +78,12 @@ def test_iconize():
     icn = webruntime.common.iconize(fname)
     assert isinstance(icn, icon.Icon)
 
+    # Loading again gives an equal copy from the cache
+    icn2 = webruntime.common.iconize(fname)
+    assert icn2 is not icn
+    assert icn2.content_hash() == icn.content_hash()
+    assert icon.CACHE_DIR and os.path.isdir(icon.CACHE_DIR)
+
     # Load from icon (noop)
     assert webruntime.common.iconize(icn) is icn
 
@@ -83,6 +91,65 @@ def test_iconize():
     raises(ValueError, webruntime.common.iconize, [])
 
 
+def test_app_dirs():
+    common = webruntime.common
+    appdata_dir = common.appdata_dir
+    tempdir = tempfile.mkdtemp()
+    common.appdata_dir = lambda *args: tempdir
+    try:
+        # Temp app dirs are tracked in an index
+        path1 = common.create_temp_app_dir('foo', 'x')
+        path2 = common.create_temp_app_dir('bar')
+        maindir = os.path.dirname(path1)
+        index = common._read_app_index(maindir)
+        assert set(index['dirs']) == set([os.path.basename(path1),
+                                          os.path.basename(path2)])
+
+        # Old dirs with the same prefix are removed, others are left alone
+        index['dirs'][os.path.basename(path1)] -= 100
+        index['dirs'][os.path.basename(path2)] -= 100
+        common._write_app_index(maindir, index)
+        path3 = common.create_temp_app_dir('foo', 'y')
+        assert not os.path.isdir(path1)
+        assert os.path.isdir(path2) and os.path.isdir(path3)
+
+        # Untracked dirs are found when the index is rescanned
+        os.mkdir(os.path.join(maindir, 'foo_1_1'))
+        assert 'foo_1_1' not in common._read_app_index(maindir)['dirs']
+        index = common._read_app_index(maindir)
+        index['scanned'] = 0
+        common._write_app_index(maindir, index)
+        assert 'foo_1_1' in common._read_app_index(maindir)['dirs']
+
+        # Templates are created once, and then reused
+        created = []
+
+        def create(path):
+            created.append(path)
+            with open(os.path.join(path, 'x.txt'), 'wb') as f:
+                f.write(b'x')
+
+        t1 = common.get_app_template_dir('spam', 'a', create)
+        t2 = common.get_app_template_dir('spam', 'a', create)
+        t3 = common.get_app_template_dir('spam', 'b', create)
+        assert t1 == t2 and t1 != t3
+        assert len(created) == 2
+        assert os.path.isfile(os.path.join(t1, 'x.txt'))
+
+        # Incomplete templates are not left behind
+        def fail(path):
+            raise ValueError()
+        raises(ValueError, common.get_app_template_dir, 'spam', 'c', fail)
+        assert len(os.listdir(os.path.dirname(t1))) == 3  # 2 dirs + index
+
+        # Least recently used templates are removed
+        for i in range(common.MAX_APP_TEMPLATES):
+            common.get_app_template_dir('spam', str(i), create)
+        assert not os.path.isdir(t1)
+    finally:
+        common.appdata_dir = appdata_dir
+
+
 ## Runtimes
 
 
@@ -122,6 +189,84 @@ def test_nodejs():
     p.close()
 
 
+def test_nodejs_pool():
+    from flexx.webruntime.nodejs import NodejsPool
+    tempdir = tempfile.mkdtemp()
+    pool = NodejsPool(2, max_uses=3)
+
+    def read(fname):
+        fname = os.path.join(tempdir, fname)
+        for i in range(500):
+            if os.path.isfile(fname):
+                break
+            time.sleep(0.01)
+        with open(fname, 'rb') as f:
+            return f.read().decode()
+
+    # Code runs in a process from the pool, in a fresh context
+    code = ('var fs = require("fs"), p = %r;\n' % tempdir +
+            'fs.writeFileSync(p + "/a" + location.pathname, typeof foo);\n'
+            'var foo = 3;  setInterval(function () {}, 1000);\n'
+            'process.on("exit", function () { fs.writeFileSync(p + "/b", "x"); });\n')
+    p = launch('http://localhost:8000/x1', 'nodejs', code=code, pool=pool)
+    assert p._proc is None
+    process = p._pool_process
+    assert read('ax1') == 'undefined'
+    assert not os.path.isfile(os.path.join(tempdir, 'b'))
+    p.close()
+    assert read('b') == 'x'  # exit handlers are called
+    p = launch('http://localhost:8000/x2', 'nodejs', code=code, pool=pool)
+    assert read('ax2') == 'undefined'  # foo did not leak
+    p.close()
+    p.close()  # should do no harm
+
+    # Processes are reused, but not too often
+    processes = []
+    for i in range(6):
+        p = launch('http://localhost:8000/y', 'nodejs', code='1;', pool=pool)
+        processes.append(p._pool_process)
+        p.close()
+    assert process in processes
+    assert max([processes.count(pr) for pr in processes]) <= 3
+    assert len(set(processes)) < 6
+
+    # When the code exits, the runtime is closed and the process released
+    code = ('var fs = require("fs"), p = %r;\n' % tempdir +
+            'process.exit(); fs.writeFileSync(p + "/c", "x");\n')
+    p = launch('http://localhost:8000/y', 'nodejs', code=code, pool=pool)
+    for i in range(500):
+        if len(pool._idle) == 2 and pool._busy == 0:
+            break
+        time.sleep(0.01)
+    assert p._pool_process is None
+    assert len(pool._idle) == 2 and pool._busy == 0
+    assert not os.path.isfile(os.path.join(tempdir, 'c'))  # code stopped at exit
+
+    # Dead processes are replaced
+    for pr in pool._idle:
+        pr._proc.kill()
+        pr._proc.wait()
+    p = launch('http://localhost:8000/y', 'nodejs', code='1;', pool=pool)
+    assert p._pool_process.is_alive()
+    p.close()
+
+    # Errors
+    raises(RuntimeError, launch, 'http://localhost:8000/y', 'nodejs',
+           code='throw "oops";', pool=pool)
+    assert len(pool._idle) == 2 and pool._busy == 0
+    pool.close()
+    assert not pool._idle
+    
+    # Pools are not kept alive, their processes are killed when collected
+    pool = NodejsPool(1)
+    process = pool._idle[0]
+    ref = weakref.ref(pool)
+    del pool
+    gc.collect()
+    assert ref() is None
+    assert not process.is_alive()
+
+
 def test_browser():
     p = launch(URL, 'browser')
     assert p._proc is None
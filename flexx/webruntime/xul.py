@@ -22,8 +22,10 @@ mimics the entire runtime via symlinks.
 Xul wants a specific directory structure with a few files that define
 the app. We write this on the fly to appdata/flexx/temp_apps. We create
 a new app for each time we launch an application. We also take good
-care to clean up the old ones. On Linux and OSX the runtime app
-(symlink) is also stored in this directory.
+care to clean up the old ones. The files that do not change between
+launches (the icons, and on Linux and OSX the runtime app/symlink) are
+stored in a template dir in appdata/flexx/app_templates, which is
+reused for launches with the same title, icon and runtime.
 
 """
 
@@ -36,6 +38,7 @@ import subprocess
 import os.path as op
 
 from .common import DesktopRuntime, create_temp_app_dir, appdata_dir
+from .common import get_app_template_dir
 
 # todo: title should change with title of web page?
 # todo: enable setting position/size at runtime?
@@ -230,6 +233,15 @@ def copy_xul_runtime(dir1, dir2):
         raise
 
 
+def _link_or_copy(filename1, filename2):
+    """ Hard-link a file, or copy it if that is not possible.
+    """
+    try:
+        os.link(filename1, filename2)
+    except (AttributeError, OSError):  # no os.link on Windows with legacy py
+        shutil.copy2(filename1, filename2)
+
+
 class XulRuntime(DesktopRuntime):
     """ Desktop runtime based on Mozilla's XUL framework. Xul is
     available wherever Firefox is installed, and uses same engine (Gecko).
@@ -262,17 +274,27 @@ class XulRuntime(DesktopRuntime):
         # More preparing
         self._kwargs['title'] = self._kwargs.get('title', 'XUL runtime')
 
-        # Create files for app
-        self._create_xul_app(app_path, id, windowfeatures=windowfeatures,
-                             **self._kwargs)
-
         # Get executable for xul runtime (may be None)
         xul_exe = self._get_xul_runtime()
+        if not (xul_exe and op.isfile(op.realpath(xul_exe))):
+            xul_exe = None
+
+        # Get the files that are the same for each launch
+        icon = self._kwargs.get('icon')
+        key = '\n'.join([self._kwargs['title'],
+                         icon.content_hash() if icon else '',
+                         op.realpath(xul_exe) if xul_exe else ''])
+        template_path = get_app_template_dir(
+            'xul', key, lambda path: self._create_xul_template(path, xul_exe))
+
+        # Create files for app
+        self._create_xul_app(app_path, id, template_path,
+                             windowfeatures=windowfeatures, **self._kwargs)
 
         # Get the command to execute
         exe = None
-        if xul_exe and op.isfile(op.realpath(xul_exe)):
-            exe = self._get_app_exe(xul_exe, app_path)
+        if xul_exe:
+            exe = self._get_app_exe(xul_exe, template_path)
         else:
             # See if we can use firefox command, Firefox may be
             # available even though we failed to find it.
@@ -298,7 +320,22 @@ class XulRuntime(DesktopRuntime):
             logging.warn("Using Flexx' Xul runtime and Qt (PySide/PyQt4/PyQt5) "
                          "together may cause problems.")
 
-    def _create_xul_app(self, path, id, **kwargs):
+    def _create_xul_template(self, path, xul_exe):
+        """ Create the files that are the same for each launch of an app
+        with a certain title and icon.
+        """
+        # Icon - use Icon class to write a png (Unix) and an ico (Windows)
+        # The launch function ensures that there always is an icon
+        if self._kwargs.get('icon'):
+            icon = self._kwargs.get('icon')
+            os.mkdir(op.join(path, 'icons'))
+            icon.write(op.join(path, 'icons', 'app.ico'))
+            icon.write(op.join(path, 'icons', 'app.png'))
+        # Executable
+        if xul_exe:
+            self._get_app_exe(xul_exe, path)
+
+    def _create_xul_app(self, path, id, template_path, **kwargs):
         """ Create the files that determine the XUL app to launch.
         """
 
@@ -351,13 +388,14 @@ class XulRuntime(DesktopRuntime):
             with open(op.join(path, fname), 'wb') as f:
                 f.write(text.encode())
 
-        # Icon - use Icon class to write a png (Unix) and an ico (Windows)
-        # The launch function ensures that there always is an icon
-        if kwargs.get('icon'):
-            icon = kwargs.get('icon')
-            icon_name = op.join(path, 'chrome/icons/default/' + D['windowid'])
-            icon.write(icon_name + '.ico')
-            icon.write(icon_name + '.png')
+        # Icons, linked from the template
+        icondir = op.join(template_path, 'icons')
+        if op.isdir(icondir):
+            for fname in sorted(os.listdir(icondir)):
+                ext = fname.split('app', 1)[-1]
+                _link_or_copy(op.join(icondir, fname),
+                              op.join(path, 'chrome/icons/default',
+                                      D['windowid'] + ext))
 
     def _get_xul_runtime(self):
         """ Get path to executable of a xul runtime. The returned path
@@ -448,7 +486,7 @@ class XulRuntime(DesktopRuntime):
         correct exe_name.
 
         * xul_exe: the location of the xul executbale (can be a symlink)
-        * app_path: the location of the xul app (the application.ini etc.)
+        * app_path: the location to store the app exe in (the template dir)
 
         """
 
@@ -459,7 +497,8 @@ class XulRuntime(DesktopRuntime):
             # seem the same thing in osx.
             exe = op.join(app_path, 'xulrunner.app')
             title = self._kwargs['title']
-            self._osx_create_app(op.realpath(xul_exe), exe, title)
+            if not op.isdir(exe):
+                self._osx_create_app(op.realpath(xul_exe), exe, title)
             exe += '/Contents/MacOS/xulrunner'
         else:
             # Define process name, so that our window is not grouped with